@@ -4,8 +4,7 @@ from functools import reduce
 from apps.core.models import Table, Snapshot
 from apps.core.types import Validation
 
-from utils.extraction import calculate_single_column_stats
-from utils.parsing import parse_type
+from utils.parsing import Parser, get_table_parser, parse_type
 
 
 __ACTIONS: Dict[str, Type] = {}
@@ -50,6 +49,7 @@ class BaseAction:
     1. validate(params_list, table): Basic validation is already implemented
     2. apply_table(table): Apply the action to table and return new snapshot
     2. apply_row(row_dict): Apply the action to row dict and return new dict
+    3. apply_rows(rows): Same as apply_row but for all the rows at once
     """
 
     NAME = ""
@@ -60,6 +60,11 @@ class BaseAction:
         self.params = params
         self.table = table
 
+    @property
+    def parser(self) -> Parser:
+        """Parser for the values of the table, as per its properties"""
+        return get_table_parser(self.table.properties or {})
+
     @classmethod
     def compose(cls, actions: List["BaseAction"]) -> Type["BaseAction"]:
         class ComposedAction(BaseAction):
@@ -80,6 +85,13 @@ class BaseAction:
                     row,
                 )
 
+            def apply_rows(self, rows: List[dict]) -> List[dict]:
+                return reduce(
+                    lambda new_rows, action: action.apply_rows(new_rows),
+                    actions,
+                    rows,
+                )
+
             def apply_columns(self, columns):
                 new_cols, affected_cols = columns, []
                 for act in actions:
@@ -152,11 +164,18 @@ class BaseAction:
         if snapshot is None:
             raise Exception("Calling run_action() when table has no snapshot")
 
-        new_rows = [self.apply_row(x) for x in snapshot.data_rows or []]
+        new_rows = self.apply_rows(snapshot.data_rows or [])
+        new_columns, column_stats = self.get_column_stats(snapshot)
+        return snapshot, new_rows, new_columns, column_stats
 
+    def get_column_stats(self, snapshot: Snapshot) -> Tuple[List[dict], List[dict]]:
+        """
+        New columns and their stats, which are the stats in the snapshot for
+        the columns the action does not affect. Affected columns have only
+        their key, label and type, their stats are calculated when asked for.
+        See Table.get_column_stats().
+        """
         new_columns, affected_column_ids = self.apply_columns(snapshot.data_columns)
-
-        # Only calculate stats for the affected columns
         column_stats = [
             next(
                 col_stat
@@ -164,22 +183,22 @@ class BaseAction:
                 if col_stat["key"] == col["key"]
             )
             if col["key"] not in affected_column_ids
-            else {
-                "type": col["type"],
-                "key": col["key"],
-                "label": col["label"],
-                **calculate_single_column_stats(
-                    [x[col["key"]] for x in new_rows], col["type"]
-                ),
-            }
+            else {"type": col["type"], "key": col["key"], "label": col["label"]}
             for col in new_columns
         ]
-        return snapshot, new_rows, new_columns, column_stats
+        return new_columns, column_stats
 
     def apply_row(self, row: dict):
         """Apply the action to single table row. Results in new set of table row."""
         raise MethodNotImplemented
 
+    def apply_rows(self, rows: List[dict]) -> List[dict]:
+        """
+        Apply the action to all the table rows. Actions which can process a
+        whole column at once should override this.
+        """
+        return [self.apply_row(x) for x in rows]
+
     def apply_columns(self, cols: List[dict]) -> Tuple[List[dict], List[str]]:
         """Get new columns and affected column keys as tuples: (new_cols, affected_col_ids)"""
         raise MethodNotImplemented
@@ -3,8 +3,8 @@ from typing import List, Tuple
 from .base import register_action, BaseAction
 from apps.core.types import Validation
 from apps.core.models import Table
+from apps.file.models import File
 from utils.common import ColumnTypes
-from utils.parsing import parse
 
 
 @register_action
@@ -27,6 +27,14 @@ class CastColumnAction(BaseAction):
             return False, f"Invalid target type '{target_type}'"
         return True, None
 
+    @property
+    def excel_serials(self) -> bool:
+        """Numbers cast to dates are Excel serial dates in tables of excel files"""
+        dataset = self.table.dataset
+        return bool(
+            dataset and dataset.file and dataset.file.file_type == File.Type.EXCEL
+        )
+
     def apply_columns(self, columns: List[dict]) -> Tuple[List[dict], List[str]]:
         col_key, target_type = self.params
         affected_col_keys = [col_key]
@@ -44,4 +52,16 @@ class CastColumnAction(BaseAction):
             col_id,
             target_type,
         ) = self.params  # parameters validation already happens in base class
-        return {**row, col_id: parse(row[col_id], target_type)}
+        return {
+            **row,
+            col_id: self.parser.parse(row[col_id], target_type, self.excel_serials),
+        }
+
+    def apply_rows(self, rows: List[dict]) -> List[dict]:
+        if not self.is_valid:
+            raise Exception("Calling apply_rows() when is_valid is False")
+        col_id, target_type = self.params
+        parsed, _ = self.parser.parse_many(
+            [row[col_id] for row in rows], target_type, self.excel_serials
+        )
+        return [{**row, col_id: val} for row, val in zip(rows, parsed.tolist())]
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import time
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from apps.core.validators import get_default_table_properties
+from utils.extraction import extract_data_from_excel, extract_preview_data
+from utils.hashing import get_content_digest
+from utils.readers import ExcelSession, clear_content_hashes
+
+
+def generate_workbook(path: str, rows: int, columns: int):
+    rng = np.random.default_rng(0)
+    data = {}
+    for i in range(columns):
+        if i % 3 == 0:
+            data[f"int_{i}"] = rng.integers(0, 1000000, rows)
+        elif i % 3 == 1:
+            data[f"float_{i}"] = rng.random(rows) * 1000
+        else:
+            data[f"str_{i}"] = [f"value {x}" for x in rng.integers(0, 1000, rows)]
+    pd.DataFrame(data).to_excel(path, index=False)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the time taken to extract a preview through pd.ExcelFile with"
+        " the time taken through an ExcelSession, which reads only the top rows"
+        " and does not hash the file, along with the time hashing it takes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file", help="xlsx file, a workbook is generated if absent"
+        )
+        parser.add_argument("--rows", type=int, default=50000)
+        parser.add_argument("--columns", type=int, default=12)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        props = get_default_table_properties()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = options["file"]
+            if path is None:
+                path = os.path.join(tmpdir, "benchmark.xlsx")
+                self.stdout.write(
+                    f"Generating workbook of {options['rows']} rows and"
+                    f" {options['columns']} columns..."
+                )
+                generate_workbook(path, options["rows"], options["columns"])
+
+            def pandas_preview():
+                xl = pd.ExcelFile(path)
+                extract_data_from_excel(xl, xl.sheet_names[0], props, is_preview=True)
+
+            def session_preview():
+                # As for a file without a stored content hash, seen for the
+                # first time by the process
+                clear_content_hashes()
+                with ExcelSession(path) as session:
+                    extract_preview_data(session, session.sheet_names[0], props)
+
+            def content_hash():
+                with open(path, "rb") as f:
+                    get_content_digest(f)
+
+            # Persisted raw rows would skip reading the file
+            with override_settings(MEDIA_ROOT=tmpdir):
+                for name, func in [
+                    ("pd.ExcelFile", pandas_preview),
+                    ("ExcelSession", session_preview),
+                    ("Content hash", content_hash),
+                ]:
+                    timings = self.time(func, options["repeat"])
+                    self.stdout.write(
+                        f"{name}: best {min(timings):.3f}s,"
+                        f" runs {', '.join(f'{t:.3f}s' for t in timings)}"
+                    )
+
+    def time(self, func: Callable, repeat: int) -> List[float]:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return timings
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.7 on 2026-10-17 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0010_alter_table_preview_data"),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name="snapshot",
+            old_name="data_rows",
+            new_name="legacy_data_rows",
+        ),
+        migrations.AlterField(
+            model_name="snapshot",
+            name="legacy_data_rows",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="snapshot",
+            name="data_file",
+            field=models.FileField(
+                blank=True, max_length=255, null=True, upload_to="snapshots/"
+            ),
+        ),
+    ]
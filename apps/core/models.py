@@ -1,13 +1,22 @@
 import copy
-from typing import Optional
-
-from django.db import models
+import tempfile
+import time
+from typing import Any, BinaryIO, Dict, List, Optional, Sequence
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.contrib.postgres.fields import ArrayField
 from django.utils.translation import gettext_lazy as _
 from django.utils.functional import cached_property
 
 from dive.base_models import BaseModel, NamedModelMixin
 from apps.file.models import File
+from utils.columnar import ColumnarReader, write_rows
+from utils.extraction import calculate_column_stats, read_extracted_rows
+from utils.stats import get_approximate_stats_after
 from .validators import (
     validate_table_properties,
     get_default_table_properties,
@@ -104,6 +113,12 @@ class Table(BaseModel, NamedModelMixin):
     def last_snapshot(self) -> Optional["Snapshot"]:
         return self.snapshot_set.order_by("-created_at").first()
 
+    @property
+    def rows_count(self) -> int:
+        """Number of rows, which actions do not change, without reading them"""
+        snapshot = self.last_snapshot
+        return 0 if snapshot is None else snapshot.rows_count
+
     @property
     def data_rows(self):
         """
@@ -124,9 +139,7 @@ class Table(BaseModel, NamedModelMixin):
             composed_action = get_composed_action_for_action_object(
                 self.last_unapplied_action
             )
-            return [
-                composed_action.apply_row(row) for row in self.last_snapshot.data_rows
-            ]
+            return composed_action.apply_rows(self.last_snapshot.data_rows)
         else:
             return self.last_snapshot.data_rows
 
@@ -147,7 +160,8 @@ class Table(BaseModel, NamedModelMixin):
     @property
     def data_column_stats(self):
         """If there is unapplied action, return column stats from the action
-        else return stats from the snapshot
+        else return stats from the snapshot. Columns whose stats are not asked
+        for yet have only their key, label and type, see get_column_stats().
         """
         if self.last_snapshot is None:
             return []
@@ -155,6 +169,88 @@ class Table(BaseModel, NamedModelMixin):
             return self.last_unapplied_action.table_column_stats
         return self.last_snapshot.column_stats
 
+    def get_column_stats(
+        self, keys: Optional[List[str]] = None, calculate: bool = True
+    ) -> List[dict]:
+        """
+        Stats of the columns with the given keys, or of all the columns. Stats
+        of a column are calculated the first time they are asked for and saved
+        in the last unapplied action, or the last snapshot if there is none,
+        so that they are calculated once for each snapshot and action. Without
+        calculate, columns not calculated yet have only their key, label and
+        type.
+        """
+        snapshot = self.last_snapshot
+        if snapshot is None:
+            return []
+        owner, field = self.get_column_stats_owner()
+        stats = [x for x in getattr(owner, field) if keys is None or x["key"] in keys]
+        pending = [
+            {"key": x["key"], "label": x["label"], "type": x["type"]}
+            for x in stats
+            if not has_column_stats(x)
+        ]
+        if not pending or not calculate:
+            return stats
+
+        # Only the pending columns are read unless actions need all of them
+        rows = (
+            self.data_rows
+            if field == "table_column_stats"
+            else snapshot.read_rows([x["key"] for x in pending])
+        )
+        calculated = {
+            x["key"]: x
+            for x in calculate_column_stats(
+                rows,
+                pending,
+                get_approximate_stats_after(self.properties or {}),
+            )
+        }
+        with transaction.atomic():
+            # Other columns may have been calculated meanwhile
+            owner = type(owner).objects.select_for_update().get(pk=owner.pk)
+            setattr(
+                owner,
+                field,
+                [calculated.get(x["key"], x) for x in getattr(owner, field)],
+            )
+            owner.save(update_fields=[field])
+        return [calculated.get(x["key"], x) for x in stats]
+
+    def get_column_stats_owner(self):
+        """(object, field) the column stats are saved in, see get_column_stats()"""
+        action = self.last_unapplied_action
+        if action is not None:
+            return action, "table_column_stats"
+        return self.last_snapshot, "column_stats"
+
+    def mark_column_stats_calculating(self, keys: List[str]) -> List[str]:
+        """
+        Mark the columns with the given keys, whose stats are not calculated,
+        as being calculated and return their keys. Columns marked less than
+        STATS_CALCULATING_TIMEOUT seconds ago are left out, as their stats are
+        still being calculated.
+        """
+        owner, field = self.get_column_stats_owner()
+        if owner is None:
+            return []
+        now = time.time()
+        marked = []
+        with transaction.atomic():
+            owner = type(owner).objects.select_for_update().get(pk=owner.pk)
+            stats = getattr(owner, field)
+            for x in stats:
+                if x["key"] not in keys or has_column_stats(x):
+                    continue
+                since = x.get("calculating_since")
+                if since is None or now - since >= settings.STATS_CALCULATING_TIMEOUT:
+                    x["calculating_since"] = now
+                    marked.append(x["key"])
+            if marked:
+                owner.save(update_fields=[field])
+        return marked
+
     @cached_property
     def source_type(self):
         return self.dataset.file.file_type
@@ -164,17 +260,122 @@ class Table(BaseModel, NamedModelMixin):
         return super().save(*args, **kwargs)
 
 
+def has_column_stats(column_stats: dict) -> bool:
+    """Whether the stats of a column are calculated, or it is just the column"""
+    return "total_count" in column_stats
+
+
 class Snapshot(BaseModel):
     table = models.ForeignKey(Table, on_delete=models.CASCADE)
     version = models.PositiveIntegerField()
+    # Rows of the snapshots saved before data_file, see data_rows
+    legacy_data_rows = models.JSONField(null=True, blank=True)
+    # Rows in the columnar format of utils.columnar. Snapshots copied from
+    # another share its file.
+    data_file = models.FileField(
+        max_length=255, upload_to="snapshots/", null=True, blank=True
+    )
     # TODO: validation and types for json fields
-    data_rows = models.JSONField()
     data_columns = models.JSONField()
+    # Stats of the columns whose stats were asked for and the key, label and
+    # type of the rest, see Table.get_column_stats()
     column_stats = models.JSONField(default=list)
 
+    def __init__(self, *args, **kwargs):
+        self._data_rows: Optional[List[Dict[str, Any]]] = None
+        self._has_unsaved_rows = False
+        super().__init__(*args, **kwargs)
+
     def __str__(self):
         return f"{self.table.original_name} - {self.version}"
 
+    @property
+    def data_rows(self) -> List[Dict[str, Any]]:
+        """All the rows, which are written to data_file on save()"""
+        if self._data_rows is None:
+            self._data_rows = self.read_rows()
+        return self._data_rows
+
+    @data_rows.setter
+    def data_rows(self, rows: List[Dict[str, Any]]):
+        self._data_rows = rows
+        self._has_unsaved_rows = True
+
+    @property
+    def rows_count(self) -> int:
+        """Number of rows, which is read from the footer of data_file"""
+        if self._data_rows is not None:
+            return len(self._data_rows)
+        if not self.data_file:
+            return len(self.legacy_data_rows or [])
+        with self.data_file.open("rb") as f:
+            return ColumnarReader(f).num_rows
+
+    def read_rows(
+        self,
+        keys: Optional[Sequence[str]] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Rows from start to stop having only the given keys if any, without
+        reading the rest of the rows from data_file
+        """
+        if self._has_unsaved_rows or not self.data_file:
+            rows = (
+                self._data_rows if self._has_unsaved_rows else self.legacy_data_rows
+            ) or []
+            if keys is None:
+                return rows[start:stop]
+            return [{key: row[key] for key in keys} for row in rows[start:stop]]
+        with self.data_file.open("rb") as f:
+            return read_extracted_rows(ColumnarReader(f), keys, start, stop)
+
+    def save(self, *args, **kwargs):
+        replaced_file = None
+        if self._has_unsaved_rows:
+            replaced_file = self.data_file.name
+            with tempfile.TemporaryFile() as f:
+                write_rows(self._data_rows or [], f)
+                self.set_data_file(f)
+        result = super().save(*args, **kwargs)
+        if replaced_file:
+            delete_unused_data_file(self.data_file.storage, replaced_file)
+        return result
+
+    def set_data_file(self, f: BinaryIO):
+        """
+        Store the rows written to f by a ColumnarWriter as data_file, for rows
+        which were not in memory as data_rows. Saved along with the snapshot.
+        """
+        f.seek(0)
+        self.data_file.save(
+            f"table_{self.table_id}_v{self.version}.cols", DjangoFile(f), save=False
+        )
+        self.legacy_data_rows = None
+        self._data_rows = None
+        self._has_unsaved_rows = False
+
+
+def delete_unused_data_file(storage, name: str):
+    """
+    Delete a data_file of snapshots once the transaction is committed, unless
+    another snapshot still has it, as snapshots copied from another share its
+    file.
+    """
+
+    def delete():
+        if not Snapshot.objects.filter(data_file=name).exists():
+            storage.delete(name)
+
+    transaction.on_commit(delete)
+
+
+@receiver(post_delete, sender=Snapshot)
+def delete_snapshot_data_file(sender, instance: Snapshot, **kwargs):
+    if instance.data_file:
+        delete_unused_data_file(instance.data_file.storage, instance.data_file.name)
+
 
 class Action(BaseModel, NamedModelMixin):
     """
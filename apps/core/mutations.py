@@ -1,6 +1,7 @@
 from typing import Any
 
 from django.db import transaction
+from django.utils.translation import gettext
 import graphene
 from graphene.types.generic import GenericScalar
 from graphene_file_upload.scalars import Upload
@@ -19,13 +20,18 @@ from apps.core.schema import DatasetType, TableType
 from apps.core.actions.base import get_all_action_names
 from apps.core.actions.utils import parse_raw_action
 from apps.file.serializers import FileSerializer, File
-from apps.core.utils import create_dataset_and_tables, perform_hash_join_
+from apps.core.utils import create_dataset, perform_hash_join_
 
 from utils.decorators import lift_mutate_with_instance
 from .serializers import TablePropertiesSerializer, TableJoinSeralizer
 from .models import Table, Action, Join
 from .utils import apply_table_properties_and_extract_preview
-from .tasks import extract_table_data, calculate_column_stats_for_action, perform_join
+from .tasks import (
+    extract_dataset_tables,
+    extract_table_data,
+    calculate_column_stats_for_action,
+    perform_join,
+)
 from .schema import KeyLabelType
 
 
@@ -44,7 +50,9 @@ class RowsColumnsType(graphene.ObjectType):
 
 
 class CreateDatasetInputType(graphene.InputObjectType):
-    file = Upload(required=True)
+    file = Upload()
+    # A file uploaded in chunks, see apps.file.mutations
+    file_id = graphene.ID()
 
 
 class CreateDataset(graphene.Mutation):
@@ -57,13 +65,24 @@ class CreateDataset(graphene.Mutation):
 
     @staticmethod
     def mutate(root, info, data):
-        serializer = FileSerializer(
-            data=data, context={"request": info.context.request}
-        )
-        if errors := mutation_is_not_valid(serializer):
-            return CreateDataset(errors=errors, ok=False)
-        file_obj: File = serializer.save()
-        dataset = create_dataset_and_tables(file_obj)
+        if data.get("file_id") is not None:
+            file_obj = File.objects.filter(id=data["file_id"]).first()
+            if file_obj is None:
+                return DiveMutationMixin(
+                    errors=[
+                        dict(field="fileId", messages=gettext("File does not exist."))
+                    ]
+                )
+        else:
+            serializer = FileSerializer(
+                data=data, context={"request": info.context.request}
+            )
+            if errors := mutation_is_not_valid(serializer):
+                return CreateDataset(errors=errors, ok=False)
+            file_obj = serializer.save()
+        dataset = create_dataset(file_obj)
+        # Tables are discovered and their previews extracted in background
+        transaction.on_commit(lambda: extract_dataset_tables.delay(dataset.id))
         return CreateDataset(result=dataset, errors=None, ok=True)
 
 
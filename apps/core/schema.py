@@ -16,6 +16,7 @@ from apps.core.models import (
     Join,
 )
 from apps.core.filter_set import DatasetFilter, TableFilter
+from apps.core.tasks import get_table_column_stats
 from dive.consts import (
     TABLE_HEADER_LEVELS,
     LANGUAGES,
@@ -34,6 +35,7 @@ class TablePropertiesType(graphene.ObjectType):
     language = graphene.String()
     trim_whitespaces = graphene.Boolean()
     treat_these_as_na = graphene.String()
+    approximate_stats_after = graphene.Int()
 
     @staticmethod
     def resolve_header_level(root, info, **kwargs):
@@ -55,6 +57,22 @@ class TablePropertiesType(graphene.ObjectType):
     def resolve_treat_these_as_na(root, info, **kwargs):
         return root.get("treatTheseAsNa")
 
+    @staticmethod
+    def resolve_approximate_stats_after(root, info, **kwargs):
+        return root.get("approximateStatsAfter")
+
+
+class HistogramBinType(graphene.ObjectType):
+    # Numbers, or iso datetimes for dates and datetimes
+    start = GenericScalar(required=True)
+    end = GenericScalar(required=True)
+    count = graphene.Int(required=True)
+
+
+class ValueCountType(graphene.ObjectType):
+    value = graphene.String(required=True)
+    count = graphene.Int(required=True)
+
 
 class TableColumnStatsType(graphene.ObjectType):
     key = graphene.String(required=True)
@@ -70,6 +88,14 @@ class TableColumnStatsType(graphene.ObjectType):
     median = graphene.Float()
     std_deviation = graphene.Float()
     mean = graphene.Float()
+    is_approximate = graphene.Boolean()
+    histogram = graphene.List(graphene.NonNull(HistogramBinType))
+    top_values = graphene.List(graphene.NonNull(ValueCountType))
+    earliest = graphene.String()
+    latest = graphene.String()
+    range_days = graphene.Float()
+    granularity = graphene.String()
+    gap_count = graphene.Int()
 
 
 class JoinType(DjangoObjectType):
@@ -98,14 +124,22 @@ class TableType(DjangoObjectType):
     status_display = EnumDescription(source="get_status_display")
     preview_data = GenericScalar()
     properties = graphene.Field(TablePropertiesType)
-    data_column_stats = graphene.List(TableColumnStatsType, source="data_column_stats")
+    # Stats of the columns with the given keys, or of all the columns
+    data_column_stats = graphene.List(
+        TableColumnStatsType,
+        column_keys=graphene.List(graphene.NonNull(graphene.String)),
+    )
     data_rows = GenericScalar(source="data_rows")
     rows_count = graphene.Int()
     columns_count = graphene.Int()
 
+    @staticmethod
+    def resolve_data_column_stats(root, info, column_keys=None, **kwargs):
+        return get_table_column_stats(root, column_keys)
+
     @staticmethod
     def resolve_rows_count(root, info, **kwargs):
-        return len(root.data_rows)
+        return root.rows_count
 
     @staticmethod
     def resolve_columns_count(root, info, **kwargs):
@@ -125,6 +159,8 @@ class DatasetType(DjangoObjectType):
             "id",
             "name",
             "status",
+            "has_errored",
+            "error",
         )
         skip_registry = True
 
@@ -12,6 +12,9 @@ class TablePropertiesSerializer(serializers.Serializer):
     language = serializers.CharField(required=True)
     trimWhitespaces = serializers.BooleanField(required=True)
     treatTheseAsNa = serializers.CharField(required=True, allow_blank=True)
+    approximateStatsAfter = serializers.IntegerField(
+        required=False, allow_null=True, min_value=0
+    )
 
     def validate(self, data):
         if not data:
@@ -1,19 +1,108 @@
-import pandas as pd
 import logging
+import tempfile
+from itertools import islice
 
-from typing import Optional
-from celery import shared_task
+from typing import Any, Dict, List, Optional
+from celery import chord, group, shared_task
+from django.conf import settings
+from django.db import transaction
 
-from apps.file.models import File
-from apps.core.models import Table, Snapshot, Action
-from apps.core.utils import perform_hash_join, perform_naive_join
+from apps.core.models import Dataset, Table, Snapshot, Action, has_column_stats
+from apps.core.utils import (
+    perform_hash_join,
+    perform_naive_join,
+    create_dataset_tables,
+    extract_table_preview,
+    save_extracted_previews,
+    SESSION_CLASSES,
+)
 from dive.consts import JOIN_CLAUSE_OPERATIONS
 from apps.core.actions.utils import get_composed_action_for_action_object
-from utils.extraction import extract_data_from_excel
+from utils.columnar import ColumnarWriter
+from utils.extraction import extract_data_in_batches
+from utils.parsing import get_parse_cache_info
+from utils.readers import set_content_hash
 
 logger = logging.getLogger(__name__)
 
 
+@shared_task
+def extract_dataset_tables(dataset_id: int):
+    """
+    Create tables of the dataset and extract their previews, in parallel by a
+    chord of at most SHEET_EXTRACTION_CONCURRENCY extract_table_previews tasks
+    whose callback saves all of the previews at once.
+    """
+    dataset: Optional[Dataset] = Dataset.objects.filter(id=dataset_id).first()
+    if dataset is None:
+        logger.warning(f"No such dataset(id: {dataset_id}) exists to extract tables")
+        return
+    try:
+        pending = create_dataset_tables(
+            dataset, extract_previews=settings.SHEET_EXTRACTION_CONCURRENCY <= 1
+        )
+    except Exception as e:
+        logger.error(
+            f"Error extracting tables of dataset(id: {dataset_id})", exc_info=True
+        )
+        dataset.has_errored = True
+        dataset.error = str(e)
+        dataset.save(update_fields=["has_errored", "error"])
+        # Tables whose previews were not extracted, which are extracted again
+        # if the task is run again
+        dataset.table_set.filter(status=Table.TableStatus.PENDING).update(
+            has_errored=True, error=str(e)
+        )
+        return
+    if not pending:
+        return
+    size = -(-len(pending) // settings.SHEET_EXTRACTION_CONCURRENCY)
+    tables_left = iter(table.id for table in pending)
+    chunks = iter(lambda: list(islice(tables_left, size)), [])
+    tasks = chord(
+        (extract_table_previews.s(chunk) for chunk in chunks),
+        save_dataset_previews.s(dataset_id),
+    )
+    transaction.on_commit(tasks.delay)
+
+
+@shared_task
+def extract_table_previews(table_ids: List[int]) -> List[Dict[str, Any]]:
+    """
+    Extract previews of the tables for the save_dataset_previews callback.
+    Failures are returned along with the previews so that the callback runs
+    and saves the rest.
+    """
+    previews = []
+    for table in Table.objects.filter(id__in=table_ids).select_related("dataset__file"):
+        try:
+            preview_data, err = extract_table_preview(table)
+            failed = False
+        except Exception as e:
+            logger.error(
+                f"Error extracting preview of table(id: {table.id})", exc_info=True
+            )
+            preview_data, err, failed = None, str(e), True
+        previews.append(
+            {
+                "table_id": table.id,
+                "preview_data": preview_data,
+                "error": err,
+                "failed": failed,
+            }
+        )
+    return previews
+
+
+@shared_task
+def save_dataset_previews(previews: List[List[Dict[str, Any]]], dataset_id: int):
+    dataset: Optional[Dataset] = Dataset.objects.filter(id=dataset_id).first()
+    if dataset is None:
+        logger.warning(f"No such dataset(id: {dataset_id}) exists to save previews")
+        return
+    save_extracted_previews(dataset, [x for chunk in previews for x in chunk])
+
+
 @shared_task
 def extract_table_data(table_id: int):
     table: Optional[Table] = Table.objects.filter(id=table_id).first()
@@ -21,30 +110,76 @@ def extract_table_data(table_id: int):
         logger.warning(f"No such table(id: {table_id}) exists to extract data")
         return
 
-    if table.source_type == File.Type.EXCEL:
+    if table.source_type in SESSION_CLASSES:
         create_snapshot_for_table(table)
     else:
         raise Exception(f"Extraction for {table.source_type} not implemented")
 
 
-def create_snapshot_for_table(table: Table) -> Optional[Snapshot]:
-    pd_excel = pd.ExcelFile(table.dataset.file.file.path)
-    extracted_data, err = extract_data_from_excel(
-        pd_excel, table.original_name, table.properties, calculate_stats=True
-    )
-    if extracted_data is None:
-        logger.warning(f"Error extracting data: {err}")
+def get_reusable_snapshot(table: Table) -> Optional[Snapshot]:
+    """
+    First snapshot of a table extracted with the same properties from a file
+    having the same content.
+    """
+    content_hash = table.dataset.file.content_hash
+    if not content_hash:
         return None
-
-    return Snapshot.objects.create(
-        table=table,
-        version=1,
-        data_rows=extracted_data["rows"],
-        data_columns=extracted_data["columns"],
-        column_stats=extracted_data["column_stats"],
+    return (
+        Snapshot.objects.filter(
+            version=1,
+            table__dataset__file__content_hash=content_hash,
+            table__original_name=table.original_name,
+            table__properties=table.properties,
+            table__joined_from__isnull=True,
+        )
+        .exclude(table=table)
+        .order_by("id")
+        .first()
     )
 
 
+def create_snapshot_for_table(table: Table) -> Optional[Snapshot]:
+    snapshot = get_reusable_snapshot(table)
+    if snapshot is not None:
+        snapshot.id = None
+        snapshot.table = table
+        snapshot.save()
+        return snapshot
+
+    session_class = SESSION_CLASSES[table.source_type]
+    file = table.dataset.file
+    if file.content_hash:
+        # To find the persisted raw rows without hashing the file
+        set_content_hash(file.file.path, file.content_hash)
+    # Rows are written to the file a batch at a time as they are extracted
+    with session_class(file.file.path) as session, tempfile.TemporaryFile() as f:
+        writer = ColumnarWriter(f)
+        extracted_data, err = extract_data_in_batches(
+            session,
+            table.original_name,
+            table.properties,
+            writer=writer,
+        )
+        if extracted_data is None:
+            logger.warning(f"Error extracting data: {err}")
+            return None
+        logger.info(
+            f"Parse cache after extracting table(id: {table.id}): "
+            f"{get_parse_cache_info()}"
+        )
+        writer.close()
+        snapshot = Snapshot(
+            table=table,
+            version=1,
+            data_columns=extracted_data["columns"],
+            # Stats are calculated as the columns are asked for
+            column_stats=extracted_data["columns"],
+        )
+        snapshot.set_data_file(f)
+        snapshot.save()
+    return snapshot
+
+
 @shared_task
 def calculate_column_stats_for_action(action_id: int):
     action_obj = Action.objects.filter(pk=action_id).first()
@@ -53,11 +188,49 @@ def calculate_column_stats_for_action(action_id: int):
         return
 
     action = get_composed_action_for_action_object(action_obj)
-    _, _, _, column_stats = action.run_action()
+    snapshot = action.table.last_snapshot
+    if snapshot is None:
+        logger.error(f"No snapshot to calculate stats of action(id {action_id}) on")
+        return
+    _, column_stats = action.get_column_stats(snapshot)
     action_obj.table_column_stats = column_stats
     action_obj.save()
 
 
+@shared_task
+def calculate_table_column_stats(table_id: int, keys: List[str]):
+    table = Table.objects.filter(pk=table_id).first()
+    if table is None:
+        logger.error(f"Calling stats calculation for inexistent table(id {table_id})")
+        return
+    table.get_column_stats(keys)
+
+
+def get_table_column_stats(table: Table, keys: Optional[List[str]] = None):
+    """
+    Table.get_column_stats() for requests. Once the columns to calculate have
+    STATS_BACKGROUND_MIN_VALUES values in all, they are calculated by a group
+    of calculate_table_column_stats tasks of STATS_TASK_COLUMNS columns each,
+    which the celery workers run in parallel. Till then the columns have only
+    their key, label and type, and when they were queued as calculating_since.
+    """
+    stats = table.get_column_stats(keys, calculate=False)
+    pending = [x["key"] for x in stats if not has_column_stats(x)]
+    if not pending:
+        return stats
+    if len(pending) * table.rows_count < settings.STATS_BACKGROUND_MIN_VALUES:
+        return table.get_column_stats(keys)
+    # Columns queued by an earlier request are not queued again
+    pending = table.mark_column_stats_calculating(pending)
+    if not pending:
+        return stats
+    keys_left = iter(pending)
+    chunks = iter(lambda: list(islice(keys_left, settings.STATS_TASK_COLUMNS)), [])
+    tasks = group(calculate_table_column_stats.s(table.id, chunk) for chunk in chunks)
+    transaction.on_commit(tasks.delay)
+    return stats
+
+
 @shared_task
 def perform_join(table_id: int):
     table = Table.objects.filter(id=table_id).first()
@@ -1,13 +1,21 @@
 import pytest
 from typing import cast
+from unittest import mock
+
+from django.test import override_settings
 
 from dive.base_test import BaseTestWithDataFrameAndExcel
 from apps.core.actions.base import get_action_class
 from apps.core.actions.utils import parse_raw_action
 from apps.core.actions.cast_column import CastColumnAction
-from apps.core.tasks import extract_table_data, calculate_column_stats_for_action
-from apps.core.models import Snapshot, Action
+from apps.core.tasks import (
+    extract_table_data,
+    calculate_column_stats_for_action,
+    get_table_column_stats,
+)
+from apps.core.models import Snapshot, Action, has_column_stats
 from utils.common import ColumnTypes
+from utils.parsing import clear_parse_cache, get_parse_cache_info
 
 STRING_STAT_KEYS = [
     "total_count",
@@ -84,6 +92,31 @@ class TestCastColumnAction(BaseTestWithDataFrameAndExcel):
         new_row = action.apply_row(row)
         assert isinstance(new_row[col_key], str)
 
+    def test_apply_date_cast_to_rows_of_excel_file(self):
+        action = cast(
+            CastColumnAction,
+            parse_raw_action(self.action_name, ["2", "date"], self.table),
+        )
+        assert action.excel_serials is True
+        rows = self.table.last_snapshot.data_rows
+        assert rows[0]["2"] == 2000.5
+        new_rows = action.apply_rows(rows)
+        assert new_rows == [action.apply_row(row) for row in rows]
+        assert new_rows[0]["2"] == "1905-06-22", "Numbers are Excel serial dates"
+
+    def test_apply_action_to_rows_caches_parsed_values(self):
+        action = cast(
+            CastColumnAction,
+            parse_raw_action(self.action_name, ["0", "number"], self.table),
+        )
+        rows = self.table.last_snapshot.data_rows
+        clear_parse_cache()
+        new_rows = [action.apply_row(row) for row in rows]
+        info = get_parse_cache_info()
+        assert info["misses"] > 0
+        assert [action.apply_row(row) for row in rows] == new_rows
+        assert get_parse_cache_info()["hits"] == info["hits"] + len(rows)
+
     def test_apply_action_to_table(self):
         params = ["0", "string"]
         action = cast(
@@ -100,7 +133,7 @@ class TestCastColumnAction(BaseTestWithDataFrameAndExcel):
         original_columns = snapshot.data_columns
 
         # Test stats
-        original_stats = snapshot.column_stats
+        original_stats = self.table.get_column_stats()
         col_stats = next(x for x in original_stats if x["key"] == col_key)
         for stat_key in NUMERIC_STAT_KEYS:
             assert (
@@ -123,7 +156,7 @@ class TestCastColumnAction(BaseTestWithDataFrameAndExcel):
             table=self.table, version=2
         ).exists(), "A snapshot with version 2 should have been created"
 
-        new_stats = self.table.last_snapshot.column_stats
+        new_stats = self.table.get_column_stats()
         col_stats_new = next(x for x in new_stats if x["key"] == col_key)
         for stat_key in STRING_STAT_KEYS:
             assert (
@@ -140,6 +173,69 @@ class TestCastColumnAction(BaseTestWithDataFrameAndExcel):
             if col["key"] == col_key:
                 assert col["type"] == ColumnTypes.STRING
 
+    def test_column_stats_are_calculated_when_asked_for(self):
+        snapshot = self.table.last_snapshot
+        assert not any(has_column_stats(x) for x in snapshot.column_stats)
+        stats = self.table.get_column_stats(["0"])
+        assert [x["key"] for x in stats] == ["0"]
+        for stat_key in NUMERIC_STAT_KEYS:
+            assert stat_key in stats[0]
+        snapshot.refresh_from_db()
+        assert [has_column_stats(x) for x in snapshot.column_stats] == [
+            x["key"] == "0" for x in snapshot.column_stats
+        ], "Only the asked column should be calculated and saved"
+        with mock.patch("apps.core.models.calculate_column_stats") as calculate_func:
+            assert self.table.get_column_stats(["0"]) == stats
+            assert not calculate_func.called, "Saved stats should be reused"
+
+        # Stats of the columns affected by an unapplied action are its own
+        action_object = Action.objects.create(
+            table=self.table,
+            action_name=self.action_name,
+            parameters=["0", "string"],
+            order=1,
+        )
+        calculate_column_stats_for_action(action_object.id)
+        action_object.refresh_from_db()
+        assert not has_column_stats(action_object.table_column_stats[0])
+        all_stats = self.table.get_column_stats()
+        assert all(has_column_stats(x) for x in all_stats)
+        for stat_key in STRING_STAT_KEYS:
+            assert stat_key in all_stats[0]
+        action_object.refresh_from_db()
+        assert action_object.table_column_stats == all_stats
+        snapshot.refresh_from_db()
+        assert not has_column_stats(snapshot.column_stats[1])
+
+    @override_settings(STATS_BACKGROUND_MIN_VALUES=0, STATS_TASK_COLUMNS=2)
+    def test_column_stats_of_large_tables_are_calculated_in_background(self):
+        keys = [x["key"] for x in self.table.last_snapshot.column_stats]
+        with mock.patch(
+            "apps.core.tasks.group"
+        ) as group_func, self.captureOnCommitCallbacks(execute=True):
+            stats = get_table_column_stats(self.table)
+        assert not any(has_column_stats(x) for x in stats)
+        group_func.return_value.delay.assert_called_once()
+        subtasks = list(group_func.call_args.args[0])
+        assert [x.args for x in subtasks] == [
+            (self.table.id, chunk) for chunk in [keys[:2], keys[2:]]
+        ]
+        # Polled again while the tasks are queued
+        with mock.patch("apps.core.tasks.group") as group_func:
+            get_table_column_stats(self.table)
+            assert not group_func.called, "Columns should not be queued twice"
+        with override_settings(STATS_CALCULATING_TIMEOUT=0), mock.patch(
+            "apps.core.tasks.group"
+        ) as group_func, self.captureOnCommitCallbacks(execute=True):
+            get_table_column_stats(self.table)
+        group_func.return_value.delay.assert_called_once()
+        for subtask in subtasks:
+            subtask.apply()
+        with mock.patch("apps.core.tasks.group") as group_func:
+            stats = get_table_column_stats(self.table)
+            assert not group_func.called
+        assert all(has_column_stats(x) for x in stats)
+
     def test_action_composition(self):
         # TODO: To be implemented by @bewakes, will do after other actions are
         # added. Currently we only have a single action
@@ -201,6 +297,7 @@ class TestCastColumnAction(BaseTestWithDataFrameAndExcel):
 
         age_casted = [action.apply_row(row) for row in data]
         assert age_casted == age_casted_expected
+        assert action.apply_rows(data) == age_casted_expected
 
         # Test cast bmi
         colkey = "bmi"
@@ -212,6 +309,7 @@ class TestCastColumnAction(BaseTestWithDataFrameAndExcel):
 
         bmi_casted = [action.apply_row(row) for row in data]
         assert bmi_casted == bmi_casted_expected
+        assert action.apply_rows(data) == bmi_casted_expected
 
     def test_cast_string_to_number_field(self):
         """Try to cast non numeric string to integer"""
@@ -16,7 +16,7 @@ from dive.base_test import (
     BaseTestWithDataFrameAndExcel,
 )
 from apps.core.models import Dataset, Table, Action, Join, Snapshot
-from apps.core.tasks import create_snapshot_for_table
+from apps.core.tasks import create_snapshot_for_table, extract_dataset_tables
 from apps.core.factories import DatasetFactory, TableFactory, SnapshotFactory
 from dive.consts import JOIN_CLAUSE_OPERATIONS
 from dive.base_test import create_test_file
@@ -66,23 +66,53 @@ class TestDatasetMutation(GraphQLFileUploadTestCase, GraphQLTestCase):
 
     @assert_object_created(Dataset, count=1)
     @assert_object_created(Table, count=SHEETS_COUNT_IN_TEST_EXCEL)
-    def test_file_upload(self):
-        content = self.call_create_dataset_api()
-        data = content["data"]["createDataset"]
-        self.assertTrue(data["ok"], content)
-        result = data["result"]
+    # Previews are extracted by the task itself instead of by more tasks
+    @override_settings(SHEET_EXTRACTION_CONCURRENCY=1)
+    @mock.patch("apps.core.mutations.extract_dataset_tables.delay")
+    def test_file_upload(self, extraction_task_func):
+        extraction_task_func.side_effect = extract_dataset_tables
+        with self.captureOnCommitCallbacks(execute=True):
+            content = self.call_create_dataset_api()
+            data = content["data"]["createDataset"]
+            self.assertTrue(data["ok"], content)
+            result = data["result"]
+            for field in ["id", "name", "status", "tables"]:
+                self.assertIsNotNone(result[field])
+            assert result["status"] == self.genum(Dataset.DatasetStatus.PENDING)
+            assert result["tables"] == [], "Tables should be extracted in background"
+            extraction_task_func.assert_not_called()
 
-        for field in ["id", "name", "status", "tables"]:
-            self.assertIsNotNone(result[field])
+        extraction_task_func.assert_called_once_with(int(result["id"]))
+        content = self.query_check(
+            """
+            query Query($id: ID!) {
+                dataset(id: $id) {
+                    status
+                    hasErrored
+                    tables {
+                        id
+                        name
+                        status
+                        isAddedToWorkspace
+                    }
+                }
+            }
+            """,
+            variables={"id": result["id"]},
+        )
+        dataset = content["data"]["dataset"]
+        assert dataset["status"] == self.genum(Dataset.DatasetStatus.EXTRACTED)
+        assert dataset["hasErrored"] is False
 
         table_fields = ["id", "name", "status", "isAddedToWorkspace"]
-        tables = result["tables"]
+        tables = dataset["tables"]
         assert (
             len(tables) > 0
         ), "There must be at least a table created for valid file upload"
         for table in tables:
             for field in table_fields:
                 self.assertIsNotNone(table[field])
+            assert table["status"] == self.genum(Table.TableStatus.EXTRACTED)
 
     def call_create_dataset_api(self):
         with open(self.file_path, "rb") as t_file:
@@ -6,6 +6,7 @@ from utils.graphene.tests import GraphQLTestCase
 from django.test import override_settings
 from django.conf import settings
 
+from apps.core.tasks import extract_table_data
 from apps.core.utils import create_dataset_and_tables
 
 from dive.base_test import create_test_file
@@ -86,3 +87,32 @@ class TestDatasetQuery(GraphQLTestCase):
             assert "type" in col
             assert "label" in col
             assert "key" in col
+
+    def test_get_table_column_stats(self):
+        file_obj = create_test_file(TEST_FILE_PATH)
+        dataset = create_dataset_and_tables(file_obj)
+        table = dataset.table_set.first()
+        extract_table_data(table.id)
+        column = table.last_snapshot.data_columns[0]
+        content = self.query_check(
+            """
+            query GetTable($id: ID!, $columnKeys: [String!]) {
+                table(id: $id) {
+                    dataColumnStats(columnKeys: $columnKeys) {
+                        key
+                        totalCount
+                        isApproximate
+                    }
+                }
+            }
+            """,
+            variables={"id": table.pk, "columnKeys": [column["key"]]},
+        )
+        stats = content["data"]["table"]["dataColumnStats"]
+        assert stats == [
+            {
+                "key": column["key"],
+                "totalCount": len(table.last_snapshot.data_rows),
+                "isApproximate": False,
+            }
+        ]
@@ -1,10 +1,19 @@
+import os
+import pandas as pd
 from typing import List
 from unittest import mock
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.core.exceptions import ValidationError
 
-from dive.base_test import BaseTestWithDataFrameAndExcel
-from apps.core.models import Snapshot, Action, Join
+from dive.base_test import (
+    BaseTestWithDataFrameAndExcel,
+    DATAFRAME,
+    NUM_ROWS,
+    create_test_file,
+)
+from apps.file.models import File
+from apps.core.models import Dataset, Table, Snapshot, Action, Join
+from utils.hashing import get_content_digest
 from utils.common import ColumnTypes
 from dive.consts import JOIN_CLAUSE_OPERATIONS
 from apps.core.factories import (
@@ -17,9 +26,15 @@ from apps.core.tasks import (
     extract_table_data,
     calculate_column_stats_for_action,
     create_snapshot_for_table,
+    extract_dataset_tables,
     perform_join,
 )
-from apps.core.utils import perform_hash_join_
+from utils.extraction import extract_preview_data_cached
+from apps.core.utils import (
+    perform_hash_join_,
+    create_dataset,
+    create_dataset_and_tables,
+)
 
 
 class TestExtractionTasks(BaseTestWithDataFrameAndExcel):
@@ -32,6 +47,210 @@ class TestExtractionTasks(BaseTestWithDataFrameAndExcel):
         assert snapshot is not None
         assert snapshot.version == 1
 
+    def test_snapshot_rows_are_stored_by_column(self):
+        table = self.dataset.table_set.first()
+        extract_table_data(table.id)
+        snapshot = Snapshot.objects.get(table=table)
+        assert snapshot.data_file and snapshot.legacy_data_rows is None
+        rows = snapshot.data_rows
+        assert len(rows) == NUM_ROWS
+        assert snapshot.read_rows(["1"], 2, 4) == [{"1": x["1"]} for x in rows[2:4]]
+
+        # Snapshots saved before the columnar files
+        legacy = SnapshotFactory.create(
+            table=table, version=2, data_columns=[], legacy_data_rows=rows
+        )
+        legacy = Snapshot.objects.get(id=legacy.id)
+        assert not legacy.data_file
+        assert legacy.data_rows == rows
+        assert legacy.read_rows(["1"], 2, 4) == snapshot.read_rows(["1"], 2, 4)
+
+    def test_snapshot_data_files_are_deleted_once_unused(self):
+        table = self.dataset.table_set.first()
+        extract_table_data(table.id)
+        snapshot = Snapshot.objects.get(table=table)
+        assert snapshot.rows_count == NUM_ROWS
+        with mock.patch.object(Snapshot, "read_rows") as read_rows:
+            assert table.rows_count == NUM_ROWS
+            assert not read_rows.called, "Rows should not be read to count them"
+
+        cloned_table = table.clone()
+        cloned_snapshot = cloned_table.last_snapshot
+        storage, name = snapshot.data_file.storage, snapshot.data_file.name
+        assert cloned_snapshot.data_file.name == name
+        with self.captureOnCommitCallbacks(execute=True):
+            snapshot.delete()
+        assert storage.exists(name), "The file is still used by the copy"
+        with self.captureOnCommitCallbacks(execute=True):
+            cloned_snapshot.data_rows = cloned_snapshot.data_rows[:2]
+            cloned_snapshot.save()
+        assert not storage.exists(name), "Replaced files should be deleted"
+        assert cloned_snapshot.rows_count == 2
+        name = cloned_snapshot.data_file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            cloned_table.delete()
+        assert not storage.exists(name)
+
+    def test_extract_csv_table_data(self):
+        csv_file_path = "test_result.csv"
+        DATAFRAME.to_csv(csv_file_path, index=False)
+        try:
+            file_obj = create_test_file(
+                csv_file_path, file_name="test.csv", file_type=File.Type.CSV
+            )
+            dataset = create_dataset_and_tables(file_obj)
+        finally:
+            os.remove(csv_file_path)
+        table = dataset.table_set.first()
+        assert table is not None
+        assert len(table.preview_data["rows"]) == NUM_ROWS
+        extract_table_data(table.id)
+        snapshot = Snapshot.objects.filter(table=table).first()
+        assert snapshot is not None
+        assert len(snapshot.data_rows) == NUM_ROWS
+        assert len(snapshot.column_stats) == len(DATAFRAME.columns)
+
+    def test_datasets_of_same_content_reuse_previews_and_snapshots(self):
+        with open(self.excel_file_path, "rb") as f:
+            content_hash = get_content_digest(f)
+        datasets = []
+        for _ in range(2):
+            file_obj = create_test_file(self.excel_file_path)
+            file_obj.content_hash = content_hash
+            file_obj.save()
+            datasets.append(create_dataset_and_tables(file_obj))
+            table = datasets[-1].table_set.get()
+            if len(datasets) == 1:
+                extract_table_data(table.id)
+
+        source_table, table = [dataset.table_set.get() for dataset in datasets]
+        assert table.status == Table.TableStatus.EXTRACTED
+        assert table.preview_data == source_table.preview_data
+        with mock.patch("apps.core.tasks.extract_data_in_batches") as extraction_func:
+            extract_table_data(table.id)
+            assert not extraction_func.called, "Snapshot should be reused"
+        assert table.last_snapshot is not None
+        assert table.last_snapshot.id != source_table.last_snapshot.id
+        assert table.last_snapshot.data_rows == source_table.last_snapshot.data_rows
+
+    def test_extract_dataset_tables_without_file(self):
+        dataset = DatasetFactory.create(file=None, status=Dataset.DatasetStatus.PENDING)
+        extract_dataset_tables(dataset.id)
+        dataset.refresh_from_db()
+        assert dataset.has_errored is True
+        assert dataset.error == "Invalid file type"
+        assert dataset.status == Dataset.DatasetStatus.PENDING
+        assert not dataset.table_set.exists()
+
+    @override_settings(SHEET_EXTRACTION_CONCURRENCY=2)
+    def test_extract_previews_of_sheets_in_parallel_tasks(self):
+        excel_file_path = "test_sheets.xlsx"
+        sheet_names = ["first", "second", "third"]
+        with pd.ExcelWriter(excel_file_path) as writer:
+            for i, name in enumerate(sheet_names):
+                DATAFRAME.head(NUM_ROWS - i).to_excel(writer, name, index=False)
+        try:
+            file_obj = create_test_file(excel_file_path, file_name="sheets.xlsx")
+            with override_settings(SHEET_EXTRACTION_CONCURRENCY=1):
+                serial = create_dataset_and_tables(file_obj)
+            # Not reused from the other dataset of the same content
+            file_obj.content_hash = None
+            file_obj.save()
+            dataset = create_dataset(file_obj)
+            with mock.patch(
+                "apps.core.tasks.chord"
+            ) as chord_func, self.captureOnCommitCallbacks(execute=True):
+                extract_dataset_tables(dataset.id)
+            chord_func.return_value.delay.assert_called_once()
+            header, callback = chord_func.call_args.args
+            subtasks = list(header)
+            assert [len(x.args[0]) for x in subtasks] == [2, 1]
+            tables = list(dataset.table_set.order_by("id"))
+            assert [t.status for t in tables] == [Table.TableStatus.PENDING] * 3
+            dataset.refresh_from_db()
+            assert dataset.status == Dataset.DatasetStatus.PENDING
+
+            previews = [subtask.apply().get() for subtask in subtasks]
+            callback.apply(args=(previews,))
+        finally:
+            os.remove(excel_file_path)
+        dataset.refresh_from_db()
+        assert dataset.status == Dataset.DatasetStatus.EXTRACTED
+        assert not dataset.has_errored
+        serial_tables, tables = [
+            list(x.table_set.order_by("id").values("name", "status", "preview_data"))
+            for x in [serial, dataset]
+        ]
+        assert [t["name"] for t in tables] == sheet_names
+        assert [len(t["preview_data"]["rows"]) for t in tables] == [
+            NUM_ROWS - i for i in range(len(sheet_names))
+        ]
+        assert tables == serial_tables
+
+    @override_settings(SHEET_EXTRACTION_CONCURRENCY=1)
+    def test_extract_dataset_tables_again_after_failure(self):
+        excel_file_path = "test_sheets.xlsx"
+        sheet_names = ["first", "second", "third"]
+        with pd.ExcelWriter(excel_file_path) as writer:
+            for name in sheet_names:
+                DATAFRAME.to_excel(writer, name, index=False)
+        try:
+            file_obj = create_test_file(excel_file_path, file_name="sheets.xlsx")
+            dataset = create_dataset(file_obj)
+
+            def fail_on_second_sheet(session, sheetname, props):
+                if sheetname == "second":
+                    raise MemoryError("Out of memory")
+                return extract_preview_data_cached(session, sheetname, props)
+
+            with mock.patch(
+                "apps.core.utils.extract_preview_data_cached",
+                side_effect=fail_on_second_sheet,
+            ):
+                extract_dataset_tables(dataset.id)
+            dataset.refresh_from_db()
+            assert dataset.has_errored
+            tables = list(dataset.table_set.order_by("id"))
+            assert [t.status for t in tables] == [
+                Table.TableStatus.EXTRACTED,
+                Table.TableStatus.PENDING,
+                Table.TableStatus.PENDING,
+            ]
+            assert [t.has_errored for t in tables] == [False, True, True]
+            assert tables[1].error == "Out of memory"
+
+            extract_dataset_tables(dataset.id)
+        finally:
+            os.remove(excel_file_path)
+        dataset.refresh_from_db()
+        assert not dataset.has_errored
+        assert dataset.status == Dataset.DatasetStatus.EXTRACTED
+        retried = list(dataset.table_set.order_by("id"))
+        assert [t.id for t in retried] == [t.id for t in tables], "No new tables"
+        for table in retried:
+            assert table.status == Table.TableStatus.EXTRACTED
+            assert not table.has_errored
+            assert len(table.preview_data["rows"]) == NUM_ROWS
+
+    def test_extract_json_table_data(self):
+        json_file_path = "test_result.json"
+        DATAFRAME.to_json(json_file_path, orient="records", lines=True)
+        try:
+            file_obj = create_test_file(
+                json_file_path, file_name="test.json", file_type=File.Type.JSON
+            )
+            dataset = create_dataset_and_tables(file_obj)
+        finally:
+            os.remove(json_file_path)
+        table = dataset.table_set.first()
+        assert table is not None
+        assert len(table.preview_data["rows"]) == NUM_ROWS
+        extract_table_data(table.id)
+        snapshot = Snapshot.objects.filter(table=table).first()
+        assert snapshot is not None
+        assert len(snapshot.data_rows) == NUM_ROWS
+        assert [c["label"] for c in snapshot.data_columns] == list(DATAFRAME.columns)
+
     @mock.patch("apps.core.tasks.get_composed_action_for_action_object")
     def test_calculate_column_stats_for_action_inexistent_action(
         self, composed_action_func
@@ -6,7 +6,13 @@ from utils.common import ColumnTypes
 Validation = Tuple[bool, Optional[str]]
 
 
-class TablePropertiesDict(TypedDict):
+class OptionalTablePropertiesDict(TypedDict, total=False):
+    # Non null values of a column after which its stats are approximated,
+    # settings.STATS_APPROXIMATE_AFTER if absent or None
+    approximateStatsAfter: Optional[int]
+
+
+class TablePropertiesDict(OptionalTablePropertiesDict):
     headerLevel: str
     timezone: str
     language: str
@@ -25,6 +31,22 @@ class ExtractedData(TypedDict):
     columns: List[Column]
     extra_headers: List[List[str]]
     column_stats: Any  # TODO
+    # Confidence of the inferred type of each column as per
+    # utils.inference.infer_column_type(), for strings it is the share of the
+    # values which are neither numbers nor dates
+    column_type_confidences: Dict[str, float]
+
+
+class HistogramBin(TypedDict):
+    # Numbers, or iso datetimes for dates and datetimes
+    start: Any
+    end: Any
+    count: int
+
+
+class ValueCount(TypedDict):
+    value: str
+    count: int
 
 
 class NumericColumnStats(TypedDict):
@@ -37,6 +59,10 @@ class NumericColumnStats(TypedDict):
     std_deviation: Optional[float]
     total_count: int
     na_count: int
+    # Whether the median and the histogram are estimated by a sketch
+    is_approximate: bool
+    # None if there are no finite values
+    histogram: Optional[List[HistogramBin]]
 
 
 class StringColumnStats(TypedDict):
@@ -45,6 +71,27 @@ class StringColumnStats(TypedDict):
     unique_count: int
     max_length: Optional[int]
     min_length: Optional[int]
+    # Whether the unique count and the top values are estimated by sketches
+    is_approximate: bool
+    top_values: List[ValueCount]
+
+
+class TemporalColumnStats(TypedDict):
+    # Iso datetimes, None if there are no valid values
+    earliest: Optional[str]
+    latest: Optional[str]
+    range_days: Optional[float]
+    # second, minute, hour, day, month or year
+    granularity: Optional[str]
+    # Periods of the granularity between the earliest and the latest without
+    # any values
+    gap_count: Optional[int]
+    unique_count: int
+    total_count: int
+    na_count: int
+    # Whether the unique count, the gaps and the histogram are estimated
+    is_approximate: bool
+    histogram: Optional[List[HistogramBin]]
 
 
-ColumnStats = Union[NumericColumnStats, StringColumnStats]
+ColumnStats = Union[NumericColumnStats, StringColumnStats, TemporalColumnStats]
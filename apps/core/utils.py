@@ -1,89 +1,249 @@
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Type, Optional
 from collections import defaultdict
 import os
-import pandas as pd
 import logging
 
-from django.db import transaction
 
 from dive.consts import JOIN_CLAUSE_OPERATIONS
 from apps.file.models import File
 from apps.core.models import Table, Dataset, Join, Snapshot
 from apps.core.validators import get_default_table_properties
-from utils.extraction import extract_preview_data_from_excel
-from utils.common import get_file_extension
+from apps.core.types import ExtractedData
+from utils.extraction import extract_preview_data_cached
+from utils.readers import (
+    FileSession,
+    ExcelSession,
+    CsvSession,
+    JsonSession,
+    TextSession,
+    get_session,
+    set_content_hash,
+)
 
 logger = logging.getLogger(__name__)
 
 
+# Files which can be read through a session, see utils.readers
+SESSION_CLASSES: Dict[str, Type[FileSession]] = {
+    File.Type.EXCEL: ExcelSession,
+    File.Type.CSV: CsvSession,
+    File.Type.JSON: JsonSession,
+    File.Type.TEXT: TextSession,
+}
+
+
+def get_file_session(file: File) -> FileSession:
+    session_class = SESSION_CLASSES.get(file.file_type)
+    if session_class is None:
+        raise Exception(f"Extraction not implemented for {file.file_type}")
+    if file.content_hash:
+        set_content_hash(file.file.path, file.content_hash)
+    # The session is reused across property changes unless the file changes
+    return get_session(file.file.path, session_class)
+
+
 def apply_table_properties_and_extract_preview(table: Table):
-    if table.dataset.file.file_type == File.Type.EXCEL:
-        pd_excel = pd.ExcelFile(table.dataset.file.file.path)
-        preview_data, err = extract_preview_data_from_excel(
-            pd_excel, table.original_name, table.properties
-        )
-    else:
-        raise Exception("Extraction not implemented for filetypes other than excel")
+    session = get_file_session(table.dataset.file)
+    preview_data, err = extract_preview_data_cached(
+        session, table.original_name, table.properties
+    )
     table.preview_data = preview_data
     table.error = err
     table.save(update_fields=["preview_data", "error"])
 
 
-def process_excel_file(dataset: Dataset):
-    pd_excel = pd.ExcelFile(dataset.file.file.path)
+def get_sheet_tables(dataset: Dataset):
+    """Tables of the dataset for its sheets, not the joined or cloned ones"""
+    return dataset.table_set.filter(joined_from__isnull=True, cloned_from__isnull=True)
+
+
+def create_pending_tables(dataset: Dataset, session: FileSession) -> List[Table]:
+    """
+    Create pending tables for all the sheets at once, so that the progress is
+    visible, and return the tables still pending in the order of the sheets.
+    Sheets already having tables, e.g. from an earlier run which failed, get
+    no new tables.
+    """
     default_props = get_default_table_properties()
-    with transaction.atomic():
-        for sheet_name in pd_excel.sheet_names:
-            table_data = {
-                "dataset": dataset,
-                "name": sheet_name,  # User can modify this later
-                "original_name": sheet_name,  # This cannot be modified
-                "created_by": dataset.file.created_by,
-                "modified_by": dataset.file.modified_by,
-                "preview_data": {},
-                "has_errored": False,
-                "error": None,
-                "properties": default_props,
-            }
-            table = Table.objects.create(**table_data)
-            preview_data, err = extract_preview_data_from_excel(
-                pd_excel, table.original_name, table.properties
-            )
-            table.preview_data = preview_data
-            table.error = err
-            table.save()
-
-
-def process_csv_file(dataset: Dataset):
-    name = os.path.basename(dataset.file.file.name)
-    table_data = {
-        "dataset": dataset,
-        "name": name,  # This can be modified later
-        "original_name": name,  # This cannot be modified
-        "created_by": dataset.file.created_by,
-        "modified_by": dataset.file.modified_by,
+    existing = set(get_sheet_tables(dataset).values_list("original_name", flat=True))
+    tables = []
+    for sheet_name in session.sheet_names:
+        if sheet_name in existing:
+            continue
+        table = Table(
+            dataset=dataset,
+            name=sheet_name,  # User can modify this later
+            original_name=sheet_name,  # This cannot be modified
+            created_by=dataset.file.created_by,
+            modified_by=dataset.file.modified_by,
+            status=Table.TableStatus.PENDING,
+            preview_data=None,
+            has_errored=False,
+            error=None,
+            properties=default_props,
+        )
+        # bulk_create() does not call Table.save() which validates json fields
+        table.full_clean()
+        tables.append(table)
+    Table.objects.bulk_create(tables)
+
+    pending = {
+        table.original_name: table
+        for table in get_sheet_tables(dataset).filter(status=Table.TableStatus.PENDING)
     }
-    Table.objects.create(**table_data)
+    return [pending[name] for name in session.sheet_names if name in pending]
 
 
-def create_dataset_and_tables(file: File) -> Dataset:
-    dataset_data = {
-        "created_by": file.created_by,
-        "modified_by": file.modified_by,
-        "name": os.path.basename(file.file.name),
-        "file": file,
-    }
-    dataset = Dataset.objects.create(**dataset_data)
-    # Now process file and create associated table
-    extension = get_file_extension(file.file.name)
-
-    if extension.lower() == "xlsx":
-        process_excel_file(dataset)
-    elif extension.lower() == "csv":
-        process_csv_file(dataset)
+def extract_table_preview(
+    table: Table,
+) -> Tuple[Optional[ExtractedData], Optional[str]]:
+    session = get_file_session(table.dataset.file)
+    return extract_preview_data_cached(session, table.original_name, table.properties)
+
+
+def set_extracted_preview(
+    table: Table, preview_data: Optional[ExtractedData], err: Optional[str]
+):
+    table.preview_data = preview_data
+    table.error = err
+    table.has_errored = err is not None
+    table.status = Table.TableStatus.EXTRACTED
+
+
+def save_extracted_previews(dataset: Dataset, previews: List[Dict[str, Any]]):
+    """
+    Save the previews extracted by the extract_table_previews tasks to their
+    tables at once. Tables whose extraction failed stay pending with the
+    error, and so does the dataset, so that it can be extracted again.
+    """
+    tables = Table.objects.in_bulk([x["table_id"] for x in previews])
+    errors = []
+    for preview in previews:
+        table = tables[preview["table_id"]]
+        if preview["failed"]:
+            table.has_errored = True
+            table.error = preview["error"]
+            errors.append(preview["error"])
+        else:
+            set_extracted_preview(table, preview["preview_data"], preview["error"])
+    Table.objects.bulk_update(
+        tables.values(), ["preview_data", "error", "has_errored", "status"]
+    )
+    if errors:
+        dataset.has_errored = True
+        dataset.error = errors[0]
+        dataset.save(update_fields=["has_errored", "error"])
     else:
+        set_dataset_extracted(dataset)
+
+
+def create_dataset(file: File) -> Dataset:
+    """
+    Create dataset for an uploaded file, pending until its tables are created
+    by create_dataset_tables(), which is run by the extract_dataset_tables task.
+    """
+    return Dataset.objects.create(
+        created_by=file.created_by,
+        modified_by=file.modified_by,
+        name=os.path.basename(file.file.name),
+        file=file,
+        status=Dataset.DatasetStatus.PENDING,
+    )
+
+
+def get_extracted_dataset_with_same_content(dataset: Dataset) -> Optional[Dataset]:
+    content_hash = dataset.file and dataset.file.content_hash
+    if not content_hash:
+        return None
+    return (
+        Dataset.objects.filter(
+            file__content_hash=content_hash,
+            status=Dataset.DatasetStatus.EXTRACTED,
+            has_errored=False,
+        )
+        .exclude(id=dataset.id)
+        .order_by("id")
+        .first()
+    )
+
+
+def copy_tables_with_preview(dataset: Dataset, source_dataset: Dataset):
+    """
+    Create tables of the dataset from the tables of a dataset of the same
+    content. Previews are reused where the properties are still the default
+    ones, the others are extracted again.
+    """
+    default_props = get_default_table_properties()
+    existing = set(get_sheet_tables(dataset).values_list("original_name", flat=True))
+    source_tables = get_sheet_tables(source_dataset).order_by("id")
+    tables = []
+    for source_table in source_tables:
+        if source_table.original_name in existing:
+            continue
+        if source_table.properties == default_props:
+            preview_data, err = source_table.preview_data, source_table.error
+        else:
+            preview_data, err = extract_preview_data_cached(
+                get_file_session(dataset.file),
+                source_table.original_name,
+                default_props,
+            )
+        table = Table(
+            dataset=dataset,
+            name=source_table.original_name,
+            original_name=source_table.original_name,
+            created_by=dataset.file.created_by,
+            modified_by=dataset.file.modified_by,
+            status=Table.TableStatus.EXTRACTED,
+            preview_data=preview_data,
+            has_errored=err is not None,
+            error=err,
+            properties=default_props,
+        )
+        table.full_clean()
+        tables.append(table)
+    Table.objects.bulk_create(tables)
+
+
+def create_dataset_tables(
+    dataset: Dataset, extract_previews: bool = True
+) -> List[Table]:
+    """
+    Create tables of the dataset, extracting their previews unless
+    extract_previews is False. Returns the tables whose previews are still to
+    be extracted, which is done by the extract_dataset_tables task.
+    """
+    file = dataset.file
+    if file is None or file.file_type not in SESSION_CLASSES:
         # TODO: Handle gracefully, or should we? because serializer already validates extension
         raise Exception("Invalid file type")
+    source_dataset = get_extracted_dataset_with_same_content(dataset)
+    if source_dataset is not None:
+        copy_tables_with_preview(dataset, source_dataset)
+        pending = []
+    else:
+        pending = create_pending_tables(dataset, get_file_session(file))
+    if extract_previews:
+        # Each preview is saved as soon as it is extracted
+        for table in pending:
+            set_extracted_preview(table, *extract_table_preview(table))
+            table.save(update_fields=["preview_data", "error", "has_errored", "status"])
+        pending = []
+    if not pending:
+        set_dataset_extracted(dataset)
+    return pending
+
+
+def set_dataset_extracted(dataset: Dataset):
+    dataset.status = Dataset.DatasetStatus.EXTRACTED
+    dataset.has_errored = False
+    dataset.error = None
+    dataset.save(update_fields=["status", "has_errored", "error"])
+
+
+def create_dataset_and_tables(file: File) -> Dataset:
+    dataset = create_dataset(file)
+    create_dataset_tables(dataset)
     return dataset
 
 
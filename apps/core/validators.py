@@ -32,6 +32,10 @@ table_properties_schema = {
         "treatTheseAsNa": {
             "type": ["string", "null"],
         },
+        "approximateStatsAfter": {
+            "type": ["integer", "null"],
+            "minimum": 0,
+        },
     },
     "required": ["headerLevel", "timezone", "language", "trimWhitespaces"],
 }
@@ -0,0 +1,92 @@
+# Generated by Django 4.1.7 on 2026-10-17 19:53
+
+from django.conf import settings
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("file", "0004_alter_file_created_by_alter_file_modified_by"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FileUpload",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("modified_at", models.DateTimeField(auto_now=True)),
+                ("file_name", models.CharField(max_length=255)),
+                (
+                    "file_type",
+                    models.CharField(
+                        choices=[
+                            ("excel", "Excel"),
+                            ("csv", "Csv"),
+                            ("json", "Json"),
+                            ("text", "Text"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("total_size", models.PositiveBigIntegerField()),
+                ("chunk_size", models.PositiveIntegerField(default=4194304)),
+                ("uploaded_size", models.PositiveBigIntegerField(default=0)),
+                (
+                    "chunk_digests",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.CharField(max_length=64),
+                        default=list,
+                        size=None,
+                    ),
+                ),
+                (
+                    "content_hash",
+                    models.CharField(blank=True, max_length=64, null=True),
+                ),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="%(class)s_created",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "file",
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="file.file",
+                    ),
+                ),
+                (
+                    "modified_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="%(class)s_modified",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-17 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("file", "0005_fileupload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="content_hash",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                max_length=64,
+                null=True,
+                verbose_name="Content hash",
+            ),
+        ),
+    ]
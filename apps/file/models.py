@@ -1,7 +1,25 @@
-from django.db import models
+import os
+import shutil
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.core.files import File as DjangoFile
+from django.db import models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 
 from dive.base_models import BaseModel
+from utils.hashing import (
+    DIGEST_BLOCK_SIZE,
+    get_block_digest,
+    combine_block_digests,
+    get_content_digest,
+)
+from utils.readers import get_raw_rows_dir
+
+# Partially uploaded files are kept under this directory in MEDIA_ROOT
+UPLOADS_DIR = "uploads"
 
 
 class File(BaseModel):
@@ -22,8 +40,139 @@ class File(BaseModel):
     file_size = models.PositiveIntegerField(
         verbose_name=_("File size"),
     )
+    # See utils.hashing.get_content_digest()
+    content_hash = models.CharField(
+        verbose_name=_("Content hash"),
+        max_length=64,
+        null=True,
+        blank=True,
+        db_index=True,
+    )
+
+    @classmethod
+    def get_stored_file_name(cls, content_hash: str) -> str | None:
+        """Name of the stored blob of a file having the same content, if any"""
+        existing = cls.objects.filter(content_hash=content_hash).order_by("id").first()
+        return existing and existing.file.name
 
     def save(self, *args, **kwargs):
         self.full_clean()  # To enforce model CharField validation for chocies.
         # Turns out that save() alone does not do any validations on choice fields
         super().save(*args, **kwargs)
+
+
+class PartialFile(DjangoFile):
+    """
+    File of an upload, which storages keeping files on disk move into place
+    instead of copying it, as they do with temporary uploaded files
+    """
+
+    def temporary_file_path(self) -> str:
+        return self.file.name
+
+
+class FileUpload(BaseModel):
+    """
+    A file uploaded in chunks of chunk_size bytes, each appended at the offset
+    where the previous one ended. An interrupted upload is resumed from
+    uploaded_size. The digests of the chunks are kept so that the content
+    digest is computed without reading the file again.
+    """
+
+    file_name = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=20, choices=File.Type.choices)
+    total_size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField(default=DIGEST_BLOCK_SIZE)
+    uploaded_size = models.PositiveBigIntegerField(default=0)
+    chunk_digests = ArrayField(models.CharField(max_length=64), default=list)
+    content_hash = models.CharField(max_length=64, null=True, blank=True)
+    # Set once the upload is completed
+    file = models.OneToOneField(File, on_delete=models.SET_NULL, null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.file_name} ({self.uploaded_size}/{self.total_size})"
+
+    @property
+    def is_completed(self) -> bool:
+        return self.file_id is not None
+
+    @property
+    def partial_path(self) -> str:
+        return os.path.join(settings.MEDIA_ROOT, UPLOADS_DIR, f"{self.pk}.part")
+
+    def get_expected_chunk_size(self) -> int:
+        return min(self.chunk_size, self.total_size - self.uploaded_size)
+
+    def append_chunk(self, chunk: bytes):
+        """
+        Write chunk at uploaded_size. Anything after it in the partial file,
+        written by a request whose response was lost, is overwritten.
+        """
+        os.makedirs(os.path.dirname(self.partial_path), exist_ok=True)
+        mode = "r+b" if os.path.exists(self.partial_path) else "wb"
+        with open(self.partial_path, mode) as f:
+            f.seek(self.uploaded_size)
+            f.truncate()
+            f.write(chunk)
+        self.chunk_digests.append(get_block_digest(chunk))
+        self.uploaded_size += len(chunk)
+        self.save(update_fields=["chunk_digests", "uploaded_size", "modified_at"])
+
+    def complete(self) -> File:
+        """
+        Move the uploaded content to a File. If a file with the same content
+        already exists, its stored blob is used instead. The partial file, if
+        not moved, is deleted once the transaction is committed.
+        """
+        if self.chunk_size == DIGEST_BLOCK_SIZE:
+            self.content_hash = combine_block_digests(self.chunk_digests)
+        else:
+            with open(self.partial_path, "rb") as f:
+                self.content_hash = get_content_digest(f)
+        file_data = {
+            "file_type": self.file_type,
+            "file_size": self.total_size,
+            "content_hash": self.content_hash,
+            "created_by": self.created_by,
+            "modified_by": self.modified_by,
+        }
+        stored_file_name = File.get_stored_file_name(self.content_hash)
+        if stored_file_name is not None:
+            self.file = File.objects.create(file=stored_file_name, **file_data)
+        else:
+            with open(self.partial_path, "rb") as f:
+                self.file = File.objects.create(
+                    file=PartialFile(f, name=self.file_name), **file_data
+                )
+        self.save(update_fields=["content_hash", "file", "modified_at"])
+        partial_path = self.partial_path
+
+        def delete():
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+        transaction.on_commit(delete)
+        return self.file
+
+
+@receiver(post_delete, sender=File)
+def delete_raw_rows(sender, instance: File, **kwargs):
+    """
+    Delete the persisted raw rows of the file once the transaction is
+    committed, unless another file has the same content.
+    """
+    content_hash = instance.content_hash
+    if not content_hash:
+        return
+
+    def delete():
+        if not File.objects.filter(content_hash=content_hash).exists():
+            shutil.rmtree(get_raw_rows_dir(content_hash), ignore_errors=True)
+
+    transaction.on_commit(delete)
+
+
+@receiver(post_delete, sender=FileUpload)
+def delete_partial_file(sender, instance: FileUpload, **kwargs):
+    if not instance.is_completed and os.path.exists(instance.partial_path):
+        os.remove(instance.partial_path)
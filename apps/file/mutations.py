@@ -0,0 +1,111 @@
+import graphene
+from graphene_file_upload.scalars import Upload
+
+from utils.graphene.error_types import CustomErrorType, mutation_is_not_valid
+
+from .models import FileUpload
+from .schema import FileUploadType
+from .serializers import FileUploadSerializer, FileUploadChunkSerializer
+
+
+def get_upload_for_update(id) -> FileUpload | None:
+    # Locked so that concurrent requests for the same upload are serialized
+    return FileUpload.objects.select_for_update().filter(id=id).first()
+
+
+def non_field_errors(*messages: str) -> list:
+    return [dict(field="nonFieldErrors", messages=message) for message in messages]
+
+
+class InitFileUploadInputType(graphene.InputObjectType):
+    file_name = graphene.String(required=True)
+    total_size = graphene.Int(required=True)
+
+
+class InitFileUpload(graphene.Mutation):
+    """
+    Start uploading a file in chunks. The chunks are then sent with
+    appendFileUpload and the upload is finished with completeFileUpload.
+    """
+
+    class Arguments:
+        data = InitFileUploadInputType(required=True)
+
+    errors = graphene.List(graphene.NonNull(CustomErrorType))
+    ok = graphene.Boolean()
+    result = graphene.Field(FileUploadType)
+
+    @staticmethod
+    def mutate(root, info, data):
+        serializer = FileUploadSerializer(
+            data=data, context={"request": info.context.request}
+        )
+        if errors := mutation_is_not_valid(serializer):
+            return InitFileUpload(errors=errors, ok=False)
+        upload = serializer.save()
+        return InitFileUpload(result=upload, errors=None, ok=True)
+
+
+class AppendFileUploadInputType(graphene.InputObjectType):
+    offset = graphene.Int(required=True)
+    chunk = Upload(required=True)
+
+
+class AppendFileUpload(graphene.Mutation):
+    """
+    Append a chunk of chunkSize bytes, or the remaining bytes for the last one,
+    at offset which should be the uploadedSize of the upload. After a dropped
+    connection, query the upload and resume from its uploadedSize.
+    """
+
+    class Arguments:
+        data = AppendFileUploadInputType(required=True)
+        id = graphene.ID(required=True)
+
+    errors = graphene.List(graphene.NonNull(CustomErrorType))
+    ok = graphene.Boolean()
+    result = graphene.Field(FileUploadType)
+
+    @staticmethod
+    def mutate(root, info, id, data):
+        upload = get_upload_for_update(id)
+        if upload is None:
+            errors = non_field_errors("Upload does not exist.")
+            return AppendFileUpload(errors=errors, ok=False)
+        serializer = FileUploadChunkSerializer(data=data, context={"upload": upload})
+        if errors := mutation_is_not_valid(serializer):
+            return AppendFileUpload(errors=errors, ok=False, result=upload)
+        serializer.save()
+        return AppendFileUpload(result=upload, errors=None, ok=True)
+
+
+class CompleteFileUpload(graphene.Mutation):
+    """Create the file once all the chunks are uploaded"""
+
+    class Arguments:
+        id = graphene.ID(required=True)
+
+    errors = graphene.List(graphene.NonNull(CustomErrorType))
+    ok = graphene.Boolean()
+    result = graphene.Field(FileUploadType)
+
+    @staticmethod
+    def mutate(root, info, id):
+        upload = get_upload_for_update(id)
+        if upload is None:
+            errors = non_field_errors("Upload does not exist.")
+            return CompleteFileUpload(errors=errors, ok=False)
+        if not upload.is_completed:
+            if upload.uploaded_size != upload.total_size:
+                errors = non_field_errors(
+                    f"Only {upload.uploaded_size} of {upload.total_size} bytes are uploaded."
+                )
+                return CompleteFileUpload(errors=errors, ok=False, result=upload)
+            upload.complete()
+        return CompleteFileUpload(result=upload, errors=None, ok=True)
+
+
+class Mutation:
+    init_file_upload = InitFileUpload.Field()
+    append_file_upload = AppendFileUpload.Field()
+    complete_file_upload = CompleteFileUpload.Field()
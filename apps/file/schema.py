@@ -5,7 +5,7 @@ from graphene_django_extras import PageGraphqlPagination, DjangoObjectField
 from utils.graphene.types import CustomDjangoListObjectType
 from utils.graphene.fields import DjangoPaginatedListObjectField
 
-from apps.file.models import File
+from apps.file.models import File, FileUpload
 from apps.file.filter_set import FileFilterSet
 
 
@@ -30,6 +30,23 @@ class FileDetailType(
         fields = "__all__"
 
 
+class FileUploadType(DjangoObjectType):
+    class Meta:
+        model = FileUpload
+        fields = (
+            "id",
+            "file_name",
+            "file_type",
+            "total_size",
+            "chunk_size",
+            "uploaded_size",
+            "content_hash",
+            "file",
+        )
+
+    is_completed = graphene.Boolean(required=True)
+
+
 class FileListType(CustomDjangoListObjectType):
     class Meta:
         model = File
@@ -38,6 +55,7 @@ class FileListType(CustomDjangoListObjectType):
 
 class Query(graphene.ObjectType):
     file = DjangoObjectField(FileDetailType)
+    file_upload = DjangoObjectField(FileUploadType)
     files = DjangoPaginatedListObjectField(
         FileListType, pagination=PageGraphqlPagination(page_size_query_param="pageSize")
     )
@@ -1,10 +1,11 @@
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from apps.file.models import File
+from apps.file.models import File, FileUpload
 from utils.common import get_file_extension
+from utils.hashing import get_content_digest
 
-from dive.consts import MAX_FILE_SIZE_BYTES
+from dive.consts import MAX_FILE_SIZE_BYTES, MAX_CHUNKED_FILE_SIZE_BYTES
 
 EXTENSION_FILETYPE_MAP = {
     "xlsx": File.Type.EXCEL,
@@ -44,4 +45,70 @@ class FileSerializer(serializers.ModelSerializer):
         validated_data["file_size"] = file.size
         extension = get_file_extension(file.name)
         validated_data["file_type"] = EXTENSION_FILETYPE_MAP[extension]
+        validated_data["content_hash"] = get_content_digest(file)
+        file.seek(0)
+        # Files with the same content share the stored blob
+        stored_file_name = File.get_stored_file_name(validated_data["content_hash"])
+        if stored_file_name is not None:
+            validated_data["file"] = stored_file_name
         return super().create(validated_data)
+
+
+class FileUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = FileUpload
+        fields = ("id", "file_name", "total_size")
+
+    def validate_total_size(self, total_size):
+        if total_size == 0:
+            raise ValidationError("File should not be empty")
+        if total_size > MAX_CHUNKED_FILE_SIZE_BYTES:
+            raise ValidationError(
+                f"File size should be less than {MAX_CHUNKED_FILE_SIZE_BYTES}"
+            )
+        return total_size
+
+    def validate_file_name(self, file_name):
+        extension = get_file_extension(file_name)
+        if EXTENSION_FILETYPE_MAP.get(extension) is None:
+            allowed = EXTENSION_FILETYPE_MAP.values()
+            raise ValidationError(
+                f"Invalid file type. Allowed types are {allowed}. Received '{extension}'"
+            )
+        return file_name
+
+    def create(self, validated_data):
+        extension = get_file_extension(validated_data["file_name"])
+        validated_data["file_type"] = EXTENSION_FILETYPE_MAP[extension]
+        user = self.context["request"].user
+        if user.is_authenticated:
+            validated_data["created_by"] = validated_data["modified_by"] = user
+        return super().create(validated_data)
+
+
+class FileUploadChunkSerializer(serializers.Serializer):
+    """Validates a chunk to be appended to the upload in context"""
+
+    offset = serializers.IntegerField(min_value=0)
+    chunk = serializers.FileField()
+
+    def validate(self, data):
+        upload: FileUpload = self.context["upload"]
+        if upload.is_completed:
+            raise ValidationError("The upload is already completed")
+        if data["offset"] != upload.uploaded_size:
+            # The client resumes from uploaded_size
+            raise ValidationError(
+                f"Chunk should be at offset {upload.uploaded_size}, received at {data['offset']}"
+            )
+        expected_size = upload.get_expected_chunk_size()
+        if data["chunk"].size != expected_size:
+            raise ValidationError(
+                f"Chunk should be of {expected_size} bytes, received {data['chunk'].size}"
+            )
+        return data
+
+    def save(self):
+        upload: FileUpload = self.context["upload"]
+        upload.append_chunk(self.validated_data["chunk"].read())
+        return upload
@@ -0,0 +1,81 @@
+import logging
+import os
+import shutil
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from apps.file.models import File, FileUpload, UPLOADS_DIR
+from utils.readers import RAW_ROWS_DIR
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def delete_expired_file_uploads():
+    """
+    Delete incomplete uploads which have not received a chunk for
+    FILE_UPLOAD_EXPIRY_HOURS, their partial files are deleted along with them.
+    Partial files left without an incomplete upload are deleted as well.
+    """
+    expired_before = timezone.now() - timedelta(hours=settings.FILE_UPLOAD_EXPIRY_HOURS)
+    deleted, _ = FileUpload.objects.filter(
+        file__isnull=True, modified_at__lt=expired_before
+    ).delete()
+    if deleted:
+        logger.info(f"Deleted {deleted} expired file uploads")
+
+    uploads_dir = os.path.join(settings.MEDIA_ROOT, UPLOADS_DIR)
+    if not os.path.isdir(uploads_dir):
+        return
+    pending = {
+        f"{pk}.part"
+        for pk in FileUpload.objects.filter(file__isnull=True).values_list(
+            "pk", flat=True
+        )
+    }
+    for name in os.listdir(uploads_dir):
+        path = os.path.join(uploads_dir, name)
+        # Files of uploads started after listing them are recent
+        is_recent = os.path.getmtime(path) >= expired_before.timestamp()
+        if name not in pending and not is_recent:
+            os.remove(path)
+
+
+@shared_task
+def delete_unused_raw_rows():
+    """
+    Delete persisted raw rows of contents no file has, which are left by files
+    deleted before their rows were deleted along with them. Raw rows of files
+    without a content hash are deleted too, they are persisted again when the
+    files are read, as well as raw rows persisted as pickles and the temporary
+    files of reads which did not finish.
+    """
+    raw_rows_dir = os.path.join(settings.MEDIA_ROOT, RAW_ROWS_DIR)
+    if not os.path.isdir(raw_rows_dir):
+        return
+    content_hashes = set(
+        File.objects.filter(content_hash__isnull=False).values_list(
+            "content_hash", flat=True
+        )
+    )
+    # Rows being persisted for a file created after listing the hashes
+    recent_after = timezone.now() - timedelta(hours=settings.FILE_UPLOAD_EXPIRY_HOURS)
+    for content_hash in os.listdir(raw_rows_dir):
+        path = os.path.join(raw_rows_dir, content_hash)
+        is_recent = os.path.getmtime(path) >= recent_after.timestamp()
+        if not os.path.isdir(path):
+            # Rows of a read which did not finish
+            if not is_recent:
+                os.remove(path)
+            continue
+        if content_hash not in content_hashes and not is_recent:
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info(f"Deleted unused raw rows of {content_hash}")
+            continue
+        # Raw rows persisted as pickles, which are not read anymore
+        for name in os.listdir(path):
+            if name.endswith(".pickle"):
+                os.remove(os.path.join(path, name))
@@ -0,0 +1,211 @@
+import io
+import json
+import os
+import shutil
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.test import override_settings
+from django.utils import timezone
+from graphene_file_upload.django.testing import GraphQLFileUploadTestCase
+
+from utils.graphene.tests import GraphQLTestCase
+from utils.hashing import get_content_digest
+from dive.base_test import TEST_MEDIA_DIR, TEST_FILE_PATH
+from dive.factories import UserFactory
+from apps.file.models import File, FileUpload
+from apps.file.tasks import delete_expired_file_uploads
+
+CHUNK_SIZE = 1024
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_DIR)
+class TestFileUploadMutation(GraphQLFileUploadTestCase, GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.init_upload = """
+            mutation Mutation($data: InitFileUploadInputType!) {
+                initFileUpload(data: $data) {
+                    ok
+                    errors
+                    result {
+                        id
+                        fileType
+                        chunkSize
+                        uploadedSize
+                    }
+                }
+            }
+        """
+        self.append_upload = """
+            mutation Mutation($id: ID!, $data: AppendFileUploadInputType!) {
+                appendFileUpload(id: $id, data: $data) {
+                    ok
+                    errors
+                    result {
+                        uploadedSize
+                    }
+                }
+            }
+        """
+        self.complete_upload = """
+            mutation Mutation($id: ID!) {
+                completeFileUpload(id: $id) {
+                    ok
+                    errors
+                    result {
+                        isCompleted
+                        contentHash
+                        file {
+                            id
+                        }
+                    }
+                }
+            }
+        """
+        self.user = UserFactory.create()
+        self.force_login(self.user)
+        with open(TEST_FILE_PATH, "rb") as f:
+            self.content = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(TEST_MEDIA_DIR, ignore_errors=True)
+
+    def init(self, total_size: int) -> dict:
+        content = self.query_check(
+            self.init_upload,
+            variables={"data": {"fileName": "test1.xlsx", "totalSize": total_size}},
+        )
+        return content["data"]["initFileUpload"]
+
+    def append(self, upload_id: str, offset: int, chunk: bytes) -> dict:
+        response = self.client.post(
+            "/graphql/",
+            data={
+                "operations": json.dumps(
+                    {
+                        "query": self.append_upload,
+                        "variables": {
+                            "id": upload_id,
+                            "data": {"offset": offset, "chunk": None},
+                        },
+                    }
+                ),
+                "chunk": io.BytesIO(chunk),
+                "map": json.dumps({"chunk": ["variables.data.chunk"]}),
+            },
+        )
+        self.assertResponseNoErrors(response)
+        return response.json()["data"]["appendFileUpload"]
+
+    def complete(self, upload_id: str) -> dict:
+        content = self.query_check(self.complete_upload, variables={"id": upload_id})
+        return content["data"]["completeFileUpload"]
+
+    def test_upload_in_chunks(self):
+        data = self.init(len(self.content))
+        assert data["ok"] is True, data
+        upload_id = data["result"]["id"]
+        assert data["result"]["fileType"] == self.genum(File.Type.EXCEL)
+        assert data["result"]["uploadedSize"] == 0
+        FileUpload.objects.filter(id=upload_id).update(chunk_size=CHUNK_SIZE)
+
+        offset = 0
+        while offset < len(self.content):
+            chunk = self.content[offset:][:CHUNK_SIZE]
+            data = self.append(upload_id, offset, chunk)
+            assert data["ok"] is True, data
+            offset += len(chunk)
+            assert data["result"]["uploadedSize"] == offset
+            if offset == CHUNK_SIZE * 2:
+                # Retrying a chunk which was already received
+                data = self.append(upload_id, CHUNK_SIZE, chunk)
+                assert data["ok"] is False
+                assert data["result"]["uploadedSize"] == offset, "Resume from here"
+
+        data = self.complete(upload_id)
+        assert data["ok"] is True, data
+        partial_path = FileUpload.objects.get(id=upload_id).partial_path
+        assert not os.path.exists(partial_path), "Moved to the stored file"
+        result = data["result"]
+        assert result["isCompleted"] is True
+        assert result["contentHash"] == get_content_digest(io.BytesIO(self.content))
+        file_obj = File.objects.get(id=result["file"]["id"])
+        assert file_obj.file_size == len(self.content)
+        assert file_obj.content_hash == result["contentHash"]
+        with file_obj.file.open("rb") as f:
+            assert f.read() == self.content
+
+        # Uploading the same content again reuses the stored file
+        upload_id = self.init(len(self.content))["result"]["id"]
+        assert self.append(upload_id, 0, self.content)["ok"] is True
+        partial_path = FileUpload.objects.get(id=upload_id).partial_path
+        with self.captureOnCommitCallbacks(execute=True):
+            data = self.complete(upload_id)
+            assert os.path.exists(partial_path), "Deleted once committed"
+        assert not os.path.exists(partial_path)
+        assert data["result"]["contentHash"] == file_obj.content_hash
+        duplicate = File.objects.get(id=data["result"]["file"]["id"])
+        assert duplicate.id != file_obj.id
+        assert duplicate.file.name == file_obj.file.name
+
+        with mock.patch(
+            "apps.core.mutations.extract_dataset_tables.delay"
+        ) as extraction_task_func, self.captureOnCommitCallbacks(execute=True):
+            content = self.query_check(
+                """
+                mutation Mutation($data: CreateDatasetInputType!) {
+                    createDataset(data: $data) {
+                        ok
+                        result {
+                            id
+                        }
+                    }
+                }
+                """,
+                variables={"data": {"fileId": file_obj.id}},
+            )
+        dataset = content["data"]["createDataset"]
+        assert dataset["ok"] is True
+        extraction_task_func.assert_called_once_with(int(dataset["result"]["id"]))
+
+    def test_complete_incomplete_upload(self):
+        data = self.init(len(self.content))
+        upload_id = data["result"]["id"]
+        data = self.append(upload_id, 0, self.content[:10])
+        assert data["ok"] is False, "Chunks other than the last should be complete"
+        data = self.complete(upload_id)
+        assert data["ok"] is False
+        assert not FileUpload.objects.get(id=upload_id).is_completed
+
+    def test_init_upload_validation(self):
+        data = self.init(0)
+        assert data["ok"] is False
+        content = self.query_check(
+            self.init_upload,
+            variables={"data": {"fileName": "test.exe", "totalSize": 10}},
+        )
+        assert content["data"]["initFileUpload"]["ok"] is False
+
+    def test_expired_uploads_are_deleted(self):
+        uploads = []
+        for _ in range(2):
+            upload_id = self.init(len(self.content))["result"]["id"]
+            FileUpload.objects.filter(id=upload_id).update(chunk_size=CHUNK_SIZE)
+            assert self.append(upload_id, 0, self.content[:CHUNK_SIZE])["ok"] is True
+            uploads.append(FileUpload.objects.get(id=upload_id))
+        expired, recent = uploads
+        long_ago = timezone.now() - timedelta(hours=settings.FILE_UPLOAD_EXPIRY_HOURS)
+        FileUpload.objects.filter(id=expired.id).update(modified_at=long_ago)
+        # Left by an upload deleted without its partial file
+        orphan_path = os.path.join(os.path.dirname(expired.partial_path), "0.part")
+        open(orphan_path, "wb").close()
+        os.utime(orphan_path, (long_ago.timestamp(), long_ago.timestamp()))
+
+        delete_expired_file_uploads()
+        assert not FileUpload.objects.filter(id=expired.id).exists()
+        assert not os.path.exists(expired.partial_path)
+        assert not os.path.exists(orphan_path)
+        assert FileUpload.objects.filter(id=recent.id).exists()
+        assert os.path.exists(recent.partial_path)
@@ -0,0 +1,63 @@
+import os
+import shutil
+from datetime import timedelta
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from dive.base_test import TEST_MEDIA_DIR
+from utils.readers import get_raw_rows_dir
+from apps.file.models import File
+from apps.file.tasks import delete_unused_raw_rows
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_DIR)
+class TestRawRowsCleanup(TestCase):
+    def tearDown(self):
+        shutil.rmtree(TEST_MEDIA_DIR, ignore_errors=True)
+
+    def create_raw_rows(self, content_hash: str, age_hours: int = 0) -> str:
+        path = get_raw_rows_dir(content_hash)
+        os.makedirs(path)
+        open(os.path.join(path, "sheet.jsonl"), "wb").close()
+        modified_at = (timezone.now() - timedelta(hours=age_hours)).timestamp()
+        os.utime(path, (modified_at, modified_at))
+        return path
+
+    def create_file(self, content_hash: str) -> File:
+        return File.objects.create(
+            file_type=File.Type.EXCEL,
+            file="imported_files/test.xlsx",
+            file_size=1,
+            content_hash=content_hash,
+        )
+
+    def test_raw_rows_are_deleted_with_the_last_file_of_the_content(self):
+        path = self.create_raw_rows("content")
+        file_obj, duplicate = self.create_file("content"), self.create_file("content")
+        with self.captureOnCommitCallbacks(execute=True):
+            file_obj.delete()
+        assert os.path.exists(path), "Another file has the same content"
+        with self.captureOnCommitCallbacks(execute=True):
+            duplicate.delete()
+        assert not os.path.exists(path)
+
+    def test_unused_raw_rows_are_deleted(self):
+        age = settings.FILE_UPLOAD_EXPIRY_HOURS + 1
+        used = self.create_raw_rows("used", age)
+        self.create_file("used")
+        unused = self.create_raw_rows("unused", age)
+        recent = self.create_raw_rows("recent")
+        pickled = os.path.join(used, "sheet.pickle")
+        open(pickled, "wb").close()
+        unfinished = os.path.join(get_raw_rows_dir(""), "rows.tmp")
+        open(unfinished, "wb").close()
+        os.utime(unfinished, (0, 0))
+
+        delete_unused_raw_rows()
+        assert os.path.exists(used)
+        assert not os.path.exists(pickled), "Pickles are not read anymore"
+        assert not os.path.exists(unfinished)
+        assert not os.path.exists(unused)
+        assert os.path.exists(recent), "Its file may have been just created"
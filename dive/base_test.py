@@ -119,10 +119,12 @@ class BaseTestWithDataFrameAndExcel(TestCase):
             os.remove(self.excel_file_path)
 
 
-def create_test_file(file_path: str, file_name="test.xlsx") -> File:
+def create_test_file(
+    file_path: str, file_name="test.xlsx", file_type=File.Type.EXCEL
+) -> File:
     test_file = open(file_path, "rb")
     return File.objects.create(
-        file_type=File.Type.EXCEL,
+        file_type=file_type,
         # NOTE: if the name argument is not passed in the following line,
         # SuspiciousFileOperation will be raised by django as the file name
         # will be /some/absolute/path.xlsx
@@ -3,6 +3,9 @@ import pytz
 
 MAX_FILE_SIZE_MB = 10  # 10 MB limit
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+# Limit for the files uploaded in chunks, see apps.file.models.FileUpload
+MAX_CHUNKED_FILE_SIZE_MB = 500
+MAX_CHUNKED_FILE_SIZE_BYTES = MAX_CHUNKED_FILE_SIZE_MB * 1024 * 1024
 
 # Zero indexed header levels, users will be displayed 1 indexed option names
 TABLE_HEADER_LEVELS = [
@@ -2,7 +2,7 @@ import graphene
 import sentry_sdk
 
 from django.conf import settings
-from apps.file import schema as file_schema
+from apps.file import schema as file_schema, mutations as file_mutations
 from apps.core import schema as core_schema, mutations as core_mutations
 from graphql.execution import ExecutionResult
 
@@ -13,7 +13,7 @@ class Query(file_schema.Query, core_schema.Query, graphene.ObjectType):
 
 
 # mutations
-class Mutation(core_mutations.Mutation, graphene.ObjectType):
+class Mutation(core_mutations.Mutation, file_mutations.Mutation, graphene.ObjectType):
     pass
 
 
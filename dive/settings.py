@@ -46,6 +46,21 @@ env = environ.Env(
     DIVE_API_FQDN=(str, "localhost"),
     SENTRY_DSN=(str, None),
     SENTRY_SAMPLE_RATE=(float, 0.2),
+    EXTRACTION_BATCH_SIZE=(int, 5000),
+    SHEET_EXTRACTION_CONCURRENCY=(int, 4),
+    PREVIEW_CACHE_MAX_BYTES=(int, 64 * 1024 * 1024),
+    PARSE_CACHE_MAX_SIZE=(int, 100000),
+    STATS_APPROXIMATE_AFTER=(int, 1000000),
+    STATS_DISTINCT_COUNT_ERROR=(float, 0.01),
+    STATS_QUANTILE_ERROR=(float, 0.01),
+    STATS_HISTOGRAM_BINS=(int, 20),
+    STATS_TOP_VALUES=(int, 10),
+    STATS_CONCURRENCY=(int, 0),
+    STATS_PARALLEL_MIN_VALUES=(int, 1000000),
+    STATS_BACKGROUND_MIN_VALUES=(int, 1000000),
+    STATS_TASK_COLUMNS=(int, 8),
+    STATS_CALCULATING_TIMEOUT=(int, 30 * 60),
+    FILE_UPLOAD_EXPIRY_HOURS=(int, 24),
 )
 
 
@@ -229,11 +244,62 @@ GRAPHENE_NODES_WHITELIST = (
 )
 
 BROKER_URL = env("CELERY_REDIS_URL")
+# Chords, e.g. of the tasks extracting sheet previews, need results
+CELERY_RESULT_BACKEND = env("CELERY_REDIS_URL")
 # CELERY_TIMEZONE = TIME_ZONE
 # CELERY_ACKS_LATE = True
+CELERYBEAT_SCHEDULE = {
+    "delete-expired-file-uploads": {
+        "task": "apps.file.tasks.delete_expired_file_uploads",
+        "schedule": 60 * 60,
+    },
+    "delete-unused-raw-rows": {
+        "task": "apps.file.tasks.delete_unused_raw_rows",
+        "schedule": 24 * 60 * 60,
+    },
+}
 
 TEST_DIR = os.path.join(BASE_DIR, "dive/test_files")
 
+# Number of rows read at a time while extracting full table data
+EXTRACTION_BATCH_SIZE = env("EXTRACTION_BATCH_SIZE")
+# Maximum number of celery tasks extracting previews of sheets of a dataset
+# at once, 1 to extract them in the task creating its tables
+SHEET_EXTRACTION_CONCURRENCY = env("SHEET_EXTRACTION_CONCURRENCY")
+# Maximum size of the previews cached in each process, as json
+PREVIEW_CACHE_MAX_BYTES = env("PREVIEW_CACHE_MAX_BYTES")
+# Maximum number of values whose parsed result is cached in each process
+PARSE_CACHE_MAX_SIZE = env("PARSE_CACHE_MAX_SIZE")
+# Non null values of a column after which its unique count and median are
+# estimated by sketches, unless the table properties say otherwise
+STATS_APPROXIMATE_AFTER = env("STATS_APPROXIMATE_AFTER")
+# Relative standard error of the estimated unique counts
+STATS_DISTINCT_COUNT_ERROR = env("STATS_DISTINCT_COUNT_ERROR")
+# Rank error of the estimated medians, as a fraction of the number of values
+STATS_QUANTILE_ERROR = env("STATS_QUANTILE_ERROR")
+# Number of bins of the histograms of numeric and temporal columns
+STATS_HISTOGRAM_BINS = env("STATS_HISTOGRAM_BINS")
+# Number of the most frequent values of string columns kept in their stats
+STATS_TOP_VALUES = env("STATS_TOP_VALUES")
+# Maximum number of processes calculating stats of columns, 0 for the number
+# of available cores, 1 to calculate them in the calling process
+STATS_CONCURRENCY = env("STATS_CONCURRENCY")
+# Number of values of all the columns below which their stats are calculated
+# in the calling process, as starting the processes would take longer
+STATS_PARALLEL_MIN_VALUES = env("STATS_PARALLEL_MIN_VALUES")
+# Number of values of the columns whose stats are asked for from which the
+# stats are calculated by celery tasks instead of in the request
+STATS_BACKGROUND_MIN_VALUES = env("STATS_BACKGROUND_MIN_VALUES")
+# Number of columns whose stats each of those celery tasks calculates
+STATS_TASK_COLUMNS = env("STATS_TASK_COLUMNS")
+# Seconds after which columns queued to those celery tasks are queued again
+# if their stats are still not calculated, e.g. as the task was lost
+STATS_CALCULATING_TIMEOUT = env("STATS_CALCULATING_TIMEOUT")
+# Hours after the last chunk after which incomplete file uploads are deleted
+# along with their partial files, also the age after which persisted raw
+# rows of no file are deleted
+FILE_UPLOAD_EXPIRY_HOURS = env("FILE_UPLOAD_EXPIRY_HOURS")
+
 
 # Sentry Config
 DIVE_ENVIRONMENT = (env("DIVE_ENVIRONMENT"),)
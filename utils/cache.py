@@ -0,0 +1,59 @@
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """
+    In process cache which evicts least recently used items once the total
+    size of the items exceeds max_size. The size of an item is given by the
+    caller, in whatever unit max_size is. Lookups are counted in hits and
+    misses.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.__items: "OrderedDict[Hashable, Tuple[V, int]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __contains__(self, key: Hashable):
+        return key in self.__items
+
+    def get(self, key: Hashable, default: Any = None) -> Optional[V]:
+        item = self.__items.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.__items.move_to_end(key)
+        return item[0]
+
+    def set(self, key: Hashable, value: V, size: int = 1):
+        self.pop(key)
+        if size > self.max_size:
+            # Would evict everything else and still not fit
+            return
+        self.__items[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted_size) = self.__items.popitem(last=False)
+            self.size -= evicted_size
+
+    def pop(self, key: Hashable, default: Any = None) -> Optional[V]:
+        item = self.__items.pop(key, None)
+        if item is None:
+            return default
+        self.size -= item[1]
+        return item[0]
+
+    def clear(self):
+        self.__items.clear()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
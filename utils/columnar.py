@@ -0,0 +1,381 @@
+"""
+Column oriented storage of table rows, which are lists of dicts. Rows are
+written a batch at a time, each batch as a row group whose columns are
+stored as typed buffers along with a bitmap of their non null values, so
+that readers can load only the columns and row ranges they need:
+
+    MAGIC | buffers of each row group | json footer | footer length (uint64)
+
+The footer has the number of rows, the keys of the rows and, for each row
+group, its number of rows and for each of its columns, the key, kind and the
+[offset, size] of each of its buffers in the file, along with the metadata
+the writer was given. Rows of a row group have
+the same keys, keys missing in a row group are None in its rows. The footer
+is at the end so that the rows can be written without knowing all of them.
+Files of the first version have the header of a single row group at the
+start instead:
+
+    MAGIC_V1 | header length (uint64) | json header | buffers
+
+Arrow IPC or Parquet files would do the same, but pyarrow is a large binary
+dependency for the few things snapshots need: reading some of the columns of
+a range of rows and the row count from the footer. Its kinds also keep the
+python types of the rows as they are, e.g. ints and floats mixed in number
+columns, which arrow would need extension types for.
+"""
+import io
+import json
+import struct
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"DIVECOL2"
+MAGIC_V1 = b"DIVECOL1"
+HEADER_LENGTH_FORMAT = "<Q"
+# Buffers start at multiples of this, so they can be memory mapped as arrays
+BUFFER_ALIGNMENT = 8
+# Largest integer stored exactly in a float64, for number columns
+MAX_FLOAT_INT = 2**53
+
+# Dtypes of the fixed width buffers of each kind of column. Strings and json
+# values have utf-8 bytes and the end offsets of each value in them instead.
+FIXED_WIDTH_DTYPES = {
+    "int": np.dtype("<i8"),
+    "float": np.dtype("<f8"),
+    # Floats along with a mask of which of them were ints, as number columns
+    # have both
+    "number": np.dtype("<f8"),
+    "bool": np.dtype("bool"),
+}
+# Buffers of masks, which are stored as bitmaps
+BITMAPS = ("validity", "ints")
+STRING_KINDS = ("string", "json")
+OFFSETS_DTYPE = np.dtype("<i8")
+# Strings are stored as codes of a dictionary of the distinct strings if
+# there are at most this share of them
+MAX_DICTIONARY_SHARE = 0.5
+CODES_DTYPE = np.dtype("<i4")
+
+
+class ColumnarWriter:
+    """
+    Writes rows to f a batch at a time, so that only a batch is in memory.
+    Call close() to write the footer once all the batches are written. The
+    rows written so far can be read by reader() meanwhile.
+    """
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.keys: List[str] = []
+        self.num_rows = 0
+        self.row_groups: List[dict] = []
+        # Json serializable details of the rows for their readers
+        self.metadata: Dict[str, Any] = {}
+        f.write(MAGIC)
+        self.offset = len(MAGIC)
+
+    def write_batch(self, rows: Sequence[Dict[str, Any]]):
+        if not rows:
+            return
+        keys = list(rows[0])
+        if any(len(row) != len(keys) for row in rows):
+            raise ValueError("Rows should have the same keys")
+        self.keys.extend(key for key in keys if key not in self.keys)
+        # Readers may have moved the file position
+        self.f.seek(self.offset)
+        columns = []
+        for key in keys:
+            kind, buffers = encode_column([row[key] for row in rows], self.num_rows)
+            for name in BITMAPS:
+                if name in buffers:
+                    buffers[name] = np.packbits(buffers[name], bitorder="little")
+            locations = {}
+            for name, array in buffers.items():
+                start = align(self.offset)
+                self.f.write(b"\0" * (start - self.offset))
+                self.f.write(array.tobytes())
+                locations[name] = [start, array.nbytes]
+                self.offset = start + array.nbytes
+            columns.append({"key": key, "kind": kind, "buffers": locations})
+        self.row_groups.append({"num_rows": len(rows), "columns": columns})
+        self.num_rows += len(rows)
+
+    def get_footer(self) -> dict:
+        return {
+            "num_rows": self.num_rows,
+            "keys": self.keys,
+            "row_groups": self.row_groups,
+            "metadata": self.metadata,
+        }
+
+    def reader(self) -> "ColumnarReader":
+        """Reader of the rows written so far"""
+        return ColumnarReader(self.f, self.get_footer())
+
+    def close(self):
+        footer = json.dumps(self.get_footer()).encode()
+        self.f.seek(self.offset)
+        self.f.write(footer)
+        self.f.write(struct.pack(HEADER_LENGTH_FORMAT, len(footer)))
+
+
+def write_rows(rows: Sequence[Dict[str, Any]], f: BinaryIO):
+    writer = ColumnarWriter(f)
+    writer.write_batch(rows)
+    writer.close()
+
+
+def align(offset: int) -> int:
+    return -(-offset // BUFFER_ALIGNMENT) * BUFFER_ALIGNMENT
+
+
+def encode_column(
+    values: List[Any], start: int = 0
+) -> Tuple[str, Dict[str, np.ndarray]]:
+    """
+    Kind of the column and its buffers, the narrowest kind fitting the values
+    of the rows from start
+    """
+    validity = np.fromiter(
+        (x is not None for x in values), dtype=bool, count=len(values)
+    )
+    types = {type(x) for x in values if x is not None}
+    if types <= {bool} and types:
+        kind = "bool"
+    elif types <= {int} and types:
+        kind = "int"
+    elif types <= {float} and types:
+        kind = "float"
+    elif types <= {int, float} and types:
+        kind = "number"
+    elif types <= {str} and values == [
+        str(i) for i in range(start, start + len(values))
+    ]:
+        # Row keys, which are their row numbers
+        return "row_number", {"validity": validity}
+    elif types <= {str}:
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        if len(uniques) > MAX_DICTIONARY_SHARE * len(values):
+            kind = "string"
+        else:
+            dictionary = np.empty(len(uniques), dtype=object)
+            dictionary[:] = uniques.tolist()
+            data, offsets = encode_strings(dictionary, np.zeros(len(uniques), bool))
+            return "dictionary", {
+                "validity": validity,
+                "codes": codes.astype(CODES_DTYPE),
+                "data": data,
+                "offsets": offsets.astype(OFFSETS_DTYPE),
+            }
+    else:
+        kind = "json"
+    try:
+        return kind, {"validity": validity, **encode_values(kind, values, ~validity)}
+    except OverflowError:
+        # Integers too large for int64 or float64
+        return "json", {
+            "validity": validity,
+            **encode_values("json", values, ~validity),
+        }
+
+
+def encode_values(
+    kind: str, values: List[Any], nulls: np.ndarray
+) -> Dict[str, np.ndarray]:
+    if kind in STRING_KINDS:
+        if kind == "json":
+            values = [None if x is None else json.dumps(x) for x in values]
+        strings = np.empty(len(values), dtype=object)
+        strings[:] = values
+        data, offsets = encode_strings(strings, nulls)
+        return {"data": data, "offsets": offsets.astype(OFFSETS_DTYPE)}
+    dtype = FIXED_WIDTH_DTYPES[kind]
+    present = np.fromiter(
+        (0 if x is None else x for x in values), dtype=dtype, count=len(values)
+    )
+    if kind != "number":
+        return {"values": present}
+    ints = np.fromiter((type(x) is int for x in values), dtype=bool, count=len(values))
+    if np.any(np.abs(present[ints]) > MAX_FLOAT_INT):
+        raise OverflowError("Integers too large to be numbers")
+    return {"values": present, "ints": ints}
+
+
+def encode_strings(
+    values: np.ndarray, nulls: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """utf-8 bytes of all of the strings and the end offsets of each of them"""
+    encoded = [b"" if is_null else x.encode() for x, is_null in zip(values, nulls)]
+    offsets = np.cumsum(
+        np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    )
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def decode_strings(
+    data: np.ndarray, offsets: np.ndarray, nulls: np.ndarray
+) -> np.ndarray:
+    raw = data.tobytes()
+    starts = np.concatenate([[0], offsets[:-1]]).tolist()
+    values = np.empty(len(offsets), dtype=object)
+    values[:] = [
+        None if is_null else raw[start:end].decode()
+        for start, end, is_null in zip(starts, offsets.tolist(), nulls.tolist())
+    ]
+    return values
+
+
+class ColumnarReader:
+    """
+    Reads columns, or ranges of rows of them, from a file written by
+    ColumnarWriter without reading the rest of the file. The footer is read
+    from the file unless given.
+    """
+
+    def __init__(self, f: BinaryIO, footer: Optional[dict] = None):
+        self.f = f
+        if footer is None:
+            footer = read_footer(f)
+        self.num_rows: int = footer["num_rows"]
+        self.keys: List[str] = footer["keys"]
+        self.metadata: Dict[str, Any] = footer.get("metadata", {})
+        # (first row, columns by key) of each row group
+        self.row_groups: List[Tuple[int, Dict[str, dict]]] = []
+        start = 0
+        for row_group in footer["row_groups"]:
+            columns = {x["key"]: x for x in row_group["columns"]}
+            self.row_groups.append((start, columns))
+            start += row_group["num_rows"]
+        self.row_group_stops = [start for start, _ in self.row_groups[1:]] + [
+            self.num_rows
+        ]
+
+    def get_kinds(self, key: str) -> List[str]:
+        """Kinds of the column in each of the row groups having it"""
+        return [
+            columns[key]["kind"] for _, columns in self.row_groups if key in columns
+        ]
+
+    def read_rows(
+        self,
+        keys: Optional[Sequence[str]] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Rows from start to stop, having only the given keys if any"""
+        keys = self.keys if keys is None else keys
+        columns = [self.read_column(key, start, stop) for key in keys]
+        return [dict(zip(keys, values)) for values in zip(*columns)]
+
+    def read_column(
+        self, key: str, start: int = 0, stop: Optional[int] = None
+    ) -> List[Any]:
+        start, stop, _ = slice(start, stop).indices(self.num_rows)
+        values: List[Any] = []
+        for _, group_values in self.iter_column(key, start, stop):
+            values.extend(group_values)
+        return values
+
+    def iter_column(
+        self, key: str, start: int = 0, stop: Optional[int] = None
+    ) -> Iterator[Tuple[int, List[Any]]]:
+        """(first row, values) of the column in each row group from start to stop"""
+        start, stop, _ = slice(start, stop).indices(self.num_rows)
+        for (group_start, columns), group_stop in zip(
+            self.row_groups, self.row_group_stops
+        ):
+            first, last = max(start, group_start), min(stop, group_stop)
+            if first >= last:
+                continue
+            if key not in columns:
+                yield first, [None] * (last - first)
+                continue
+            yield first, self.read_group_column(
+                columns[key], group_start, first - group_start, last - group_start
+            )
+
+    def read_group_column(
+        self, column: dict, group_start: int, start: int, stop: int
+    ) -> List[Any]:
+        validity = self.read_bitmap(column, "validity", start, stop)
+        kind = column["kind"]
+        if kind in STRING_KINDS:
+            return self.read_strings(column, validity, start, stop)
+        if kind == "row_number":
+            return [str(i) for i in range(group_start + start, group_start + stop)]
+        if kind == "dictionary":
+            _, size = column["buffers"]["offsets"]
+            count = size // OFFSETS_DTYPE.itemsize
+            dictionary = self.read_strings(column, np.ones(count, bool), 0, count)
+            codes = self.read_buffer(column, "codes", CODES_DTYPE, start, stop)
+            return [
+                dictionary[code] if is_valid else None
+                for code, is_valid in zip(codes.tolist(), validity.tolist())
+            ]
+        values = self.read_buffer(
+            column, "values", FIXED_WIDTH_DTYPES[kind], start, stop
+        ).tolist()
+        if kind == "number":
+            ints = self.read_bitmap(column, "ints", start, stop)
+            values = [int(x) if y else x for x, y in zip(values, ints.tolist())]
+        return [
+            x if is_valid else None for x, is_valid in zip(values, validity.tolist())
+        ]
+
+    def read_strings(
+        self, column: dict, validity: np.ndarray, start: int, stop: int
+    ) -> List[Any]:
+        # The value before start ends where the values to read begin
+        first = max(start - 1, 0)
+        ends = self.read_buffer(column, "offsets", OFFSETS_DTYPE, first, stop)
+        begin = int(ends[0]) if start > 0 and len(ends) else 0
+        skipped = start - first
+        ends = ends[skipped:]
+        data_offset, _ = column["buffers"]["data"]
+        end = int(ends[-1]) if len(ends) else begin
+        self.f.seek(data_offset + begin)
+        data = np.frombuffer(self.f.read(end - begin), dtype=np.uint8)
+        values = decode_strings(data, ends - begin, ~validity).tolist()
+        if column["kind"] == "json":
+            return [None if x is None else json.loads(x) for x in values]
+        return values
+
+    def read_buffer(
+        self, column: dict, name: str, dtype: np.dtype, start: int, stop: int
+    ) -> np.ndarray:
+        offset, _ = column["buffers"][name]
+        self.f.seek(offset + start * dtype.itemsize)
+        return np.frombuffer(self.f.read((stop - start) * dtype.itemsize), dtype=dtype)
+
+    def read_bitmap(self, column: dict, name: str, start: int, stop: int) -> np.ndarray:
+        first_byte, end_byte = start // 8, -(-stop // 8)
+        offset, _ = column["buffers"][name]
+        self.f.seek(offset + first_byte)
+        raw = np.frombuffer(self.f.read(end_byte - first_byte), dtype=np.uint8)
+        skipped = start - first_byte * 8
+        bits = np.unpackbits(raw, bitorder="little").astype(bool)[skipped:]
+        return bits[: stop - start]
+
+
+def read_footer(f: BinaryIO) -> dict:
+    f.seek(0)
+    magic = f.read(len(MAGIC))
+    if magic == MAGIC_V1:
+        (header_length,) = struct.unpack(
+            HEADER_LENGTH_FORMAT, f.read(struct.calcsize(HEADER_LENGTH_FORMAT))
+        )
+        header = json.loads(f.read(header_length))
+        return {
+            "num_rows": header["num_rows"],
+            "keys": [x["key"] for x in header["columns"]],
+            "row_groups": [header] if header["columns"] else [],
+        }
+    if magic != MAGIC:
+        raise ValueError("Not a columnar rows file")
+    length_size = struct.calcsize(HEADER_LENGTH_FORMAT)
+    f.seek(-length_size, io.SEEK_END)
+    (footer_length,) = struct.unpack(HEADER_LENGTH_FORMAT, f.read(length_size))
+    f.seek(-length_size - footer_length, io.SEEK_END)
+    return json.loads(f.read(footer_length))
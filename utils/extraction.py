@@ -1,4 +1,6 @@
 from typing import (
+    Iterable,
+    Iterator,
     Tuple,
     Optional,
     Union,
@@ -6,12 +8,30 @@ from typing import (
     Any,
     List,
     Dict,
+    Sequence,
 )
+import copy
+import json
+from datetime import datetime
+
 import pandas as pd
 import numpy as np
+from django.conf import settings
 
 from .common import ColumnTypes, float_r
-from .parsing import parse_int, parse
+from .parsing import Parser, DEFAULT_PARSER, get_table_parser, parse_int
+from .readers import FileSession
+from .inference import infer_column_types
+from .stats import (
+    StatsAccumulator,
+    calculate_columns_stats,
+    calculate_stats,
+    get_approximate_stats_after,
+    get_stats_accumulator,
+    to_column_array,
+)
+from .cache import LRUCache
+from .columnar import ColumnarReader, ColumnarWriter
 from apps.core.types import TablePropertiesDict, ExtractedData, ColumnStats, Column
 
 
@@ -20,26 +40,73 @@ PreviewResult = Union[
     Tuple[Optional[ExtractedData], str],
 ]
 
-INFINITY = float("inf")
+# Types which columns are widened to when some of their values do not conform
+# to them, the rest are widened to strings
+WIDER_COLUMN_TYPES = {ColumnTypes.INTEGER: ColumnTypes.FLOAT}
+
+# Extracted previews by (file content hash, sheet, normalized properties)
+__PREVIEW_CACHE: LRUCache[ExtractedData] = LRUCache(settings.PREVIEW_CACHE_MAX_BYTES)
+
+
+def extract_preview_data(
+    session: FileSession,
+    sheetname: str,
+    table_properties: TablePropertiesDict,
+) -> PreviewResult:
+    """
+    Extract preview from the top rows of the sheet, which are read only once
+    per session for all header levels and table properties.
+    """
+    header_level = parse_int(table_properties["headerLevel"]) or 0
+    return extract_data_from_batches(
+        session.get_extra_headers(sheetname, header_level),
+        [session.get_preview_df(sheetname, header_level)],
+        table_properties,
+    )
 
 
-def get_col_type_from_pd_type(pd_type) -> ColumnTypes:
-    pd_type_str = str(pd_type).lower()
-    if "int" in pd_type_str:
-        return ColumnTypes.INTEGER
-    elif "float" in pd_type_str:
-        return ColumnTypes.FLOAT
-    elif "datetime" in pd_type_str:
-        return ColumnTypes.DATETIME
-    return ColumnTypes.STRING
+def get_preview_cache_key(
+    session: FileSession, sheetname: str, table_properties: TablePropertiesDict
+) -> Tuple[str, str, str]:
+    # Only the properties previews depend on, so that the rest do not keep
+    # previews from being reused
+    normalized_props = {
+        "headerLevel": parse_int(table_properties["headerLevel"]) or 0,
+        "trimWhitespaces": bool(table_properties.get("trimWhitespaces", False)),
+        "treatTheseAsNa": table_properties.get("treatTheseAsNa"),
+        "timezone": table_properties.get("timezone"),
+        "language": table_properties.get("language"),
+    }
+    # Files are not hashed for previews, files whose content hash is unknown
+    # are told apart by their path and signature instead
+    content_key = session.known_content_hash or f"{session.path}:{session.signature}"
+    return (content_key, sheetname, json.dumps(normalized_props, sort_keys=True))
 
 
-def extract_preview_data_from_excel(
-    xl: pd.ExcelFile,
+def extract_preview_data_cached(
+    session: FileSession,
     sheetname: str,
     table_properties: TablePropertiesDict,
 ) -> PreviewResult:
-    return extract_data_from_excel(xl, sheetname, table_properties, is_preview=True)
+    """
+    extract_preview_data() whose successful results are cached in process by
+    file content, so that switching back to recent table properties does not
+    read the file again.
+    """
+    key = get_preview_cache_key(session, sheetname, table_properties)
+    cached = __PREVIEW_CACHE.get(key)
+    if cached is not None:
+        # Callers are free to modify the result
+        return copy.deepcopy(cached), None
+    preview_data, err = extract_preview_data(session, sheetname, table_properties)
+    if preview_data is not None:
+        size = len(json.dumps(preview_data, default=str))
+        __PREVIEW_CACHE.set(key, copy.deepcopy(preview_data), size)
+    return preview_data, err
+
+
+def clear_preview_cache():
+    __PREVIEW_CACHE.clear()
 
 
 def extract_data_from_excel(
@@ -48,7 +115,14 @@ def extract_data_from_excel(
     table_properties: TablePropertiesDict,
     is_preview: bool = False,
     calculate_stats=False,
+    vectorized=True,
 ) -> PreviewResult:
+    """
+    Extract rows, columns and optionally column stats from an excel sheet.
+    With vectorized=True(default), values are converted a column at a time and
+    rows are built only at the end. vectorized=False falls back to the per
+    cell conversion.
+    """
     header_level = parse_int(table_properties["headerLevel"]) or 0
     # extract and save other header levels if header_level >= 1
     extra_headers: List[List[str]] = (
@@ -63,24 +137,302 @@ def extract_data_from_excel(
             header=header_level,
         ),
     )
+    df = prepare_df(df, table_properties)
+    columns, confidences = get_columns_from_df(df)
+
+    trimWhitespaces = table_properties.get("trimWhitespaces", False)
+    parser = get_table_parser(table_properties)
+
+    # Types are widened first for values outside the sample not conforming
+    # to them, so that per cell extraction has the same types
+    column_values = {}
+    for j, col in enumerate(columns):
+        series = df.iloc[:, j]
+        coltype, values, unparsed = get_conforming_column_values(
+            series, col["type"], trimWhitespaces, parser
+        )
+        if coltype != col["type"]:
+            col["type"] = coltype
+            confidences[col["key"]] = get_widened_confidence(
+                coltype, unparsed, series.count()
+            )
+        column_values[col["key"]] = values
+
+    if vectorized:
+        rows = get_rows_from_column_values(column_values, columns, len(df))
+        column_stats = (
+            calculate_column_stats_from_values(
+                column_values, columns, get_approximate_stats_after(table_properties)
+            )
+            if calculate_stats
+            else None
+        )
+    else:
+        rows = get_rows_from_df(df, columns, trimWhitespaces, parser)
+        column_stats = (
+            calculate_column_stats(
+                rows, columns, get_approximate_stats_after(table_properties)
+            )
+            if calculate_stats
+            else None
+        )
+
+    extracted: ExtractedData = {
+        "rows": rows,
+        "columns": columns,
+        "extra_headers": extra_headers,
+        "column_stats": column_stats,
+        "column_type_confidences": confidences,
+    }
+    return extracted, None
+
+
+def extract_data_in_batches(
+    session: FileSession,
+    sheetname: str,
+    table_properties: TablePropertiesDict,
+    calculate_stats=False,
+    batch_size: Optional[int] = None,
+    writer: Optional[ColumnarWriter] = None,
+) -> PreviewResult:
+    """
+    Extract data from excel sheet or csv reading batch_size rows at a time
+    instead of loading the whole file in memory. The rows are written to
+    writer if any, see extract_data_from_batches().
+    """
+    header_level = parse_int(table_properties["headerLevel"]) or 0
+    extra_headers, batches = session.read_in_batches(
+        sheetname, header_level=header_level, batch_size=batch_size
+    )
+    return extract_data_from_batches(
+        extra_headers,
+        batches,
+        table_properties,
+        calculate_stats=calculate_stats,
+        writer=writer,
+    )
+
+
+def extract_data_from_batches(
+    extra_headers: List[List[str]],
+    batches: Iterable[pd.DataFrame],
+    table_properties: TablePropertiesDict,
+    calculate_stats=False,
+    writer: Optional[ColumnarWriter] = None,
+) -> PreviewResult:
+    """
+    Extract data from dataframes having the columns of the previous ones and
+    possibly more. Column types are decided from the batch a column first
+    appears in and values of the later batches are parsed to those types,
+    which are widened if any of the values do not conform to them. Earlier rows have
+    None for the columns added later. Stats are accumulated batch by batch.
+
+    Given a writer, the rows of each batch are written to it instead of being
+    returned, so that only the counts and the stats of the columns are kept
+    between batches. Values written before their column was widened are not
+    rewritten, the metadata of the writer has the types of the widened columns
+    for readers to convert them with widen_values().
+    """
+    trimWhitespaces = table_properties.get("trimWhitespaces", False)
+    parser = get_table_parser(table_properties)
+    approximate_after = get_approximate_stats_after(table_properties)
+    columns: List[Column] = []
+    confidences: Dict[str, float] = {}
+    accumulators: Dict[str, StatsAccumulator] = {}
+    # Non null values of each column so far
+    counts: Dict[str, int] = {}
+    widened: List[Column] = []
+    rows: List[Dict[str, Any]] = []
+    num_rows = 0
+
+    def get_earlier_values(key: str) -> Iterator[list]:
+        if writer is None:
+            yield [row[key] for row in rows]
+            return
+        for _, values in writer.reader().iter_column(key):
+            yield values
+
+    for batch in batches:
+        batch = prepare_df(batch, table_properties)
+        known = len(columns)
+        if batch.shape[1] > known:
+            new_columns, new_confidences = get_columns_from_df(
+                batch.iloc[:, known:], start=known
+            )
+            for col in new_columns:
+                if writer is None:
+                    for row in rows:
+                        row[col["key"]] = None
+                counts[col["key"]] = 0
+                accumulators[col["key"]] = get_stats_accumulator(
+                    col["type"], approximate_after
+                )
+                accumulators[col["key"]].add_nulls(num_rows)
+            columns.extend(new_columns)
+            confidences.update(new_confidences)
+        batch_values: Dict[str, list] = {}
+        for j, col in enumerate(columns):
+            key = col["key"]
+            series = batch.iloc[:, j]
+            coltype, values, unparsed = get_conforming_column_values(
+                series, col["type"], trimWhitespaces, parser
+            )
+            counts[key] += int(series.count())
+            if coltype != col["type"]:
+                # Earlier values all conform to the narrower type
+                confidences[key] = get_widened_confidence(
+                    coltype, unparsed, counts[key]
+                )
+                col["type"] = coltype
+                if col not in widened:
+                    widened.append(col)
+                if calculate_stats and coltype == ColumnTypes.STRING:
+                    # Numeric stats of the earlier values stay valid for
+                    # wider numeric types, not for strings
+                    accumulators[key] = get_stats_accumulator(
+                        coltype, approximate_after
+                    )
+                    for earlier in get_earlier_values(key):
+                        accumulators[key].add(widen_values(earlier, coltype), coltype)
+            batch_values[key] = values
+        batch_rows = get_rows_from_column_values(
+            batch_values, columns, len(batch), start=num_rows
+        )
+        if writer is None:
+            rows.extend(batch_rows)
+        else:
+            writer.write_batch(batch_rows)
+        num_rows += len(batch)
+        if calculate_stats:
+            for col in columns:
+                accumulators[col["key"]].add(batch_values[col["key"]], col["type"])
+
+    if writer is None:
+        for col in widened:
+            widen_column(col, rows)
+    else:
+        writer.metadata["widened"] = {col["key"]: col["type"] for col in widened}
+    extracted: ExtractedData = {
+        "rows": rows,
+        "columns": columns,
+        "extra_headers": extra_headers,
+        "column_stats": finalize_column_stats(accumulators, columns)
+        if calculate_stats
+        else None,
+        "column_type_confidences": confidences,
+    }
+    return extracted, None
+
+
+def get_conforming_column_values(
+    series: pd.Series,
+    coltype: ColumnTypes,
+    trim_whitespaces: bool,
+    parser: Parser = DEFAULT_PARSER,
+) -> Tuple[ColumnTypes, list, int]:
+    """
+    Values of a column as per get_column_values(), widening its type until
+    all of them conform to it instead of them becoming None, strings always
+    conform. Returns the type, the values and the number of values which did
+    not conform to the given type.
+    """
+    values = get_column_values(series, coltype, trim_whitespaces, parser)
+    unparsed = count_unparsed_values(series, values)
+    failed = unparsed
+    while failed:
+        coltype = WIDER_COLUMN_TYPES.get(coltype, ColumnTypes.STRING)
+        values = get_column_values(series, coltype, trim_whitespaces, parser)
+        failed = count_unparsed_values(series, values)
+    return coltype, values, unparsed
+
+
+def count_unparsed_values(series: pd.Series, values: list) -> int:
+    """Number of the non null items of series which were converted to None"""
+    return sum(x is not None and y is None for x, y in zip(series.tolist(), values))
+
+
+def get_widened_confidence(coltype: ColumnTypes, unparsed: int, count: int) -> float:
+    """
+    Confidence of a widened type out of count non null values, unparsed of
+    which did not conform to the inferred type. For strings it is the share
+    of them, as the rest are of the inferred type.
+    """
+    if coltype != ColumnTypes.STRING or count == 0:
+        return 1.0
+    return round(unparsed / count, 4)
+
+
+def widen_values(values: list, coltype: ColumnTypes) -> list:
+    """
+    Values extracted as a narrower type converted to the type their column
+    was widened to, values already of that type are kept as they are
+    """
+    convert = float_r if coltype == ColumnTypes.FLOAT else str
+    return [value if value is None else convert(value) for value in values]
+
+
+def read_extracted_rows(
+    reader: ColumnarReader,
+    keys: Optional[Sequence[str]] = None,
+    start: int = 0,
+    stop: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    ColumnarReader.read_rows() of rows written by extract_data_from_batches(),
+    with the values written before their columns were widened converted
+    """
+    rows = reader.read_rows(keys, start, stop)
+    for key, coltype in reader.metadata.get("widened", {}).items():
+        if keys is None or key in keys:
+            values = widen_values([row[key] for row in rows], coltype)
+            for row, value in zip(rows, values):
+                row[key] = value
+    return rows
+
+
+def widen_column(col: Column, rows: List[Dict[str, Any]]):
+    """Convert the extracted values of a widened column to its type"""
+    key = col["key"]
+    values = widen_values([row[key] for row in rows], col["type"])
+    for row, value in zip(rows, values):
+        row[key] = value
+
+
+def prepare_df(df: pd.DataFrame, table_properties: TablePropertiesDict):
     na_replacement = {
         pd.NaT: None,
         np.nan: None,
         table_properties.get("treatTheseAsNa"): None,
     }
+    # Columns having nulls become objects, their types are inferred from the
+    # values by get_columns_from_df()
+    return df.replace(na_replacement)
 
-    # convert_dtypes() is to prevent df from treating most cols as 'objects',
-    # instead try to parse the correct type
-    df = df.convert_dtypes()
 
-    df.replace(na_replacement, inplace=True)
+def get_columns_from_df(
+    df: pd.DataFrame, start: int = 0
+) -> Tuple[List[Column], Dict[str, float]]:
+    """
+    Returns columns and the confidence of their inferred types by key, the
+    keys are the positions of the columns from start.
+    """
+    columns: List[Column] = []
+    confidences: Dict[str, float] = {}
+    for i, (col, (coltype, confidence)) in enumerate(
+        zip(df.columns, infer_column_types(df)), start
+    ):
+        columns.append({"key": str(i), "label": str(col), "type": coltype})
+        confidences[str(i)] = confidence
+    return columns, confidences
 
-    columns: List[Column] = [
-        {"key": str(i), "label": str(col), "type": get_col_type_from_pd_type(coltype)}
-        for i, (col, coltype) in enumerate(zip(df.columns, df.dtypes))
-    ]
 
-    trimWhitespaces = table_properties.get("trimWhitespaces", False)
+def get_rows_from_df(
+    df: pd.DataFrame,
+    columns: List[Column],
+    trim_whitespaces: bool,
+    parser: Parser = DEFAULT_PARSER,
+) -> List[Dict[str, Any]]:
+    """Per cell extraction of rows, this is slow and is kept as a fallback"""
 
     def get_ith_row_from_df(i):
         # Add an attribute key to each the row item, it's okay if it is later replaced
@@ -88,22 +440,98 @@ def extract_data_from_excel(
         row: Dict[str, Any] = {"key": str(i)}
         for j, col in enumerate(columns):
             val = df.iloc[i, j]
-            parsed = parse(val, col["type"])
-            should_strip = col["type"] == ColumnTypes.STRING and trimWhitespaces
+            parsed = parse_cell(val, col["type"], parser)
+            should_strip = (
+                col["type"] == ColumnTypes.STRING
+                and trim_whitespaces
+                and parsed is not None
+            )
             row[col["key"]] = str(parsed).strip() if should_strip else parsed
         return row
 
-    rows = [get_ith_row_from_df(i) for i in range(len(df))]
+    return [get_ith_row_from_df(i) for i in range(len(df))]
 
-    extracted: ExtractedData = {
-        "rows": rows,
-        "columns": columns,
-        "extra_headers": extra_headers,
-        "column_stats": calculate_column_stats(rows, columns)
-        if calculate_stats
-        else None,
-    }
-    return extracted, None
+
+def get_column_values(
+    series: pd.Series,
+    coltype: ColumnTypes,
+    trim_whitespaces: bool = False,
+    parser: Parser = DEFAULT_PARSER,
+) -> list:
+    """
+    Convert a whole column to python values of type coltype. The result is the
+    same as calling parse() on each of the items but avoids the per cell
+    overhead for the common dtypes.
+    """
+    if series.hasnans:
+        # Nulls are already replaced by None, columns having them are objects
+        values = series.astype(object).tolist()
+    elif (
+        coltype == ColumnTypes.INTEGER
+        and pd.api.types.is_numeric_dtype(series)
+        # Larger values would wrap around in int64, parse_cells() keeps them
+        and series.abs().max() < 2**63
+    ):
+        # Float columns are inferred as integers only if all values are integral
+        return series.astype("int64").tolist()
+    elif coltype == ColumnTypes.FLOAT and pd.api.types.is_float_dtype(series):
+        return [round(x, 5) for x in series.astype("float64").tolist()]
+    elif coltype == ColumnTypes.DATETIME and pd.api.types.is_datetime64_dtype(series):
+        return [x.isoformat() for x in series.dt.to_pydatetime()]
+    else:
+        values = series.astype(object).tolist()
+
+    if coltype == ColumnTypes.STRING:
+        if trim_whitespaces:
+            return [None if x is None else str(x).strip() for x in values]
+        return [None if x is None else str(x) for x in values]
+    return parse_cells(values, coltype, parser)
+
+
+def parse_cells(
+    values: list, coltype: ColumnTypes, parser: Parser = DEFAULT_PARSER
+) -> list:
+    """parse_cell() for a list of values, which are converted all at once"""
+    if coltype == ColumnTypes.INTEGER:
+        values = [
+            int(x) if isinstance(x, float) and x.is_integer() else x for x in values
+        ]
+    elif coltype == ColumnTypes.DATETIME:
+        values = [x.isoformat() if isinstance(x, datetime) else x for x in values]
+    elif coltype not in (ColumnTypes.FLOAT, ColumnTypes.NUMBER, ColumnTypes.DATE):
+        return [parse_cell(x, coltype, parser) for x in values]
+    parsed, _ = parser.parse_many(values, coltype)
+    return parsed.tolist()
+
+
+def parse_cell(val: Any, coltype: ColumnTypes, parser: Parser = DEFAULT_PARSER) -> Any:
+    """
+    parse() for the values read from files. Integral floats are integers and
+    datetimes are not parsed again from their string representation.
+    """
+    if coltype == ColumnTypes.INTEGER and isinstance(val, float) and val.is_integer():
+        return int(val)
+    elif coltype == ColumnTypes.DATETIME and isinstance(val, datetime):
+        return val.isoformat()
+    return parser.parse(val, coltype)
+
+
+def get_rows_from_column_values(
+    column_values: Dict[str, list],
+    columns: List[Column],
+    num_rows: int,
+    start: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Build the row dicts from the column wise extracted values. Row keys start
+    from start.
+    """
+    keys = ["key", *[col["key"] for col in columns]]
+    value_lists = [column_values[col["key"]] for col in columns]
+    return [
+        dict(zip(keys, (str(i), *values)))
+        for i, *values in zip(range(start, start + num_rows), *value_lists)
+    ]
 
 
 def extract_extra_headers(
@@ -123,7 +551,11 @@ def extract_extra_headers(
     return [[str(e) for e in row] for row in df.itertuples(index=False)]
 
 
-def calculate_column_stats(data_rows: List[Dict[str, Any]], columns: List[Column]):
+def calculate_column_stats(
+    data_rows: List[Dict[str, Any]],
+    columns: List[Column],
+    approximate_after: Optional[int] = None,
+):
     """
     Calculate column wise stats.
     data_rows is a list of the form:
@@ -133,69 +565,40 @@ def calculate_column_stats(data_rows: List[Dict[str, Any]], columns: List[Column
         ]
     which is the result of dataframe.to_dict()
     """
-    column_stats = []
-    for col in columns:
-        colkey = col["key"]
-        col_items = [row[colkey] for row in data_rows]
-        single_column_stats = calculate_single_column_stats(col_items, col["type"])
-        column_info = {
-            **single_column_stats,
-            **col,
-        }
-        column_stats.append(column_info)
-    return column_stats
-
-
-def calculate_single_column_stats(items: list, coltype: ColumnTypes) -> ColumnStats:
-    if coltype in [ColumnTypes.INTEGER, ColumnTypes.FLOAT, ColumnTypes.NUMBER]:
-        return calculate_stats_for_numeric_col(items)
-    else:
-        return calculate_stats_for_string_col(items)
-
-
-def calculate_stats_for_numeric_col(items: list) -> ColumnStats:
-    # TODO: optimize the list(use np/pd). But this should happen from the extraction phase itself
-    not_null_items = [x for x in items if x is not None]
-    if not not_null_items:
-        return {
-            "min": None,
-            "max": None,
-            "mean": None,
-            "median": None,
-            "std_deviation": None,
-            "total_count": len(items),
-            "na_count": len(items) - len(not_null_items),
-        }
-    return {
-        "min": float_r(np.min(not_null_items)),
-        "max": float_r(np.max(not_null_items)),
-        "mean": float_r(np.mean(not_null_items)),
-        "median": float_r(np.median(not_null_items)),
-        "std_deviation": float_r(np.std(not_null_items)),
-        "total_count": len(items),
-        "na_count": len(items) - len(not_null_items),
+    column_values = {
+        col["key"]: [row[col["key"]] for row in data_rows] for col in columns
     }
+    return calculate_column_stats_from_values(column_values, columns, approximate_after)
 
 
-def calculate_stats_for_string_col(items: list) -> ColumnStats:
-    max_len = 0
-    min_len = INFINITY
-    for x in items:
-        if x is None:
-            continue
-        length = len(x)
-        if length > max_len:
-            max_len = length
-        if length < min_len:
-            min_len = length
-
-    # TODO: optimize the following calculations
-    not_null_items = [x for x in items if x is not None]
-    return {
-        "total_count": len(items),
-        "na_count": len(not_null_items),
-        "unique_count": len(set(not_null_items)),
-        "max_length": max_len,
-        "min_length": 0 if min_len == INFINITY else int(min_len),
-        # NOTE: Need to cast min_length to int although it is guranteed to be an int becauese of mypy error
-    }
+def calculate_column_stats_from_values(
+    column_values: Dict[str, list],
+    columns: List[Column],
+    approximate_after: Optional[int] = None,
+):
+    """
+    Calculate column wise stats from values that are already grouped by column:
+        { col1: [val1, val2, ...], col2: [...], ... }
+    """
+    column_stats = calculate_columns_stats(
+        [
+            (*to_column_array(column_values[col["key"]], col["type"]), col["type"])
+            for col in columns
+        ],
+        approximate_after,
+    )
+    return [{**stats, **col} for stats, col in zip(column_stats, columns)]
+
+
+def finalize_column_stats(
+    accumulators: Dict[str, StatsAccumulator], columns: List[Column]
+):
+    """Column wise stats from the accumulated stats of each column by key"""
+    return [{**accumulators[col["key"]].finalize(), **col} for col in columns]
+
+
+def calculate_single_column_stats(
+    items: list, coltype: ColumnTypes, approximate_after: Optional[int] = None
+) -> ColumnStats:
+    values, nulls = to_column_array(items, coltype)
+    return calculate_stats(values, nulls, coltype, approximate_after)
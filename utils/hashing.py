@@ -0,0 +1,29 @@
+import hashlib
+from typing import BinaryIO, List
+
+# Files are hashed in blocks of this size, so that the digest can be computed
+# incrementally from the chunks of an upload
+DIGEST_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def get_block_digest(block: bytes) -> str:
+    return hashlib.sha256(block).hexdigest()
+
+
+def combine_block_digests(block_digests: List[str]) -> str:
+    """Content digest from the digests of the consecutive blocks of a file"""
+    digest = hashlib.sha256()
+    for block_digest in block_digests:
+        digest.update(bytes.fromhex(block_digest))
+    return digest.hexdigest()
+
+
+def get_content_digest(f: BinaryIO, block_size: int = DIGEST_BLOCK_SIZE) -> str:
+    """
+    Digest of the content of a binary file object, which is the sha256 of the
+    sha256 digests of its blocks of block_size bytes.
+    """
+    block_digests = [
+        get_block_digest(block) for block in iter(lambda: f.read(block_size), b"")
+    ]
+    return combine_block_digests(block_digests)
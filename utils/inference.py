@@ -0,0 +1,110 @@
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .common import ColumnTypes
+
+# Number of values sampled from the top, bottom and random positions of a
+# column to infer its type
+TYPE_SAMPLE_HEAD = 100
+TYPE_SAMPLE_TAIL = 100
+TYPE_SAMPLE_RANDOM = 300
+
+# Candidate types in the order of preference when the shares are equal
+CANDIDATE_TYPES = [ColumnTypes.INTEGER, ColumnTypes.FLOAT, ColumnTypes.DATETIME]
+
+TypeInference = Tuple[ColumnTypes, float]
+
+
+def infer_column_types(df: pd.DataFrame) -> List[TypeInference]:
+    """
+    Infer (type, confidence) of the columns of a dataframe whose nulls are
+    already replaced by None.
+    """
+    return [infer_column_type(df.iloc[:, j]) for j in range(df.shape[1])]
+
+
+def infer_column_type(series: pd.Series) -> TypeInference:
+    """
+    Infer the type of a column along with the confidence. Typed columns are
+    decided from their dtype. For object columns the type is decided from a
+    sample of values from the head, tail and random positions: it is the
+    candidate type all of the sampled values conform to, or string otherwise
+    so that no value becomes null. The confidence of strings is the share of
+    the values conforming to none of the candidate types, for which all the
+    values are checked, e.g. it is low for numbers having a few notes among
+    them. Values outside the sample which do not conform to the type widen it
+    when they are extracted, see utils.extraction.
+    """
+    if pd.api.types.is_bool_dtype(series):
+        return ColumnTypes.STRING, 1.0
+    elif pd.api.types.is_integer_dtype(series):
+        return ColumnTypes.INTEGER, 1.0
+    elif pd.api.types.is_float_dtype(series):
+        # Integer columns having nulls are read as floats
+        is_integral = bool((series.to_numpy() % 1 == 0).all())
+        return (ColumnTypes.INTEGER if is_integral else ColumnTypes.FLOAT), 1.0
+    elif pd.api.types.is_datetime64_any_dtype(series):
+        return ColumnTypes.DATETIME, 1.0
+
+    values = series[series.notna()].to_numpy()
+    sample = get_sample(values)
+    coltype, confidence = infer_type_from_values(sample)
+    if confidence < 1 and len(sample) < len(values):
+        coltype, confidence = infer_type_from_values(values)
+    return coltype, confidence
+
+
+def get_sample(values: np.ndarray) -> np.ndarray:
+    size = len(values)
+    if size <= TYPE_SAMPLE_HEAD + TYPE_SAMPLE_TAIL + TYPE_SAMPLE_RANDOM:
+        return values
+    # Seeded so that the same data is always inferred the same
+    rng = np.random.default_rng(size)
+    random_positions = rng.choice(
+        np.arange(TYPE_SAMPLE_HEAD, size - TYPE_SAMPLE_TAIL),
+        TYPE_SAMPLE_RANDOM,
+        replace=False,
+    )
+    positions = np.concatenate(
+        [
+            np.arange(TYPE_SAMPLE_HEAD),
+            np.sort(random_positions),
+            np.arange(size - TYPE_SAMPLE_TAIL, size),
+        ]
+    )
+    return values[positions]
+
+
+def infer_type_from_values(values: np.ndarray) -> TypeInference:
+    if len(values) == 0:
+        return ColumnTypes.STRING, 0.0
+    counts = dict.fromkeys(CANDIDATE_TYPES, 0)
+    for val in values:
+        valtype = get_value_type(val)
+        if valtype == ColumnTypes.INTEGER:
+            counts[ColumnTypes.INTEGER] += 1
+            counts[ColumnTypes.FLOAT] += 1
+        elif valtype is not None:
+            counts[valtype] += 1
+    # max() keeps the first of the types having the highest count
+    coltype = max(CANDIDATE_TYPES, key=lambda t: counts[t])
+    share = counts[coltype] / len(values)
+    if share < 1:
+        return ColumnTypes.STRING, round(1 - share, 4)
+    return coltype, 1.0
+
+
+def get_value_type(val: Any) -> Optional[ColumnTypes]:
+    """Type of a value read from a file, None for strings and other values"""
+    if isinstance(val, (bool, np.bool_)):
+        return None
+    elif isinstance(val, (int, np.integer)):
+        return ColumnTypes.INTEGER
+    elif isinstance(val, (float, np.floating)):
+        return ColumnTypes.INTEGER if float(val).is_integer() else ColumnTypes.FLOAT
+    elif isinstance(val, (datetime, np.datetime64)):
+        return ColumnTypes.DATETIME
+    return None
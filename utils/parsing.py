@@ -1,27 +1,293 @@
-from typing import Type, Any, Optional
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Type, Any, Dict, List, Mapping, Optional, Sequence, Tuple
 
-import dateparser
+import numpy as np
+import pandas as pd
+from dateparser.date import DateDataParser
+from dateparser.languages.loader import default_loader
+from django.conf import settings
 
+from .cache import LRUCache
 from .common import ColumnTypes, float_r
+from .inference import get_sample
 
+# Parsed values by (string value, coltype[, timezone, language, date]). Single
+# underscored since double underscored names are mangled in Parser methods
+_PARSE_CACHE: LRUCache[Any] = LRUCache(settings.PARSE_CACHE_MAX_SIZE)
+_MISSING = object()
 
-def parse(val: Optional[Any], coltype: Any) -> str | int | float | None:
-    # TODO: Integer/Float precision
-    if val is None:
+
+def get_dateparser_languages(language: Optional[str]) -> Optional[List[str]]:
+    """
+    The language and English, which is common in files of any language, out
+    of the languages dateparser supports. None to try all of them.
+    """
+    if language is None:
         return None
-    # Convert to string first
-    strval = str(val)
-    if coltype == ColumnTypes.INTEGER:
-        return parse_int(strval)
-    elif coltype == ColumnTypes.FLOAT:
-        return parse_float(strval)
-    elif coltype == ColumnTypes.NUMBER:
-        return parse_int(strval) or parse_float(strval)
-    elif coltype == ColumnTypes.DATE:
-        return parse_date(strval)
-    elif coltype == ColumnTypes.DATETIME:
-        return parse_datetime(strval)
-    return strval
+    supported = default_loader.get_locale_map()
+    languages = [lang for lang in dict.fromkeys([language, "en"]) if lang in supported]
+    return languages or None
+
+
+class Parser:
+    """
+    Converts values to column types. Dates are parsed by dateparser, which is
+    restricted to the language and English when a language is given, and are
+    converted to the timezone when a timezone is given. Build parsers for
+    tables with get_table_parser(), which reuses them.
+    """
+
+    def __init__(self, timezone: Optional[str] = None, language: Optional[str] = None):
+        self.timezone = timezone
+        self.language = language
+        dateparser_settings = {}
+        if timezone is not None:
+            # Dates without offsets are taken to be in the timezone already
+            dateparser_settings = {
+                "TIMEZONE": timezone,
+                "TO_TIMEZONE": timezone,
+                "RETURN_AS_TIMEZONE_AWARE": False,
+            }
+        self.date_data_parser = DateDataParser(
+            languages=get_dateparser_languages(language),
+            settings=dateparser_settings,
+        )
+
+    def parse(
+        self, val: Optional[Any], coltype: Any, excel_serials: bool = False
+    ) -> str | int | float | None:
+        """
+        Convert a value to coltype, memoized by parse_cached(). With
+        excel_serials, numbers are taken as Excel serial dates for date and
+        datetime types.
+        """
+        if val is None:
+            return None
+        is_date = coltype in (ColumnTypes.DATE, ColumnTypes.DATETIME)
+        if excel_serials and is_date and is_number(val):
+            parsed, _ = self.parse_many([val], coltype, excel_serials=True)
+            return parsed[0]
+        if coltype == ColumnTypes.STRING:
+            # Not worth memoizing
+            return str(val)
+        return self.parse_cached(val, coltype)
+
+    def parse_uncached(self, strval: str, coltype: Any) -> str | int | float | None:
+        """Convert the string representation of a value to coltype"""
+        # TODO: Integer/Float precision
+        if coltype == ColumnTypes.INTEGER:
+            return parse_int(strval)
+        elif coltype == ColumnTypes.FLOAT:
+            return parse_float(strval)
+        elif coltype == ColumnTypes.NUMBER:
+            return parse_int(strval) or parse_float(strval)
+        elif coltype == ColumnTypes.DATE:
+            return self.parse_date(strval)
+        elif coltype == ColumnTypes.DATETIME:
+            return self.parse_datetime(strval)
+        return strval
+
+    def parse_cached(
+        self, val: Optional[Any], coltype: Any
+    ) -> str | int | float | None:
+        """
+        parse() memoized in process, for the values which are not converted
+        all at once and which repeat in columns having few distinct values.
+        Dates are cached for the day as dateparser resolves values like
+        "yesterday" to the current date.
+        """
+        if val is None:
+            return None
+        strval = str(val)
+        if coltype in (ColumnTypes.DATE, ColumnTypes.DATETIME):
+            key: tuple = (
+                strval,
+                coltype,
+                self.timezone,
+                self.language,
+                date.today(),
+            )
+        else:
+            key = (strval, coltype)
+        parsed = _PARSE_CACHE.get(key, _MISSING)
+        if parsed is _MISSING:
+            parsed = self.parse_uncached(strval, coltype)
+            _PARSE_CACHE.set(key, parsed)
+        return parsed
+
+    def parse_datetime(self, val: Optional[str]) -> Optional[str]:
+        """Parse input value to datetime and return iso string if parsed"""
+        # TODO: add formatting
+        if val is None:
+            return None
+        date = self.date_data_parser.get_date_data(val).date_obj
+        return date and date.isoformat()
+
+    def parse_date(self, val: Optional[str]) -> Optional[str]:
+        """Parse input value to date and return iso string if parsed"""
+        # TODO: add formatting
+        if val is None:
+            return None
+        date = self.date_data_parser.get_date_data(val).date_obj
+        return date and date.isoformat()[:10]
+
+    def parse_many(
+        self, values: Sequence[Any], coltype: Any, excel_serials: bool = False
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Batch counterpart of parse(). Returns an object array of the same values
+        parse() gives for each of the items along with a mask of the items which
+        failed to convert, i.e. which are not None but were parsed to None.
+        """
+        size = len(values)
+        result = np.full(size, None, dtype=object)
+        if isinstance(values, np.ndarray) and values.dtype.kind in "iuf":
+            # Typed arrays have no nulls to skip and need no string conversion
+            if coltype in (ColumnTypes.INTEGER, ColumnTypes.FLOAT, ColumnTypes.NUMBER):
+                result[:] = parse_numbers(values, coltype)
+                return result, np.equal(result, None)
+            values = values.tolist()
+
+        notnull = np.fromiter((x is not None for x in values), dtype=bool, count=size)
+        if coltype in (ColumnTypes.DATE, ColumnTypes.DATETIME):
+            items = np.empty(notnull.sum(), dtype=object)
+            items[:] = [x for x in values if x is not None]
+            result[notnull] = self.parse_dates(items, coltype, excel_serials)
+            return result, notnull & np.equal(result, None)
+
+        strvals = np.array([str(x) for x in values if x is not None], dtype=object)
+        if coltype in (ColumnTypes.INTEGER, ColumnTypes.FLOAT, ColumnTypes.NUMBER):
+            result[notnull] = parse_numbers(strvals, coltype)
+        else:
+            result[notnull] = strvals
+        return result, notnull & np.equal(result, None)
+
+    def parse_dates(
+        self, values: np.ndarray, coltype: Any, excel_serials: bool = False
+    ) -> List[Optional[str]]:
+        """
+        ISO strings of the dates/datetimes in an object array of non null values.
+        Numbers are taken as Excel serial dates if excel_serials, which is only
+        known for the values of Excel cells. Strings are converted all at once
+        with the format most of them are in and the rest are left to dateparser.
+        """
+        timestamps = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[ns]")
+        numbers = np.fromiter(
+            (excel_serials and is_number(x) for x in values),
+            dtype=bool,
+            count=len(values),
+        )
+        if numbers.any():
+            serials = values[numbers].astype(np.float64)
+            is_serial = (serials >= EXCEL_SERIAL_MIN) & (serials < EXCEL_SERIAL_MAX)
+            positions = np.flatnonzero(numbers)[is_serial]
+            timestamps[positions] = (
+                pd.to_datetime(serials[is_serial], unit="D", origin=EXCEL_EPOCH)
+                # Fractions of days are not exact, Excel keeps milliseconds
+                .round("ms").to_numpy()
+            )
+
+        unparsed = np.isnat(timestamps)
+        strvals = pd.Series([str(x) for x in values[unparsed]], dtype=object)
+        date_format = detect_date_format(strvals)
+        if date_format is not None:
+            converted = pd.to_datetime(strvals, format=date_format, errors="coerce")
+            if not pd.api.types.is_datetime64_any_dtype(converted):
+                # Values having different offsets are converted to objects,
+                # converted to UTC they are datetimes. The values without
+                # offsets among them are left to dateparser.
+                has_offset = np.fromiter(
+                    (getattr(x, "tzinfo", None) is not None for x in converted),
+                    dtype=bool,
+                    count=len(converted),
+                )
+                converted = pd.to_datetime(
+                    strvals, format=date_format, errors="coerce", utc=True
+                )
+                converted[~has_offset] = pd.NaT
+            if date_format == ISO_DATE_FORMAT:
+                matches = strvals.str.match(ISO_DATE_PATTERN).to_numpy(dtype=bool)
+                converted[~matches] = pd.NaT
+            if converted.dt.tz is not None and self.timezone is not None:
+                converted = converted.dt.tz_convert(self.timezone).dt.tz_localize(None)
+            # Without a timezone, dates having offsets are left to dateparser,
+            # which keeps the offsets
+            if converted.dt.tz is None:
+                timestamps[unparsed] = converted.to_numpy()
+
+        parsed: List[Optional[str]] = [None] * len(values)
+        is_parsed = ~np.isnat(timestamps)
+        if is_parsed.any():
+            stamps = pd.Series(timestamps[is_parsed])
+            if coltype == ColumnTypes.DATE:
+                isostrings = stamps.dt.strftime("%Y-%m-%d").tolist()
+            else:
+                isostrings = [x.isoformat() for x in stamps.dt.to_pydatetime()]
+            for i, val in zip(np.flatnonzero(is_parsed), isostrings):
+                parsed[i] = val
+        for i in np.flatnonzero(~is_parsed):
+            parsed[i] = self.parse_cached(values[i], coltype)
+        return parsed
+
+
+# Parser for the values which do not belong to a table, dateparser tries all
+# the languages on them
+DEFAULT_PARSER = Parser()
+
+
+def parse(
+    val: Optional[Any], coltype: Any, excel_serials: bool = False
+) -> str | int | float | None:
+    return DEFAULT_PARSER.parse(val, coltype, excel_serials)
+
+
+def parse_cached(val: Optional[Any], coltype: Any) -> str | int | float | None:
+    return DEFAULT_PARSER.parse_cached(val, coltype)
+
+
+def parse_many(
+    values: Sequence[Any], coltype: Any, excel_serials: bool = False
+) -> Tuple[np.ndarray, np.ndarray]:
+    return DEFAULT_PARSER.parse_many(values, coltype, excel_serials)
+
+
+def parse_datetime(val: Optional[str]) -> Optional[str]:
+    return DEFAULT_PARSER.parse_datetime(val)
+
+
+def parse_date(val: Optional[str]) -> Optional[str]:
+    return DEFAULT_PARSER.parse_date(val)
+
+
+@lru_cache(maxsize=32)
+def get_parser(timezone: Optional[str], language: Optional[str]) -> Parser:
+    return Parser(timezone=timezone, language=language)
+
+
+def get_table_parser(table_properties: Mapping[str, Any]) -> Parser:
+    """Parser for the values of a table, shared by the tables having the same properties"""
+    return get_parser(
+        table_properties.get("timezone"), table_properties.get("language")
+    )
+
+
+def get_parse_cache_info() -> Dict[str, int]:
+    return {
+        "hits": _PARSE_CACHE.hits,
+        "misses": _PARSE_CACHE.misses,
+        "size": len(_PARSE_CACHE),
+    }
+
+
+def clear_parse_cache():
+    _PARSE_CACHE.clear()
+
+
+def is_number(val: Any) -> bool:
+    return isinstance(val, (int, float, np.integer, np.floating)) and not isinstance(
+        val, (bool, np.bool_)
+    )
 
 
 def parse_type(typ: Type, val: Optional[str]):
@@ -39,19 +305,118 @@ def parse_float(val: Optional[str]) -> Optional[float]:
     return parse_type(float_r, val)
 
 
-def parse_datetime(val: Optional[str]) -> Optional[str]:
-    """Parse input value to datetime and return iso string if parsed"""
-    # TODO: add formatting
-    if val is None:
-        return None
-    date = dateparser.parse(val)
-    return date and date.isoformat()
+# Strings which int() accepts without surprises, the rest are tried one by one
+INTEGER_PATTERN = r"\s*[+-]?[0-9]+\s*"
 
 
-def parse_date(val: Optional[str]) -> Optional[str]:
-    """Parse input value to date and return iso string if parsed"""
-    # TODO: add formatting
-    if val is None:
+def parse_numbers(values: np.ndarray, coltype: Any) -> list:
+    """Numbers from an array of strings or of numbers for a numeric coltype"""
+    if coltype == ColumnTypes.INTEGER:
+        return parse_ints(values)
+    elif coltype == ColumnTypes.FLOAT:
+        return parse_floats(values)
+    # As in parse(), zeros are not integers because 0 is falsy
+    ints = parse_ints(values)
+    is_float = np.fromiter((not x for x in ints), dtype=bool, count=len(ints))
+    if not is_float.any():
+        return ints
+    floats = iter(parse_floats(values[is_float]))
+    return [next(floats) if x else i for i, x in zip(ints, is_float)]
+
+
+def parse_ints(values: np.ndarray) -> list:
+    if values.dtype.kind in "iu":
+        return values.tolist()
+    elif values.dtype.kind == "f":
+        # str() of floats always has a decimal point or is nan/inf
+        return [None] * len(values)
+
+    parsed: list = [None] * len(values)
+    strvals = pd.Series(values, dtype=object)
+    matches = strvals.str.fullmatch(INTEGER_PATTERN).to_numpy(dtype=bool)
+    if matches.any():
+        numbers = pd.to_numeric(strvals[matches], errors="coerce")
+        if numbers.dtype.kind == "i":
+            ints = numbers.tolist()
+        else:
+            # Some are too large for int64 and pandas gives up on them
+            ints = [int(x) for x in strvals[matches]]
+        for i, val in zip(np.flatnonzero(matches), ints):
+            parsed[i] = val
+    for i in np.flatnonzero(~matches):
+        # int() also accepts underscores and digits of other scripts
+        parsed[i] = parse_cached(values[i], ColumnTypes.INTEGER)
+    return parsed
+
+
+def parse_floats(values: np.ndarray) -> list:
+    if values.dtype.kind in "iuf":
+        return [float_r(x) for x in values.tolist()]
+
+    parsed: list = [None] * len(values)
+    # pandas parses the common cases, numpy then converts them the same as
+    # float() does. Anything pandas rejects is tried with float() itself
+    numbers = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce")
+    candidates = numbers.notna().to_numpy()
+    if candidates.any():
+        try:
+            floats = values[candidates].astype(str).astype(np.float64).tolist()
+        except ValueError:
+            floats = [parse_float(x) for x in values[candidates]]
+        for i, val in zip(np.flatnonzero(candidates), floats):
+            parsed[i] = val if val is None else round(val, 5)
+    for i in np.flatnonzero(~candidates):
+        parsed[i] = parse_cached(values[i], ColumnTypes.FLOAT)
+    return parsed
+
+
+# Formats tried on a sample of a date column, in the order of preference when
+# they match equally. Month first is preferred as dateparser does for dates
+# like 01/02/2022
+DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%m/%d/%Y",
+    "%d/%m/%Y",
+    "%m-%d-%Y",
+    "%d-%m-%Y",
+    "%d.%m.%Y",
+    "%m/%d/%Y %H:%M",
+    "%d/%m/%Y %H:%M",
+    "%m/%d/%Y %H:%M:%S",
+    "%d/%m/%Y %H:%M:%S",
+    "%d %b %Y",
+    "%d %B %Y",
+    "%b %d, %Y",
+    "%B %d, %Y",
+]
+# pandas parses any ISO 8601 like date or datetime for this format, separated
+# by - or /, including partial ones like 2022, which are left to dateparser
+ISO_DATE_FORMAT = "%Y-%m-%d"
+ISO_DATE_PATTERN = r"\s*[0-9]{4}([-/])[0-9]{1,2}\1[0-9]{1,2}"
+# Minimum share of the sampled values which should match a format for it to be
+# used for the whole column
+MIN_DATE_FORMAT_SHARE = 0.5
+
+# Excel stores dates as days since 1899-12-30. Numbers outside the range are
+# not taken as dates
+EXCEL_EPOCH = datetime(1899, 12, 30)
+EXCEL_SERIAL_MIN = 1
+EXCEL_SERIAL_MAX = (datetime(2200, 1, 1) - EXCEL_EPOCH).days
+
+
+def detect_date_format(values: pd.Series) -> Optional[str]:
+    """The format of DATE_FORMATS most of a sample of the values are in"""
+    sample = pd.Series(get_sample(values.to_numpy()), dtype=object)
+    if len(sample) == 0:
+        return None
+    best_format, best_count = None, 0
+    for date_format in DATE_FORMATS:
+        converted = pd.to_datetime(sample, format=date_format, errors="coerce")
+        if date_format == ISO_DATE_FORMAT:
+            converted = converted[sample.str.match(ISO_DATE_PATTERN)]
+        count = converted.notna().sum()
+        if count > best_count:
+            best_format, best_count = date_format, count
+    if best_count < MIN_DATE_FORMAT_SHARE * len(sample):
         return None
-    date = dateparser.parse(val)
-    return date and date.isoformat()[:10]
+    return best_format
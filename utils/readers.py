@@ -0,0 +1,669 @@
+import os
+import csv
+import json
+import codecs
+import hashlib
+import tempfile
+from datetime import date, datetime, time, timedelta
+from itertools import chain, islice
+from collections import OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+
+from django.conf import settings
+
+from dive.consts import TABLE_HEADER_LEVELS
+from .cache import LRUCache
+from .hashing import get_content_digest
+
+PREVIEW_ROWS_COUNT = 50
+MAX_HEADER_LEVEL = max(int(x["key"]) for x in TABLE_HEADER_LEVELS)
+# Maximum number of sessions that are kept open by get_session()
+MAX_OPEN_SESSIONS = 4
+# Number of bytes read from the beginning of a csv file to detect its format
+CSV_SNIFF_SIZE = 64 * 1024
+CSV_DELIMITERS = ",;\t|"
+# Raw rows of the sheets are persisted under this directory in MEDIA_ROOT, as
+# json lines of frames of RAW_ROWS_FRAME_SIZE rows
+RAW_ROWS_DIR = "raw_rows"
+RAW_ROWS_FRAME_SIZE = 1000
+# Number of records from which the columns of json files are inferred
+JSON_SAMPLE_RECORDS = 1000
+JSON_CHUNK_SIZE = 64 * 1024
+# Number of lines from which the columns of fixed width text files are inferred
+FIXED_WIDTH_SAMPLE_LINES = 1000
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+FileSignature = Tuple[int, int]
+
+
+def convert_excel_cell(cell) -> Any:
+    """
+    Convert openpyxl cell to a python value, the same way pandas does while
+    reading excel files.
+    """
+    if cell.value is None:
+        return ""
+    elif cell.data_type == TYPE_ERROR:
+        return np.nan
+    elif cell.data_type == TYPE_NUMERIC:
+        val = int(cell.value)
+        if val == cell.value:
+            return val
+    return cell.value
+
+
+def iter_sheet_rows(sheet) -> Iterator[List[Any]]:
+    """Lazily read rows of a read only openpyxl sheet"""
+    sheet.reset_dimensions()
+    return trim_rows([convert_excel_cell(cell) for cell in row] for row in sheet.rows)
+
+
+def trim_rows(rows: Iterable[List[Any]]) -> Iterator[List[Any]]:
+    """
+    Drop trailing empty cells of each row and trailing empty rows, the way
+    pandas does while reading excel files.
+    """
+    # Empty rows are held back until a non empty row follows them
+    empty_rows = 0
+    for row in rows:
+        while row and row[-1] == "":
+            row.pop()
+        if not row:
+            empty_rows += 1
+            continue
+        for _ in range(empty_rows):
+            yield []
+        empty_rows = 0
+        yield row
+
+
+def pad_row(row: List[Any], width: int) -> List[Any]:
+    if len(row) >= width:
+        return row[:width]
+    return row + [""] * (width - len(row))
+
+
+def parse_rows(
+    rows: List[List[Any]],
+    header: Optional[int] = None,
+    dtype=None,
+    nrows: Optional[int] = None,
+) -> pd.DataFrame:
+    """Create dataframe from raw rows with the same inference as pd.read_excel"""
+    parser = TextParser(rows, header=header, dtype=dtype, skip_blank_lines=False)
+    return parser.read(nrows)
+
+
+def get_extra_headers(head_rows: List[List[Any]], header_level: int):
+    """Rows before the header row, as strings"""
+    if header_level < 1:
+        return []
+    return [
+        [str(e) for e in row]
+        for row in parse_rows(head_rows[:header_level]).itertuples(index=False)
+    ]
+
+
+def read_rows_in_batches(
+    rows: Iterator[List[Any]],
+    header_level: int = 0,
+    batch_size: Optional[int] = None,
+) -> Tuple[List[List[str]], Iterator[pd.DataFrame]]:
+    """
+    Group raw rows in dataframes of at most batch_size rows.
+    Returns (extra_headers, batches). The columns of the batches are the
+    values of row at index header_level, rows before it are extra headers.
+    Types are inferred only for the first batch, the later ones have object
+    columns which are to be parsed to the types of the first one, or wider.
+    Rows longer than the header add columns named "Unnamed: <index>" the same
+    as in get_preview_df(), a batch has all the columns of the earlier ones.
+    """
+    batch_size = batch_size or settings.EXTRACTION_BATCH_SIZE
+
+    head_rows: List[List[Any]] = []
+    for row in rows:
+        head_rows.append(row)
+        if len(head_rows) > header_level:
+            break
+    if not head_rows:
+        return [], iter([])
+
+    width = max(len(row) for row in head_rows)
+    head_rows = [pad_row(row, width) for row in head_rows]
+
+    def batches() -> Iterator[pd.DataFrame]:
+        columns = parse_rows(head_rows, header=header_level).columns
+        batch: List[List[Any]] = []
+        dtype = None
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                columns = add_unnamed_columns(columns, batch)
+                yield parse_batch(batch, columns, dtype)
+                dtype = object
+                batch = []
+        if batch:
+            columns = add_unnamed_columns(columns, batch)
+            yield parse_batch(batch, columns, dtype)
+        elif dtype is None:
+            # Yield at least one batch so that the columns are known
+            yield pd.DataFrame(columns=columns)
+
+    return get_extra_headers(head_rows, header_level), batches()
+
+
+def add_unnamed_columns(columns: pd.Index, rows: List[List[Any]]) -> pd.Index:
+    """Columns for the cells of rows beyond the columns, named as pandas does"""
+    width = max((len(row) for row in rows), default=0)
+    if width <= len(columns):
+        return columns
+    return columns.append(
+        pd.Index([f"Unnamed: {j}" for j in range(len(columns), width)])
+    )
+
+
+def parse_batch(rows: List[List[Any]], columns: pd.Index, dtype=None) -> pd.DataFrame:
+    rows = [pad_row(row, len(columns)) for row in rows]
+    return parse_rows(rows, dtype=dtype).set_axis(columns, axis=1)
+
+
+# Content hashes by (path, signature), so that a file is hashed once per
+# process until it changes. Forked workers inherit them.
+__CONTENT_HASHES: LRUCache[str] = LRUCache(max_size=256)
+
+
+def get_content_hash(path: str, signature: Optional[FileSignature] = None) -> str:
+    """Content digest of the file, see utils.hashing.get_content_digest()"""
+    key = (path, signature or get_file_signature(path))
+    content_hash = __CONTENT_HASHES.get(key)
+    if content_hash is None:
+        with open(path, "rb") as f:
+            content_hash = get_content_digest(f)
+        __CONTENT_HASHES.set(key, content_hash)
+    return content_hash
+
+
+def get_known_content_hash(
+    path: str, signature: Optional[FileSignature] = None
+) -> Optional[str]:
+    """get_content_hash() if the file was hashed already, without reading it"""
+    return __CONTENT_HASHES.get((path, signature or get_file_signature(path)))
+
+
+def clear_content_hashes():
+    __CONTENT_HASHES.clear()
+
+
+def set_content_hash(path: str, content_hash: str):
+    """Use an already known content digest for the file instead of reading it"""
+    __CONTENT_HASHES.set((path, get_file_signature(path)), content_hash)
+
+
+def encode_raw_cell(value: Any) -> Dict[str, Any]:
+    """
+    Json of the cells which are not json values, the temporal values of excel
+    files. Cells are never dicts, so these are told apart from the rest.
+    """
+    if isinstance(value, datetime):
+        return {"$type": "datetime", "value": value.isoformat()}
+    elif isinstance(value, date):
+        return {"$type": "date", "value": value.isoformat()}
+    elif isinstance(value, time):
+        return {"$type": "time", "value": value.isoformat()}
+    elif isinstance(value, timedelta):
+        return {"$type": "timedelta", "value": value.total_seconds()}
+    raise TypeError(f"Cells of type {type(value).__name__} are not persisted")
+
+
+def decode_raw_cell(obj: Dict[str, Any]) -> Any:
+    kind = obj["$type"]
+    if kind == "datetime":
+        return datetime.fromisoformat(obj["value"])
+    elif kind == "date":
+        return date.fromisoformat(obj["value"])
+    elif kind == "time":
+        return time.fromisoformat(obj["value"])
+    return timedelta(seconds=obj["value"])
+
+
+def persist_rows(
+    rows: Iterable[List[Any]], get_path: Callable[[], str], tmp_dir: str
+) -> Iterator[List[Any]]:
+    """
+    Pass the rows through while writing them to a temporary file in tmp_dir,
+    which is moved to get_path() only if all the rows are read and none of
+    them has cells which cannot be persisted. The path is asked for only
+    then, as it may be costly to find out.
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            persisting = True
+            frame: List[List[Any]] = []
+            for row in rows:
+                yield row
+                if not persisting:
+                    continue
+                frame.append(row)
+                if len(frame) >= RAW_ROWS_FRAME_SIZE:
+                    persisting = write_raw_rows_frame(frame, f)
+                    frame = []
+            persisting = persisting and write_raw_rows_frame(frame, f)
+        if persisting:
+            path = get_path()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_raw_rows_frame(frame: List[List[Any]], f) -> bool:
+    """Write the rows as a json line, False if some of the cells cannot be"""
+    try:
+        line = json.dumps(frame, default=encode_raw_cell)
+    except TypeError:
+        return False
+    f.write(line + "\n")
+    return True
+
+
+def iter_persisted_rows(path: str) -> Iterator[List[Any]]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield from json.loads(line, object_hook=decode_raw_cell)
+
+
+def get_raw_rows_dir(content_hash: str) -> str:
+    """Directory of the persisted raw rows of all sheets of files of a content"""
+    return os.path.join(settings.MEDIA_ROOT, RAW_ROWS_DIR, content_hash)
+
+
+def get_file_signature(path: str) -> FileSignature:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FileSession:
+    """
+    An opened tabular file whose tables(sheets) are read for header, preview
+    and full data extraction. The top rows of each table are read once and
+    shared by header and preview extraction. Use it as a context manager or
+    call close() to release the file. Subclasses implement sheet_names and
+    iter_rows().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.signature = get_file_signature(path)
+        self._head_rows: Dict[str, List[List[Any]]] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def sheet_names(self) -> List[str]:
+        raise NotImplementedError
+
+    @property
+    def is_stale(self) -> bool:
+        """If the file has changed after the session was opened"""
+        try:
+            return get_file_signature(self.path) != self.signature
+        except FileNotFoundError:
+            return True
+
+    @property
+    def content_hash(self) -> str:
+        return get_content_hash(self.path, self.signature)
+
+    @property
+    def known_content_hash(self) -> Optional[str]:
+        return get_known_content_hash(self.path, self.signature)
+
+    def iter_rows(self, sheetname: str) -> Iterator[List[Any]]:
+        raise NotImplementedError
+
+    def get_raw_rows_path(
+        self, sheetname: str, content_hash: Optional[str] = None
+    ) -> str:
+        filename = hashlib.sha1(sheetname.encode()).hexdigest()
+        return os.path.join(
+            get_raw_rows_dir(content_hash or self.content_hash), f"{filename}.jsonl"
+        )
+
+    def has_raw_rows(self, sheetname: str) -> bool:
+        return os.path.exists(self.get_raw_rows_path(sheetname))
+
+    def read_rows(self, sheetname: str, persist: bool = False) -> Iterator[List[Any]]:
+        """
+        Raw rows of the sheet, untyped and independent of the table properties.
+        They are read from the persisted raw rows if present, which is much
+        cheaper than parsing the file again. Otherwise they are read from the
+        file and, if persist, saved once the whole sheet is read. The file is
+        hashed to find its persisted raw rows only then, unless its content
+        hash is known already, as reading the top rows costs less.
+        """
+        content_hash = self.known_content_hash
+        if content_hash is not None:
+            path = self.get_raw_rows_path(sheetname, content_hash)
+            if os.path.exists(path):
+                return iter_persisted_rows(path)
+        rows = self.iter_rows(sheetname)
+        if not persist:
+            return rows
+        return persist_rows(
+            rows,
+            lambda: self.get_raw_rows_path(sheetname),
+            os.path.join(settings.MEDIA_ROOT, RAW_ROWS_DIR),
+        )
+
+    def get_head_rows(self, sheetname: str) -> List[List[Any]]:
+        """Top rows of the sheet, enough for preview with any header level"""
+        if sheetname not in self._head_rows:
+            rows_count = MAX_HEADER_LEVEL + 1 + PREVIEW_ROWS_COUNT
+            rows: List[List[Any]] = []
+            for row in self.read_rows(sheetname):
+                rows.append(row)
+                if len(rows) >= rows_count:
+                    break
+            while rows and not rows[-1]:
+                rows.pop()
+            width = max((len(row) for row in rows), default=0)
+            self._head_rows[sheetname] = [pad_row(row, width) for row in rows]
+        return self._head_rows[sheetname]
+
+    def get_extra_headers(self, sheetname: str, header_level: int):
+        return get_extra_headers(self.get_head_rows(sheetname), header_level)
+
+    def get_preview_df(self, sheetname: str, header_level: int) -> pd.DataFrame:
+        head_rows = self.get_head_rows(sheetname)
+        if len(head_rows) <= header_level:
+            return pd.DataFrame()
+        return parse_rows(head_rows, header=header_level, nrows=PREVIEW_ROWS_COUNT)
+
+    def read_in_batches(
+        self,
+        sheetname: str,
+        header_level: int = 0,
+        batch_size: Optional[int] = None,
+    ) -> Tuple[List[List[str]], Iterator[pd.DataFrame]]:
+        return read_rows_in_batches(
+            self.read_rows(sheetname, persist=True),
+            header_level=header_level,
+            batch_size=batch_size,
+        )
+
+    def close(self):
+        self._head_rows = {}
+
+
+class ExcelSession(FileSession):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.workbook = load_workbook(
+            path, read_only=True, data_only=True, keep_links=False
+        )
+
+    @property
+    def sheet_names(self) -> List[str]:
+        return self.workbook.sheetnames
+
+    def iter_rows(self, sheetname: str) -> Iterator[List[Any]]:
+        return iter_sheet_rows(self.workbook[sheetname])
+
+    def close(self):
+        super().close()
+        self.workbook.close()
+
+
+class CsvSession(FileSession):
+    """
+    Csv file as a single table named after the file. Encoding and dialect are
+    detected from the first CSV_SNIFF_SIZE bytes and the rows are read lazily.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.encoding, self.sniffed_dialect = sniff_csv_format(path)
+        self.dialect = self.sniffed_dialect or csv.excel
+
+    @property
+    def sheet_names(self) -> List[str]:
+        return [os.path.basename(self.path)]
+
+    def iter_rows(self, sheetname: str) -> Iterator[List[Any]]:
+        with open(self.path, encoding=self.encoding, newline="") as f:
+            yield from trim_rows(csv.reader(f, self.dialect))
+
+
+def sniff_csv_format(path: str) -> Tuple[str, Optional[Type[csv.Dialect]]]:
+    """Returns (encoding, dialect), dialect is None if it could not be detected"""
+    with open(path, "rb") as f:
+        prefix = f.read(CSV_SNIFF_SIZE)
+    encoding = sniff_encoding(prefix)
+    sample = prefix.decode(encoding, errors="ignore")
+    if len(prefix) == CSV_SNIFF_SIZE:
+        # Avoid sniffing the last line, which is most probably incomplete
+        sample = sample[: sample.rfind("\n") + 1] or sample
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=CSV_DELIMITERS)
+    except csv.Error:
+        dialect = None
+    return encoding, dialect
+
+
+def sniff_encoding(prefix: bytes) -> str:
+    for bom, encoding in BOM_ENCODINGS:
+        if prefix.startswith(bom):
+            return encoding
+    try:
+        # final=False so that a character split at the end of prefix is fine
+        codecs.getincrementaldecoder("utf-8")().decode(prefix, final=False)
+    except UnicodeDecodeError:
+        # latin-1 can decode any bytes
+        return "latin-1"
+    return "utf-8"
+
+
+class TextSession(CsvSession):
+    """
+    Text file as a single table. Delimited text is read like csv, otherwise
+    the lines are split in fixed width columns inferred from the first
+    FIXED_WIDTH_SAMPLE_LINES lines.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.colspecs: List[Tuple[int, Optional[int]]] = []
+        if self.sniffed_dialect is None:
+            with open(self.path, encoding=self.encoding) as f:
+                sample = islice(f, FIXED_WIDTH_SAMPLE_LINES)
+                self.colspecs = infer_colspecs(line.rstrip("\r\n") for line in sample)
+
+    def iter_rows(self, sheetname: str) -> Iterator[List[Any]]:
+        if not self.colspecs:
+            yield from super().iter_rows(sheetname)
+            return
+        with open(self.path, encoding=self.encoding) as f:
+            yield from trim_rows(
+                [line[start:end].strip() for start, end in self.colspecs] for line in f
+            )
+
+
+def infer_colspecs(lines: Iterable[str]) -> List[Tuple[int, Optional[int]]]:
+    """
+    Column boundaries of fixed width lines as [(start, end)]. A column is a
+    run of positions which are not blank in at least one of the lines. The
+    last column extends to the end of the line.
+    """
+    filled: List[bool] = []
+    for line in lines:
+        if len(line) > len(filled):
+            filled.extend([False] * (len(line) - len(filled)))
+        for i, char in enumerate(line):
+            if not char.isspace():
+                filled[i] = True
+    colspecs: List[Tuple[int, Optional[int]]] = []
+    start = None
+    for i, is_filled in enumerate(filled):
+        if is_filled and start is None:
+            start = i
+        elif not is_filled and start is not None:
+            colspecs.append((start, i))
+            start = None
+    if start is not None:
+        colspecs.append((start, None))
+    if colspecs:
+        colspecs[-1] = (colspecs[-1][0], None)
+    return colspecs
+
+
+class JsonSession(FileSession):
+    """
+    Json file, either an array of records or newline delimited records, as a
+    single table. Records are decoded incrementally. The columns are the keys
+    of the first JSON_SAMPLE_RECORDS records, in the order they appear, keys
+    which first appear after them are ignored. Nested values are kept as json
+    strings.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        with open(path, "rb") as f:
+            self.encoding = sniff_encoding(f.read(CSV_SNIFF_SIZE))
+
+    @property
+    def sheet_names(self) -> List[str]:
+        return [os.path.basename(self.path)]
+
+    def iter_rows(self, sheetname: str) -> Iterator[List[Any]]:
+        with open(self.path, encoding=self.encoding) as f:
+            records = iter_json_values(f)
+            sample = list(islice(records, JSON_SAMPLE_RECORDS))
+            keys: Dict[str, None] = {}
+            for record in sample:
+                if isinstance(record, dict):
+                    keys.update(dict.fromkeys(record))
+            if keys:
+                yield list(keys)
+            rows = (
+                get_json_record_row(record, keys) for record in chain(sample, records)
+            )
+            yield from trim_rows(rows)
+
+
+def get_json_record_row(record: Any, keys: Dict[str, None]) -> List[Any]:
+    if isinstance(record, dict):
+        values = [record.get(key) for key in keys]
+    elif isinstance(record, list):
+        values = record
+    else:
+        values = [record]
+    return [convert_json_value(value) for value in values]
+
+
+def convert_json_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    elif isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def iter_json_values(f, chunk_size: int = JSON_CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Decode values of a top level json array, or a sequence of json values
+    such as ndjson, from a text file without reading the whole file.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    is_array = None
+    while True:
+        # Skip whitespaces and separators between values
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                return
+            buffer, pos = f.read(chunk_size), 0
+            eof = not buffer
+            continue
+        if is_array is None:
+            is_array = buffer[pos] == "["
+            if is_array:
+                pos += 1
+                continue
+        if is_array and buffer[pos] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            end = None
+        # A value ending with the buffer, like a number, might be incomplete
+        if end is None or (end == len(buffer) and not eof):
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        pos = end
+        yield value
+
+
+__SESSIONS: "OrderedDict[str, FileSession]" = OrderedDict()
+
+
+def get_session(path: str, session_class: Type[FileSession]) -> FileSession:
+    """
+    Get an opened session for the file at path. Sessions are kept open so
+    that extractions in the same process do not open the file again, unless
+    the file has changed. Least recently used sessions are closed when there
+    are more than MAX_OPEN_SESSIONS.
+    """
+    session = __SESSIONS.pop(path, None)
+    if session is not None and (
+        session.is_stale or not isinstance(session, session_class)
+    ):
+        session.close()
+        session = None
+    if session is None:
+        session = session_class(path)
+    __SESSIONS[path] = session
+    while len(__SESSIONS) > MAX_OPEN_SESSIONS:
+        _, evicted = __SESSIONS.popitem(last=False)
+        evicted.close()
+    return session
+
+
+def close_sessions():
+    while __SESSIONS:
+        _, session = __SESSIONS.popitem()
+        session.close()
@@ -0,0 +1,59 @@
+from multiprocessing import shared_memory
+from typing import List, Tuple, TypedDict
+
+import numpy as np
+
+
+class SharedArray(TypedDict):
+    """A numpy array in a shared memory block, picklable by the block name"""
+
+    name: str
+    dtype: str
+    shape: Tuple[int, ...]
+
+
+class SharedColumn(TypedDict):
+    values: SharedArray
+    nulls: SharedArray
+
+
+def share_array(
+    array: np.ndarray, blocks: List[shared_memory.SharedMemory]
+) -> SharedArray:
+    """
+    Copy the array into a new shared memory block, which is appended to
+    blocks for the caller to unlink once done. Object arrays cannot be shared.
+    """
+    # Blocks cannot be empty
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+    return {"name": block.name, "dtype": array.dtype.str, "shape": array.shape}
+
+
+def load_array(shared: SharedArray) -> np.ndarray:
+    """Copy of the array in the shared memory block"""
+    block = shared_memory.SharedMemory(name=shared["name"])
+    try:
+        view = np.ndarray(
+            shared["shape"], dtype=np.dtype(shared["dtype"]), buffer=block.buf
+        )
+        array = view.copy()
+        # The block cannot be closed while a view of it exists
+        del view
+        return array
+    finally:
+        block.close()
+
+
+def share_column(
+    values: np.ndarray,
+    nulls: np.ndarray,
+    blocks: List[shared_memory.SharedMemory],
+) -> SharedColumn:
+    """Share the typed values of a column as returned by utils.stats.to_column_array"""
+    return {"values": share_array(values, blocks), "nulls": share_array(nulls, blocks)}
+
+
+def load_column(shared: SharedColumn) -> Tuple[np.ndarray, np.ndarray]:
+    return load_array(shared["values"]), load_array(shared["nulls"])
@@ -0,0 +1,192 @@
+import math
+from collections import Counter
+from typing import Any, Dict, List, Mapping, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Precision range of HyperLogLog, 16 to 262144 registers
+HLL_MIN_PRECISION = 4
+HLL_MAX_PRECISION = 18
+HLL_HASH_BITS = 64
+
+# A KLL sketch of k=200 has a normalized rank error of about 1.65%, which is
+# inversely proportional to k
+KLL_REFERENCE_K = 200
+KLL_REFERENCE_ERROR = 0.0165
+KLL_MIN_K = 8
+# Each level of the sketch keeps this fraction of the items of the level above
+KLL_CAPACITY_RATIO = 2 / 3
+
+
+class HyperLogLog:
+    """
+    Mergeable distinct count of values whose standard error is about
+    1.04 / sqrt(number of registers). The registers are picked for the error.
+    """
+
+    def __init__(self, error: float):
+        precision = math.ceil(2 * math.log2(1.04 / error))
+        self.precision = min(max(precision, HLL_MIN_PRECISION), HLL_MAX_PRECISION)
+        self.registers = np.zeros(2**self.precision, dtype=np.uint8)
+
+    def update(self, values: np.ndarray):
+        if len(values) == 0:
+            return
+        hashes = pd.util.hash_array(values)
+        # The top bits pick the register and the rest give the rank
+        rest_bits = HLL_HASH_BITS - self.precision
+        indices = (hashes >> np.uint64(rest_bits)).astype(np.intp)
+        rest = hashes & np.uint64((1 << rest_bits) - 1)
+        ranks = (rest_bits - get_bit_lengths(rest) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, indices, ranks)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precisions")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self) -> int:
+        size = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(size, 0.7213 / (1 + 1.079 / size))
+        estimate = (
+            alpha * size**2 / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        )
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * size and zeros > 0:
+            # Linear counting is more accurate for small counts
+            estimate = size * math.log(size / zeros)
+        return int(round(estimate))
+
+
+def get_bit_lengths(values: np.ndarray) -> np.ndarray:
+    """int.bit_length() of each of the uint64 values"""
+    values = values.copy()
+    lengths = np.zeros(len(values), dtype=np.int64)
+    for shift in [32, 16, 8, 4, 2, 1]:
+        is_longer = values >= np.uint64(1 << shift)
+        lengths[is_longer] += shift
+        values[is_longer] >>= np.uint64(shift)
+    return lengths + (values > 0)
+
+
+class KLLSketch:
+    """
+    Mergeable quantiles of numbers as per Karnin, Lang and Liberty. Level h
+    keeps items of weight 2^h and is compacted into the next level, keeping
+    every other sorted item, once it exceeds its capacity. k is picked for the
+    normalized rank error.
+    """
+
+    def __init__(self, error: float, seed: int = 0):
+        k = math.ceil(KLL_REFERENCE_K * KLL_REFERENCE_ERROR / error)
+        self.k = max(k, KLL_MIN_K)
+        self.count = 0
+        self.levels: List[np.ndarray] = [np.empty(0, dtype=np.float64)]
+        # Seeded so that the same data always gives the same quantiles
+        self.rng = np.random.default_rng(seed)
+
+    def update(self, values: np.ndarray):
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values.astype(np.float64)])
+        self.compress()
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        self.count += other.count
+        for level, items in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(items)
+            else:
+                self.levels[level] = np.concatenate([self.levels[level], items])
+        self.compress()
+        return self
+
+    def get_capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(math.ceil(self.k * KLL_CAPACITY_RATIO**depth), 2)
+
+    def compress(self):
+        # Compact the lowest full level until the sketch fits its capacity
+        while sum(map(len, self.levels)) > sum(
+            self.get_capacity(level) for level in range(len(self.levels))
+        ):
+            level = next(
+                level
+                for level, items in enumerate(self.levels)
+                if len(items) > self.get_capacity(level)
+            )
+            self.compact(level)
+
+    def compact(self, level: int):
+        items = np.sort(self.levels[level])
+        # An odd item out stays in the level
+        odd = len(items) % 2
+        kept, items = items[:odd], items[odd:]
+        offset = self.rng.integers(2)
+        promoted = items[offset::2]
+        self.levels[level] = kept
+        if level + 1 == len(self.levels):
+            self.levels.append(promoted)
+        else:
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def get_weighted_items(self) -> Tuple[np.ndarray, np.ndarray]:
+        items = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(len(x), 2**level) for level, x in enumerate(self.levels)]
+        )
+        return items, weights
+
+    def quantile(self, q: float) -> float:
+        items, weights = self.get_weighted_items()
+        order = np.argsort(items, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        position = np.searchsorted(cumulative, q * cumulative[-1])
+        return float(items[order][min(position, len(items) - 1)])
+
+    def histogram(self, edges: np.ndarray) -> np.ndarray:
+        """Estimated count of the values in each of the bins between the edges"""
+        items, weights = self.get_weighted_items()
+        counts, _ = np.histogram(items, bins=edges, weights=weights)
+        return counts.astype(np.int64)
+
+
+class FrequentItems:
+    """
+    Mergeable counts of the most frequent values as per Misra and Gries. Once
+    there are more than capacity values, the count of the value just outside
+    the capacity is taken off every count, so the counts are underestimated by
+    at most the number of values / (capacity + 1).
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[Any, int] = {}
+
+    def update(self, values: np.ndarray):
+        self.update_counts(pd.Series(values, dtype=object).value_counts().to_dict())
+
+    def merge(self, other: "FrequentItems") -> "FrequentItems":
+        self.update_counts(other.counts)
+        return self
+
+    def update_counts(self, counts: Mapping[Any, int]):
+        combined = Counter(self.counts)
+        combined.update(counts)
+        threshold = 0
+        if len(combined) > self.capacity:
+            threshold = sorted(combined.values(), reverse=True)[self.capacity]
+        self.counts = {
+            value: count - threshold
+            for value, count in combined.items()
+            if count > threshold
+        }
+
+    def most_common(self, k: int) -> List[Tuple[Any, int]]:
+        return get_most_common(self.counts, k)
+
+
+def get_most_common(counts: Mapping[Any, int], k: int) -> List[Tuple[Any, int]]:
+    """Top k of the counts, ties broken by the value so that the order is stable"""
+    return sorted(counts.items(), key=lambda x: (-x[1], str(x[0])))[:k]
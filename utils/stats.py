@@ -0,0 +1,620 @@
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
+from typing import Any, Callable, List, Mapping, Optional, Sequence, Tuple, cast
+
+import billiard
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .common import ColumnTypes, float_r
+from .shared_arrays import SharedColumn, load_column, share_column
+from .sketches import FrequentItems, HyperLogLog, KLLSketch, get_most_common
+from apps.core.types import (
+    ColumnStats,
+    HistogramBin,
+    NumericColumnStats,
+    StringColumnStats,
+    TemporalColumnStats,
+    ValueCount,
+)
+
+NUMERIC_TYPES = (ColumnTypes.INTEGER, ColumnTypes.FLOAT, ColumnTypes.NUMBER)
+TEMPORAL_TYPES = (ColumnTypes.DATE, ColumnTypes.DATETIME)
+
+# Number of values whose counts are kept for the top values once approximate
+FREQUENT_ITEMS_CAPACITY = 1000
+
+# Units of the granularity of dates and datetimes with their datetime64 codes,
+# finest first
+GRANULARITIES = [
+    ("second", "s"),
+    ("minute", "m"),
+    ("hour", "h"),
+    ("day", "D"),
+    ("month", "M"),
+    ("year", "Y"),
+]
+SECONDS_PER_DAY = 24 * 60 * 60
+# Columns of calculate_columns_stats() which are not in shared memory, as of
+# when it forks its processes
+_inherited_columns: List[Optional[Tuple[np.ndarray, np.ndarray]]] = []
+OFFSET_PATTERN = re.compile(r"T.*(?:[+-]\d{2}:?\d{2}|Z)$")
+
+
+def to_column_array(
+    items: Sequence, coltype: ColumnTypes
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Array of the values of a column along with the mask of the nulls. Numbers
+    are float64 with nan in place of nulls, dates and datetimes are
+    datetime64[s] with NaT in place of nulls and invalid values, other values
+    are objects.
+    """
+    if coltype in TEMPORAL_TYPES:
+        datetimes = to_datetimes(items)
+        return datetimes, np.isnat(datetimes)
+    nulls = np.fromiter((x is None for x in items), dtype=bool, count=len(items))
+    if coltype in NUMERIC_TYPES:
+        values = np.fromiter(
+            (np.nan if x is None else x for x in items),
+            dtype=np.float64,
+            count=len(items),
+        )
+    else:
+        values = np.empty(len(items), dtype=object)
+        values[:] = items
+    return values, nulls
+
+
+def calculate_stats(
+    values: np.ndarray,
+    nulls: np.ndarray,
+    coltype: ColumnTypes,
+    approximate_after: Optional[int] = None,
+) -> ColumnStats:
+    accumulator = get_stats_accumulator(coltype, approximate_after)
+    accumulator.update(values, nulls)
+    return accumulator.finalize()
+
+
+def calculate_columns_stats(
+    columns: Sequence[Tuple[np.ndarray, np.ndarray, ColumnTypes]],
+    approximate_after: Optional[int] = None,
+) -> List[ColumnStats]:
+    """
+    Stats of each of the (values, nulls, type) columns. Once there are at
+    least STATS_PARALLEL_MIN_VALUES values in all, the columns are calculated
+    in a pool of forked processes, as the stats of strings are mostly python
+    code holding the GIL. Numbers and datetimes are handed over through
+    shared memory. Strings are inherited by the processes as they are forked,
+    since encoding them to bytes and back takes longer than their stats.
+    """
+    global _inherited_columns
+    concurrency = min(get_stats_concurrency(), len(columns))
+    if (
+        concurrency <= 1
+        or sum(len(values) for values, _, _ in columns)
+        < settings.STATS_PARALLEL_MIN_VALUES
+    ):
+        return [
+            calculate_stats(values, nulls, coltype, approximate_after)
+            for values, nulls, coltype in columns
+        ]
+    blocks: List[shared_memory.SharedMemory] = []
+    try:
+        shared_columns = [
+            None if values.dtype == object else share_column(values, nulls, blocks)
+            for values, nulls, _ in columns
+        ]
+        _inherited_columns = [
+            (values, nulls) if shared is None else None
+            for (values, nulls, _), shared in zip(columns, shared_columns)
+        ]
+        # Processes of billiard, which celery forks its workers with, can be
+        # started from daemonic processes like those workers unlike the ones
+        # of multiprocessing
+        with ProcessPoolExecutor(
+            max_workers=concurrency, mp_context=billiard.get_context("fork")
+        ) as executor:
+            return list(
+                executor.map(
+                    calculate_shared_column_stats,
+                    range(len(columns)),
+                    shared_columns,
+                    [coltype for _, _, coltype in columns],
+                    repeat(approximate_after),
+                )
+            )
+    finally:
+        _inherited_columns = []
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def calculate_shared_column_stats(
+    index: int,
+    column: Optional[SharedColumn],
+    coltype: ColumnTypes,
+    approximate_after: Optional[int] = None,
+) -> ColumnStats:
+    """
+    Runs in a worker process of calculate_columns_stats(), the column is in
+    shared memory or else inherited at index.
+    """
+    if column is None:
+        values, nulls = cast(Tuple[np.ndarray, np.ndarray], _inherited_columns[index])
+    else:
+        values, nulls = load_column(column)
+    return calculate_stats(values, nulls, coltype, approximate_after)
+
+
+def get_stats_concurrency() -> int:
+    """settings.STATS_CONCURRENCY, or the number of cores this process can use"""
+    if settings.STATS_CONCURRENCY > 0:
+        return settings.STATS_CONCURRENCY
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_stats_accumulator(
+    coltype: ColumnTypes, approximate_after: Optional[int] = None
+) -> "StatsAccumulator":
+    if coltype in NUMERIC_TYPES:
+        return NumericStatsAccumulator(approximate_after)
+    if coltype in TEMPORAL_TYPES:
+        return TemporalStatsAccumulator(approximate_after)
+    return StringStatsAccumulator(approximate_after)
+
+
+def to_datetimes(items: Sequence) -> np.ndarray:
+    """
+    datetime64[s] of the iso dates and datetimes, NaT for nulls and invalid
+    values. Offsets are converted to UTC.
+    """
+    datetimes = np.full(len(items), np.datetime64("NaT"), dtype="datetime64[s]")
+    is_plain = np.fromiter(
+        (isinstance(x, str) and not OFFSET_PATTERN.search(x) for x in items),
+        dtype=bool,
+        count=len(items),
+    )
+    values = np.empty(len(items), dtype=object)
+    values[:] = items
+    # The rest are left to pandas, which is slower but parses the offsets
+    others = ~is_plain & pd.notna(values)
+    try:
+        datetimes[is_plain] = values[is_plain].astype("datetime64[s]")
+    except ValueError:
+        others |= is_plain
+    if others.any():
+        stamps = pd.to_datetime(
+            pd.Series(values[others]), errors="coerce", utc=True
+        ).dt.tz_localize(None)
+        datetimes[others] = stamps.to_numpy().astype("datetime64[s]")
+    return datetimes
+
+
+def get_granularity(datetimes: np.ndarray) -> int:
+    """Index of the coarsest of GRANULARITIES all of the datetimes are at the start of"""
+    granularity = 0
+    for i, (_, code) in enumerate(GRANULARITIES):
+        if (datetimes.astype(f"datetime64[{code}]") != datetimes).any():
+            break
+        granularity = i
+    return granularity
+
+
+def format_epoch_seconds(seconds: float) -> str:
+    return str(np.datetime64(round(seconds), "s"))
+
+
+def get_approximate_stats_after(table_properties: Mapping[str, Any]) -> int:
+    """Number of non null values of a column after which its stats are approximated"""
+    approximate_after = table_properties.get("approximateStatsAfter")
+    if approximate_after is None:
+        return settings.STATS_APPROXIMATE_AFTER
+    return approximate_after
+
+
+class StatsAccumulator:
+    """
+    Stats of a column which are fed a batch of values at a time and can be
+    merged with the stats of other batches of the same column, in any order,
+    before finalizing them into the stats dict of the column.
+
+    Once there are more than approximate_after non null values, the stats
+    which need all the values switch to sketches. None to never switch.
+    """
+
+    def __init__(self, approximate_after: Optional[int] = None):
+        self.approximate_after = approximate_after
+        self.total_count = 0
+        self.na_count = 0
+
+    @property
+    def is_approximate(self) -> bool:
+        raise NotImplementedError
+
+    def add(self, items: Sequence, coltype: ColumnTypes):
+        """update() with a list of the values"""
+        self.update(*to_column_array(items, coltype))
+
+    def add_nulls(self, count: int):
+        """update() with count null values"""
+        self.total_count += count
+        self.na_count += count
+
+    def update(self, values: np.ndarray, nulls: np.ndarray):
+        self.total_count += len(values)
+        self.na_count += int(nulls.sum())
+
+    def merge(self, other: "StatsAccumulator") -> "StatsAccumulator":
+        self.total_count += other.total_count
+        self.na_count += other.na_count
+        return self
+
+    def check_approximation(self):
+        if (
+            not self.is_approximate
+            and self.approximate_after is not None
+            and self.total_count - self.na_count > self.approximate_after
+        ):
+            self.approximate()
+
+    def approximate(self):
+        """Move the exact state to the sketches"""
+        raise NotImplementedError
+
+    def finalize(self) -> ColumnStats:
+        raise NotImplementedError
+
+
+class NumericStatsAccumulator(StatsAccumulator):
+    """
+    Count, sum, min and max along with the mean and the sum of squared
+    deviations (M2) which are combined as per Welford/Chan et al. The present
+    values are kept for the median and the histogram, or a KLL sketch when
+    approximate.
+    """
+
+    def __init__(self, approximate_after: Optional[int] = None):
+        super().__init__(approximate_after)
+        self.count = 0
+        self.sum = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.batches: List[np.ndarray] = []
+        self.sketch: Optional[KLLSketch] = None
+
+    @property
+    def is_approximate(self) -> bool:
+        return self.sketch is not None
+
+    def update(self, values: np.ndarray, nulls: np.ndarray):
+        super().update(values, nulls)
+        present = values[~nulls]
+        if len(present) == 0:
+            return
+        mean = present.mean()
+        self.combine(
+            len(present),
+            float(present.sum()),
+            mean,
+            float(np.square(present - mean).sum()),
+            present.min(),
+            present.max(),
+        )
+        if self.sketch is not None:
+            self.sketch.update(present)
+        else:
+            self.batches.append(present)
+        self.check_approximation()
+
+    def merge(self, other: StatsAccumulator) -> StatsAccumulator:
+        assert isinstance(other, NumericStatsAccumulator)
+        super().merge(other)
+        if other.count == 0:
+            return self
+        self.combine(other.count, other.sum, other.mean, other.m2, other.min, other.max)
+        if other.sketch is not None:
+            if self.sketch is None:
+                self.approximate()
+            cast(KLLSketch, self.sketch).merge(other.sketch)
+        elif self.sketch is not None:
+            self.sketch.update(np.concatenate(other.batches))
+        else:
+            self.batches.extend(other.batches)
+        self.check_approximation()
+        return self
+
+    def combine(self, count, total, mean, m2, minimum, maximum):
+        combined_count = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / combined_count
+        self.m2 += m2 + delta**2 * self.count * count / combined_count
+        self.count = combined_count
+        self.sum += total
+        # np.minimum and np.maximum keep nan
+        self.min = np.minimum(self.min, minimum)
+        self.max = np.maximum(self.max, maximum)
+
+    def approximate(self):
+        self.sketch = KLLSketch(settings.STATS_QUANTILE_ERROR)
+        if self.batches:
+            self.sketch.update(np.concatenate(self.batches))
+        self.batches = []
+
+    def finalize(self) -> NumericColumnStats:
+        if self.count == 0:
+            return {
+                "min": None,
+                "max": None,
+                "mean": None,
+                "median": None,
+                "std_deviation": None,
+                "total_count": self.total_count,
+                "na_count": self.na_count,
+                "is_approximate": self.is_approximate,
+                "histogram": None,
+            }
+        return {
+            "min": float_r(self.min),
+            "max": float_r(self.max),
+            "mean": float_r(self.mean),
+            "median": float_r(self.get_median()),
+            "std_deviation": float_r(np.sqrt(self.m2 / self.count)),
+            "total_count": self.total_count,
+            "na_count": self.na_count,
+            "is_approximate": self.is_approximate,
+            "histogram": self.get_histogram(),
+        }
+
+    def get_median(self) -> float:
+        if np.isnan(self.min):
+            return np.nan
+        if self.sketch is not None:
+            return self.sketch.quantile(0.5)
+        present = np.concatenate(self.batches)
+        mid_low, mid_high = (self.count - 1) // 2, self.count // 2
+        partitioned = np.partition(present, [mid_low, mid_high])
+        return (partitioned[mid_low] + partitioned[mid_high]) / 2
+
+    def get_histogram(
+        self, format_edge: Callable[[float], Any] = float_r
+    ) -> Optional[List[HistogramBin]]:
+        """
+        Counts of the values in settings.STATS_HISTOGRAM_BINS bins of equal
+        width between the min and the max
+        """
+        if self.count == 0 or not np.isfinite([self.min, self.max]).all():
+            return None
+        if self.min == self.max:
+            edges = np.array([self.min, self.max])
+            counts = np.array([self.count])
+        else:
+            edges = np.linspace(self.min, self.max, settings.STATS_HISTOGRAM_BINS + 1)
+            if self.sketch is not None:
+                counts = self.sketch.histogram(edges)
+            else:
+                counts, _ = np.histogram(np.concatenate(self.batches), bins=edges)
+        return [
+            {"start": format_edge(start), "end": format_edge(end), "count": int(count)}
+            for start, end, count in zip(edges[:-1], edges[1:], counts)
+        ]
+
+
+class StringStatsAccumulator(StatsAccumulator):
+    """
+    Lengths of the values and the count of each distinct value for the unique
+    count and the top values. When approximate, a HyperLogLog of the values
+    for the unique count and the frequent items for the top values.
+    """
+
+    def __init__(self, approximate_after: Optional[int] = None):
+        super().__init__(approximate_after)
+        self.min_length: Optional[int] = None
+        self.max_length: Optional[int] = None
+        self.value_counts: Counter = Counter()
+        self.sketch: Optional[HyperLogLog] = None
+        self.frequent_items: Optional[FrequentItems] = None
+
+    @property
+    def is_approximate(self) -> bool:
+        return self.sketch is not None
+
+    def update(self, values: np.ndarray, nulls: np.ndarray):
+        super().update(values, nulls)
+        present = values[~nulls]
+        if len(present) == 0:
+            return
+        lengths = np.fromiter(map(len, present), dtype=np.int64, count=len(present))
+        self.combine(int(lengths.min()), int(lengths.max()))
+        if self.sketch is not None:
+            self.sketch.update(present)
+            cast(FrequentItems, self.frequent_items).update(present)
+        else:
+            self.value_counts.update(
+                pd.Series(present, dtype=object).value_counts().to_dict()
+            )
+        self.check_approximation()
+
+    def merge(self, other: StatsAccumulator) -> StatsAccumulator:
+        assert isinstance(other, StringStatsAccumulator)
+        super().merge(other)
+        if other.min_length is None or other.max_length is None:
+            return self
+        self.combine(other.min_length, other.max_length)
+        if other.sketch is not None:
+            if self.sketch is None:
+                self.approximate()
+            cast(HyperLogLog, self.sketch).merge(other.sketch)
+            cast(FrequentItems, self.frequent_items).merge(
+                cast(FrequentItems, other.frequent_items)
+            )
+        elif self.sketch is not None:
+            self.sketch.update(
+                to_column_array(list(other.value_counts), ColumnTypes.STRING)[0]
+            )
+            cast(FrequentItems, self.frequent_items).update_counts(other.value_counts)
+        else:
+            self.value_counts.update(other.value_counts)
+        self.check_approximation()
+        return self
+
+    def combine(self, min_length: int, max_length: int):
+        if self.min_length is None or self.max_length is None:
+            self.min_length, self.max_length = min_length, max_length
+        else:
+            self.min_length = min(self.min_length, min_length)
+            self.max_length = max(self.max_length, max_length)
+
+    def approximate(self):
+        self.sketch = HyperLogLog(settings.STATS_DISTINCT_COUNT_ERROR)
+        self.sketch.update(
+            to_column_array(list(self.value_counts), ColumnTypes.STRING)[0]
+        )
+        self.frequent_items = FrequentItems(FREQUENT_ITEMS_CAPACITY)
+        self.frequent_items.update_counts(self.value_counts)
+        self.value_counts = Counter()
+
+    def finalize(self) -> StringColumnStats:
+        return {
+            "total_count": self.total_count,
+            "na_count": self.na_count,
+            "unique_count": (
+                self.sketch.estimate()
+                if self.sketch is not None
+                else len(self.value_counts)
+            ),
+            "max_length": self.max_length or 0,
+            "min_length": self.min_length or 0,
+            "is_approximate": self.is_approximate,
+            "top_values": self.get_top_values(),
+        }
+
+    def get_top_values(self) -> List[ValueCount]:
+        """The settings.STATS_TOP_VALUES most frequent values with their counts"""
+        if self.frequent_items is not None:
+            top_values = self.frequent_items.most_common(settings.STATS_TOP_VALUES)
+        else:
+            top_values = get_most_common(self.value_counts, settings.STATS_TOP_VALUES)
+        return [{"value": value, "count": count} for value, count in top_values]
+
+
+class TemporalStatsAccumulator(StatsAccumulator):
+    """
+    Stats of dates and datetimes as datetime64[s]. Their seconds since the
+    epoch are accumulated as numbers for the earliest, the latest and the
+    histogram. The distinct values are kept for the unique count, or a
+    HyperLogLog of them when approximate.
+
+    The granularity is the coarsest unit all of the values are at the start
+    of and the gaps are the periods of that unit between the earliest and the
+    latest which none of the values are in.
+    """
+
+    def __init__(self, approximate_after: Optional[int] = None):
+        super().__init__(approximate_after)
+        self.seconds = NumericStatsAccumulator(approximate_after)
+        self.granularity: Optional[int] = None
+        self.uniques: List[np.ndarray] = []
+        self.sketch: Optional[HyperLogLog] = None
+
+    @property
+    def is_approximate(self) -> bool:
+        return self.sketch is not None or self.seconds.is_approximate
+
+    def update(self, values: np.ndarray, nulls: np.ndarray):
+        super().update(values, nulls)
+        present = values[~nulls]
+        if len(present) == 0:
+            return
+        seconds = present.astype(np.int64)
+        self.seconds.update(seconds.astype(np.float64), np.zeros(len(seconds), bool))
+        self.combine(get_granularity(present))
+        if self.sketch is not None:
+            self.sketch.update(seconds)
+        else:
+            self.uniques.append(np.unique(seconds))
+        self.check_approximation()
+
+    def merge(self, other: StatsAccumulator) -> StatsAccumulator:
+        assert isinstance(other, TemporalStatsAccumulator)
+        super().merge(other)
+        if other.granularity is None:
+            return self
+        self.seconds.merge(other.seconds)
+        self.combine(other.granularity)
+        if other.sketch is not None:
+            if self.sketch is None:
+                self.approximate()
+            cast(HyperLogLog, self.sketch).merge(other.sketch)
+        elif self.sketch is not None:
+            self.sketch.update(np.concatenate(other.uniques))
+        else:
+            self.uniques.extend(other.uniques)
+        self.check_approximation()
+        return self
+
+    def combine(self, granularity: int):
+        if self.granularity is None:
+            self.granularity = granularity
+        else:
+            self.granularity = min(self.granularity, granularity)
+
+    def approximate(self):
+        self.sketch = HyperLogLog(settings.STATS_DISTINCT_COUNT_ERROR)
+        if self.uniques:
+            self.sketch.update(np.concatenate(self.uniques))
+        self.uniques = []
+
+    def finalize(self) -> TemporalColumnStats:
+        if self.granularity is None:
+            return {
+                "earliest": None,
+                "latest": None,
+                "range_days": None,
+                "granularity": None,
+                "gap_count": None,
+                "unique_count": 0,
+                "total_count": self.total_count,
+                "na_count": self.na_count,
+                "is_approximate": self.is_approximate,
+                "histogram": None,
+            }
+        unit, code = GRANULARITIES[self.granularity]
+        earliest = np.datetime64(int(self.seconds.min), "s")
+        latest = np.datetime64(int(self.seconds.max), "s")
+        periods = int(
+            latest.astype(f"datetime64[{code}]").astype(np.int64)
+            - earliest.astype(f"datetime64[{code}]").astype(np.int64)
+            + 1
+        )
+        unique_count = (
+            self.sketch.estimate()
+            if self.sketch is not None
+            else len(np.unique(np.concatenate(self.uniques)))
+        )
+        return {
+            "earliest": str(earliest),
+            "latest": str(latest),
+            "range_days": float_r(
+                (self.seconds.max - self.seconds.min) / SECONDS_PER_DAY
+            ),
+            "granularity": unit,
+            # The estimated unique count can be more than the periods
+            "gap_count": max(periods - unique_count, 0),
+            "unique_count": unique_count,
+            "total_count": self.total_count,
+            "na_count": self.na_count,
+            "is_approximate": self.is_approximate,
+            "histogram": self.seconds.get_histogram(format_epoch_seconds),
+        }
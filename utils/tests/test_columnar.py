@@ -0,0 +1,86 @@
+import io
+
+from utils.columnar import ColumnarReader, ColumnarWriter, write_rows
+
+ROWS = [
+    {
+        "key": str(i),
+        "int": i if i % 3 else None,
+        "float": i * 1.5 if i % 4 else None,
+        "number": i if i % 2 else float(i),
+        "bool": i % 2 == 0,
+        "string": f"काठमाडौं {i}" if i % 5 else None,
+        "category": ["a", "b", None][i % 3],
+        "other": {"lat": i} if i % 7 else 2**70,
+    }
+    for i in range(50)
+]
+
+
+def get_reader(rows) -> ColumnarReader:
+    f = io.BytesIO()
+    write_rows(rows, f)
+    f.seek(0)
+    return ColumnarReader(f)
+
+
+def test_columnar_rows():
+    reader = get_reader(ROWS)
+    assert reader.num_rows == len(ROWS)
+    assert reader.keys == list(ROWS[0])
+    rows = reader.read_rows()
+    assert rows == ROWS
+    assert [type(x["number"]) for x in rows] == [type(x["number"]) for x in ROWS]
+    assert {key: reader.get_kinds(key) for key in reader.keys} == {
+        "key": ["row_number"],
+        "int": ["int"],
+        "float": ["float"],
+        "number": ["number"],
+        "bool": ["bool"],
+        "string": ["string"],
+        "category": ["dictionary"],
+        "other": ["json"],
+    }
+    assert get_reader([]).read_rows() == []
+
+
+def test_columnar_partial_reads():
+    reader = get_reader(ROWS)
+    keys = ["string", "int", "category", "number"]
+    for start, stop in [(0, 0), (0, 1), (3, 10), (10, 3), (7, 9), (45, None)]:
+        assert reader.read_rows(keys, start, stop) == [
+            {key: row[key] for key in keys} for row in ROWS[start:stop]
+        ], (start, stop)
+    assert reader.read_column("float", 47) == [70.5, None, 73.5]
+
+
+def test_columnar_rows_written_in_batches():
+    f = io.BytesIO()
+    writer = ColumnarWriter(f)
+    # Columns added by later batches are None in the earlier rows
+    batches = [
+        [{k: v for k, v in row.items() if k != "other"} for row in ROWS[:7]],
+        ROWS[7:20],
+        [],
+        ROWS[20:],
+    ]
+    for batch in batches:
+        writer.write_batch(batch)
+        reader = writer.reader()
+        assert reader.read_rows() == [
+            {key: row.get(key) for key in reader.keys}
+            for rows in batches[: batches.index(batch) + 1]
+            for row in rows
+        ]
+    writer.close()
+    f.seek(0)
+    reader = ColumnarReader(f)
+    assert reader.num_rows == len(ROWS)
+    assert reader.keys == list(ROWS[0])
+    expected = [{**row, "other": None} for row in ROWS[:7]] + ROWS[7:]
+    assert reader.read_rows() == expected
+    assert reader.get_kinds("key") == ["row_number"] * 3
+    for start, stop in [(0, 0), (5, 9), (6, 7), (7, 8), (19, 21), (3, None)]:
+        assert reader.read_rows(["key", "other"], start, stop) == [
+            {"key": row["key"], "other": row["other"]} for row in expected[start:stop]
+        ], (start, stop)
@@ -1,11 +1,40 @@
+import io
 import os
+import json
+import math
+from datetime import date, datetime, time, timedelta
 import pandas as pd
+from contextlib import contextmanager
+from unittest import mock
 
 from django.test import override_settings
 from django.conf import settings
 
-from dive.base_test import BaseTestWithDataFrameAndExcel, DATA, NUM_ROWS
-from utils.extraction import extract_data_from_excel
+from dive.base_test import BaseTestWithDataFrameAndExcel, DATA, DATAFRAME, NUM_ROWS
+from utils.extraction import (
+    extract_data_from_excel,
+    extract_data_in_batches,
+    read_extracted_rows,
+    extract_preview_data,
+    extract_preview_data_cached,
+    get_column_values,
+    parse_cell,
+    clear_preview_cache,
+)
+from utils.cache import LRUCache
+from utils.columnar import ColumnarReader, ColumnarWriter
+from utils.readers import (
+    ExcelSession,
+    CsvSession,
+    JsonSession,
+    TextSession,
+    iter_json_values,
+    iter_persisted_rows,
+    persist_rows,
+    sniff_csv_format,
+    MAX_HEADER_LEVEL,
+    PREVIEW_ROWS_COUNT,
+)
 from utils.common import ColumnTypes
 
 TEST_MEDIA_DIR = os.path.join(settings.TEST_DIR, "media")
@@ -126,6 +155,8 @@ class TestExtraction(BaseTestWithDataFrameAndExcel):
             "total_count",
             "std_deviation",
             "na_count",
+            "is_approximate",
+            "histogram",
             "key",
             "label",
             "type",
@@ -138,6 +169,8 @@ class TestExtraction(BaseTestWithDataFrameAndExcel):
             "total_count",
             "std_deviation",
             "na_count",
+            "is_approximate",
+            "histogram",
             "key",
             "label",
             "type",
@@ -148,11 +181,383 @@ class TestExtraction(BaseTestWithDataFrameAndExcel):
             "unique_count",
             "max_length",
             "min_length",
+            "is_approximate",
+            "top_values",
             "key",
             "label",
             "type",
         }
 
+    def test_vectorized_extraction_matches_per_cell_extraction(self):
+        xl = pd.ExcelFile(self.excel_file_path)
+        sheetname = xl.sheet_names[0]
+        props_list = [
+            self.default_table_properties,
+            {**self.default_table_properties, "headerLevel": "1"},
+            {
+                **self.default_table_properties,
+                "trimWhitespaces": True,
+                "treatTheseAsNa": "Sita",
+            },
+        ]
+        for props in props_list:
+            vectorized, _ = extract_data_from_excel(
+                xl, sheetname, props, calculate_stats=True
+            )
+            per_cell, _ = extract_data_from_excel(
+                xl, sheetname, props, calculate_stats=True, vectorized=False
+            )
+            assert vectorized == per_cell, "Extracted data should be identical"
+
+    def test_vectorized_integers_beyond_int64(self):
+        for series in [
+            pd.Series([1e20, -2.0, 3.0]),
+            pd.Series([2**64 - 1, 2, 3], dtype="uint64"),
+        ]:
+            expected = [parse_cell(x, ColumnTypes.INTEGER) for x in series.tolist()]
+            assert expected[0] == int(series[0])
+            assert get_column_values(series, ColumnTypes.INTEGER) == expected
+
+    def test_batched_extraction_matches_extraction(self):
+        xl = pd.ExcelFile(self.excel_file_path)
+        sheetname = xl.sheet_names[0]
+        for header_level in ["0", "1", "2"]:
+            props = {**self.default_table_properties, "headerLevel": header_level}
+            expected, _ = extract_data_from_excel(
+                xl, sheetname, props, calculate_stats=True
+            )
+            for batch_size in [3, NUM_ROWS * 2]:
+                with ExcelSession(self.excel_file_path) as session:
+                    extracted, err = extract_data_in_batches(
+                        session,
+                        sheetname,
+                        props,
+                        calculate_stats=True,
+                        batch_size=batch_size,
+                    )
+                assert err is None
+                assert extracted == expected, f"Mismatch for batch size {batch_size}"
+
+    def test_session_preview_matches_extraction(self):
+        xl = pd.ExcelFile(self.excel_file_path)
+        sheetname = xl.sheet_names[0]
+        with ExcelSession(self.excel_file_path) as session:
+            for header_level in ["0", "1", "2"]:
+                props = {**self.default_table_properties, "headerLevel": header_level}
+                expected, _ = extract_data_from_excel(
+                    xl, sheetname, props, is_preview=True
+                )
+                preview, err = extract_preview_data(session, sheetname, props)
+                assert err is None
+                assert preview == expected
+            assert list(session._head_rows.keys()) == [
+                sheetname
+            ], "Top rows of the sheet should be read only once"
+
+    @contextmanager
+    def open_written_session(self, session_class, path: str, write):
+        """Session of the file written by write(path), which is removed after"""
+        try:
+            write(path)
+            with session_class(path) as session:
+                yield session
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def assert_session_extraction_matches_excel_extraction(self, session):
+        xl = pd.ExcelFile(self.excel_file_path)
+        [name] = session.sheet_names
+        for header_level in ["0", "1"]:
+            props = {**self.default_table_properties, "headerLevel": header_level}
+            expected, _ = extract_data_from_excel(
+                xl, xl.sheet_names[0], props, calculate_stats=True
+            )
+            extracted, _ = extract_data_in_batches(
+                session, name, props, calculate_stats=True, batch_size=4
+            )
+            assert extracted == expected
+            preview, _ = extract_preview_data(session, name, props)
+            assert preview["rows"] == expected["rows"]
+
+    def test_csv_extraction_matches_excel_extraction(self):
+        with self.open_written_session(
+            CsvSession,
+            "test_result.csv",
+            lambda path: DATAFRAME.to_csv(
+                path, index=False, sep=";", encoding="utf-16"
+            ),
+        ) as session:
+            encoding, dialect = sniff_csv_format(session.path)
+            assert encoding == "utf-16"
+            assert dialect.delimiter == ";"
+            assert session.sheet_names == [session.path]
+            self.assert_session_extraction_matches_excel_extraction(session)
+
+    def test_json_extraction_matches_excel_extraction(self):
+        for lines in [False, True]:
+            with self.open_written_session(
+                JsonSession,
+                "test_result.json",
+                lambda path: DATAFRAME.to_json(path, orient="records", lines=lines),
+            ) as session:
+                self.assert_session_extraction_matches_excel_extraction(session)
+
+    def test_iter_json_values(self):
+        records = [{"a": 1, "b": [1, {"c": "x y"}]}, {"a": 12345.5}, None, "]"]
+        documents = [
+            "[" + ", ".join(json.dumps(r) for r in records) + "]",
+            "\n".join(json.dumps(r) for r in records),
+            "\n  ".join(json.dumps(r, indent=2) for r in records),
+            "[]",
+            "",
+        ]
+        for document in documents:
+            for chunk_size in [1, 3, 1024]:
+                values = list(iter_json_values(io.StringIO(document), chunk_size))
+                assert values == (records if len(document) > 2 else [])
+
+    def test_fixed_width_text_extraction_matches_excel_extraction(self):
+        def write(path):
+            with open(path, "w") as f:
+                f.write(DATAFRAME.to_string(index=False))
+
+        with self.open_written_session(
+            TextSession, "test_result.txt", write
+        ) as session:
+            assert session.sniffed_dialect is None
+            assert len(session.colspecs) == len(DATAFRAME.columns)
+            self.assert_session_extraction_matches_excel_extraction(session)
+
+    def test_delimited_text_extraction_matches_excel_extraction(self):
+        with self.open_written_session(
+            TextSession,
+            "test_result.txt",
+            lambda path: DATAFRAME.to_csv(path, index=False, sep="\t"),
+        ) as session:
+            assert session.colspecs == []
+            self.assert_session_extraction_matches_excel_extraction(session)
+
+    def test_cached_preview_extraction(self):
+        clear_preview_cache()
+        props = {**self.default_table_properties, "headerLevel": "1"}
+        with ExcelSession(self.excel_file_path) as session:
+            sheetname = session.sheet_names[0]
+            expected, _ = extract_preview_data(session, sheetname, props)
+            preview, _ = extract_preview_data_cached(session, sheetname, props)
+            assert preview == expected
+        with ExcelSession(self.excel_file_path) as session, mock.patch(
+            "utils.extraction.extract_preview_data"
+        ) as extract_mock:
+            preview, err = extract_preview_data_cached(
+                session,
+                sheetname,
+                {**props, "headerLevel": 1, "approximateStatsAfter": 10},
+            )
+            assert not extract_mock.called, "Cached preview should be returned"
+            assert err is None
+            assert preview == expected
+            preview["rows"].clear()
+            preview, _ = extract_preview_data_cached(session, sheetname, props)
+            assert preview == expected, "Cached preview should not be modified"
+
+    def test_file_is_hashed_only_to_persist_its_raw_rows(self):
+        clear_preview_cache()
+        props = self.default_table_properties
+        with ExcelSession(self.excel_file_path) as session, mock.patch(
+            "utils.readers.get_content_digest", return_value="content"
+        ) as digest_func:
+            sheetname = session.sheet_names[0]
+            extract_preview_data_cached(session, sheetname, props)
+            assert not digest_func.called, "Previews should not hash the file"
+            extract_data_in_batches(session, sheetname, props)
+            digest_func.assert_called_once()
+            assert session.has_raw_rows(sheetname)
+
+    def test_preview_reads_only_top_rows(self):
+        read_count = 0
+
+        def endless_rows(sheetname):
+            nonlocal read_count
+            while True:
+                read_count += 1
+                yield [read_count, "name", 1.5]
+
+        with ExcelSession(self.excel_file_path) as session, mock.patch.object(
+            session, "iter_rows", side_effect=endless_rows
+        ):
+            for header_level in ["0", str(MAX_HEADER_LEVEL)]:
+                props = {**self.default_table_properties, "headerLevel": header_level}
+                preview, _ = extract_preview_data(session, "sheet", props)
+                assert len(preview["rows"]) == PREVIEW_ROWS_COUNT
+        assert read_count == MAX_HEADER_LEVEL + 1 + PREVIEW_ROWS_COUNT
+
+    def test_batched_extraction_adds_columns_of_longer_rows(self):
+        raw_rows = [["id", "name"], *[[i, "name"] for i in range(5)], [5, "x", 2.5]]
+        with ExcelSession(self.excel_file_path) as session, mock.patch.object(
+            session, "iter_rows", side_effect=lambda sheetname: iter(raw_rows)
+        ):
+            props = self.default_table_properties
+            preview, _ = extract_preview_data(session, "longer rows", props)
+            for batch_size in [2, 10]:
+                extracted, err = extract_data_in_batches(
+                    session, "longer rows", props, batch_size=batch_size
+                )
+                assert err is None
+                assert extracted["columns"] == preview["columns"]
+                assert extracted["rows"] == preview["rows"]
+        assert [col["label"] for col in preview["columns"]] == [
+            "id",
+            "name",
+            "Unnamed: 2",
+        ]
+        assert [row["2"] for row in preview["rows"]] == [None] * 5 + [2.5]
+
+    def test_batched_extraction_widens_types_of_later_values(self):
+        raw_rows = [
+            ["price", "code"],
+            *[[6000 + i, i] for i in range(6)],
+            [6000.5, "A1"],
+        ]
+        with ExcelSession(self.excel_file_path) as session, mock.patch.object(
+            session, "iter_rows", side_effect=lambda sheetname: iter(raw_rows)
+        ):
+            props = self.default_table_properties
+            expected, _ = extract_data_in_batches(
+                session, "mixed types", props, calculate_stats=True, batch_size=10
+            )
+            extracted, err = extract_data_in_batches(
+                session, "mixed types", props, calculate_stats=True, batch_size=3
+            )
+        assert err is None
+        assert extracted == expected
+        assert [col["type"] for col in extracted["columns"]] == [
+            ColumnTypes.FLOAT,
+            ColumnTypes.STRING,
+        ]
+        assert [row["0"] for row in extracted["rows"]][-2:] == [6005.0, 6000.5]
+        assert [row["1"] for row in extracted["rows"]][-2:] == ["5", "A1"]
+
+    def test_batched_extraction_written_to_columnar_file(self):
+        raw_rows = [
+            ["price", "code"],
+            *[[6000 + i, i] for i in range(6)],
+            [6000.5, 2.5],
+            [7000, "A1", "new"],
+        ]
+        with ExcelSession(self.excel_file_path) as session, mock.patch.object(
+            session, "iter_rows", side_effect=lambda sheetname: iter(raw_rows)
+        ):
+            props = self.default_table_properties
+            expected, _ = extract_data_in_batches(
+                session, "written types", props, calculate_stats=True, batch_size=3
+            )
+            f = io.BytesIO()
+            writer = ColumnarWriter(f)
+            extracted, err = extract_data_in_batches(
+                session,
+                "written types",
+                props,
+                calculate_stats=True,
+                batch_size=3,
+                writer=writer,
+            )
+            writer.close()
+        assert err is None
+        assert extracted == {**expected, "rows": []}
+        assert [col["type"] for col in extracted["columns"]] == [
+            ColumnTypes.FLOAT,
+            ColumnTypes.STRING,
+            ColumnTypes.STRING,
+        ]
+        rows = read_extracted_rows(ColumnarReader(f))
+        assert rows == expected["rows"]
+        assert [row["1"] for row in rows][-4:] == ["4", "5", "2.5", "A1"]
+        assert read_extracted_rows(ColumnarReader(f), ["0"], 0, 2) == [
+            {"0": 6000.0},
+            {"0": 6001.0},
+        ]
+
+    def test_extraction_keeps_values_not_conforming_to_inferred_type(self):
+        # Likely outside of the sample the type is inferred from
+        raw_rows = [["count"], *[[i] for i in range(5000)]]
+        raw_rows[2500] = ["unknown"]
+        with ExcelSession(self.excel_file_path) as session, mock.patch.object(
+            session, "iter_rows", side_effect=lambda sheetname: iter(raw_rows)
+        ):
+            extracted, err = extract_data_in_batches(
+                session,
+                "unsampled values",
+                self.default_table_properties,
+                batch_size=10000,
+            )
+        assert err is None
+        assert extracted["columns"][0]["type"] == ColumnTypes.STRING
+        assert extracted["rows"][2499]["0"] == "unknown"
+        assert extracted["rows"][0]["0"] == "0"
+        assert extracted["column_type_confidences"] == {"0": 0.0002}
+
+    def test_extraction_from_persisted_raw_rows(self):
+        props_list = [
+            {**self.default_table_properties, "headerLevel": header_level}
+            for header_level in ["0", "1"]
+        ] + [{**self.default_table_properties, "trimWhitespaces": True}]
+        expected_list = []
+        with ExcelSession(self.excel_file_path) as session:
+            sheetname = session.sheet_names[0]
+            for props in props_list:
+                expected, _ = extract_data_in_batches(
+                    session, sheetname, props, calculate_stats=True, batch_size=4
+                )
+                expected_list.append(expected)
+            assert session.has_raw_rows(sheetname)
+        with ExcelSession(self.excel_file_path) as session, mock.patch.object(
+            session, "iter_rows", side_effect=Exception("Should not read the file")
+        ):
+            for props, expected in zip(props_list, expected_list):
+                extracted, _ = extract_data_in_batches(
+                    session, sheetname, props, calculate_stats=True, batch_size=4
+                )
+                assert extracted == expected
+                preview, _ = extract_preview_data(session, sheetname, props)
+                assert preview["rows"] == expected["rows"]
+
     def tearDown(self):
         if os.path.exists(self.excel_file_path):
             os.remove(self.excel_file_path)
+
+
+def test_lru_cache_eviction():
+    cache: LRUCache[str] = LRUCache(max_size=10)
+    cache.set("a", "a", 4)
+    cache.set("b", "b", 4)
+    assert cache.get("a") == "a"
+    cache.set("c", "c", 4)
+    assert "b" not in cache, "Least recently used item should be evicted"
+    assert cache.get("a") == "a" and cache.get("c") == "c"
+    assert cache.size == 8
+    cache.set("d", "d", 11)
+    assert "d" not in cache and len(cache) == 2, "Items larger than cache are skipped"
+
+
+def test_persisted_raw_rows(tmp_path):
+    rows = [
+        ["name", "born", "at", "took", "score"],
+        ["Ram", date(1990, 1, 2), datetime(2020, 1, 2, 3, 4, 5), time(6, 7), 1.5],
+        ["Sita", "", "", timedelta(hours=1, seconds=2), float("nan")],
+        [],
+        ["Hari", True, 3],
+    ]
+    path = str(tmp_path / "sheet.jsonl")
+    assert list(persist_rows(iter(rows), lambda: path, str(tmp_path))) == rows
+    persisted = list(iter_persisted_rows(path))
+    assert persisted[:2] == rows[:2] and persisted[3:] == rows[3:]
+    assert persisted[2][:4] == rows[2][:4] and math.isnan(persisted[2][4])
+
+    # Rows having cells which cannot be persisted are only passed through
+    path = str(tmp_path / "other.jsonl")
+    unpersisted = [["a"], [object()], ["b"]]
+    get_path = mock.Mock(return_value=path)
+    assert list(persist_rows(iter(unpersisted), get_path, str(tmp_path))) == unpersisted
+    assert not os.path.exists(path) and not get_path.called
+    assert sorted(os.listdir(tmp_path)) == ["sheet.jsonl"]
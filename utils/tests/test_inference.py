@@ -0,0 +1,66 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.common import ColumnTypes
+from utils.inference import infer_column_type, infer_column_types
+from utils.extraction import prepare_df
+
+PROPS = {
+    "headerLevel": "0",
+    "timezone": "UTC",
+    "language": "en",
+    "trimWhitespaces": False,
+    "treatTheseAsNa": "-",
+}
+
+
+def test_infer_column_types_from_dtypes():
+    df = pd.DataFrame(
+        {
+            "int": [1, 2, 3],
+            "integral_float": [1.0, np.nan, 3.0],
+            "float": [1.5, 2.0, np.nan],
+            "datetime": pd.to_datetime(["2022-01-01", None, "2022-01-03"]),
+            "bool": [True, False, True],
+            "string": ["a", "b", None],
+        }
+    )
+    inferred = infer_column_types(prepare_df(df, PROPS))
+    assert inferred == [
+        (ColumnTypes.INTEGER, 1.0),
+        (ColumnTypes.INTEGER, 1.0),
+        (ColumnTypes.FLOAT, 1.0),
+        (ColumnTypes.DATETIME, 1.0),
+        (ColumnTypes.STRING, 1.0),
+        (ColumnTypes.STRING, 1.0),
+    ]
+
+
+def test_infer_mixed_column_type():
+    values = [*range(19), "unknown"]
+    assert infer_column_type(pd.Series(values, dtype=object)) == (
+        ColumnTypes.STRING,
+        0.05,
+    ), "Values not conforming to a type should not become null"
+    values = [*range(5), 2.5, "unknown", "n/a"]
+    assert infer_column_type(pd.Series(values, dtype=object)) == (
+        ColumnTypes.STRING,
+        0.25,
+    )
+    values = [datetime(2022, 1, i) for i in range(1, 20)] + ["today"]
+    assert infer_column_type(pd.Series(values, dtype=object))[0] == (ColumnTypes.STRING)
+    values = [*range(5), 2.5]
+    assert infer_column_type(pd.Series(values, dtype=object)) == (
+        ColumnTypes.FLOAT,
+        1.0,
+    )
+
+
+def test_infer_column_type_validates_whole_column_when_sample_is_mixed():
+    # Strings at the end which are in the sample, but fewer overall
+    values = [*range(10000), *["x"] * 50]
+    coltype, confidence = infer_column_type(pd.Series(values, dtype=object))
+    assert coltype == ColumnTypes.STRING
+    assert confidence == round(50 / 10050, 4)
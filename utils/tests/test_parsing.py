@@ -0,0 +1,161 @@
+import numpy as np
+
+from utils.common import ColumnTypes
+from utils.parsing import (
+    parse,
+    parse_many,
+    get_parse_cache_info,
+    get_table_parser,
+    clear_parse_cache,
+)
+
+VALUES = [
+    None,
+    "1",
+    " 2 ",
+    "+3",
+    "-0",
+    "0",
+    "1_000",
+    "٣",
+    "1.5",
+    "2.123456789",
+    "1e3",
+    "1.0",
+    "nan",
+    "-inf",
+    "abc",
+    "",
+    "1,000",
+    "99999999999999999999999",
+    0,
+    7,
+    2.5,
+    3.0,
+    True,
+]
+
+
+def test_parse_many_matches_parse():
+    for coltype in [
+        ColumnTypes.INTEGER,
+        ColumnTypes.FLOAT,
+        ColumnTypes.NUMBER,
+        ColumnTypes.STRING,
+    ]:
+        parsed, failed = parse_many(VALUES, coltype)
+        expected = [parse(x, coltype) for x in VALUES]
+        # nan != nan, compare their representations
+        assert [repr(x) for x in parsed] == [repr(x) for x in expected], coltype
+        assert [type(x) for x in parsed] == [type(x) for x in expected], coltype
+        assert failed.tolist() == [
+            x is not None and y is None for x, y in zip(VALUES, expected)
+        ]
+
+
+def test_parse_many_typed_arrays():
+    ints = np.array([0, 1, 20])
+    floats = np.array([1.0, 2.1234567, np.nan])
+    for values in [ints, floats]:
+        for coltype in [ColumnTypes.INTEGER, ColumnTypes.FLOAT, ColumnTypes.NUMBER]:
+            parsed, _ = parse_many(values, coltype)
+            expected = [parse(x, coltype) for x in values.tolist()]
+            assert [repr(x) for x in parsed] == [repr(x) for x in expected]
+    parsed, failed = parse_many(ints, ColumnTypes.NUMBER)
+    assert parsed.tolist() == [0.0, 1, 20]
+    assert not failed.any()
+
+
+def test_parse_many_dates():
+    values = ["05/01/2022", "25/12/2022", "2/3/2021", "yesterday", None, "hello"]
+    parsed, failed = parse_many(values, ColumnTypes.DATE)
+    # Day first is the only format all of the dates are in
+    assert parsed.tolist()[:3] == ["2022-01-05", "2022-12-25", "2021-03-02"]
+    assert parsed[3] == parse("yesterday", ColumnTypes.DATE)
+    assert failed.tolist() == [False, False, False, False, False, True]
+
+    values = ["2022-01-05", "2022-01-05 10:11:12", "2022-01-05T10:11:12.5", "2022"]
+    parsed, _ = parse_many(values, ColumnTypes.DATETIME)
+    assert parsed.tolist() == [parse(x, ColumnTypes.DATETIME) for x in values]
+
+    values = ["2022-01-05T10:00:00+05:45", "1500-01-01", "1 Jan 2022", 45000.5, 1e10]
+    parsed, _ = parse_many(values, ColumnTypes.DATETIME, excel_serials=True)
+    assert parsed.tolist() == [
+        "2022-01-05T10:00:00+05:45",
+        "1500-01-01T00:00:00",
+        "2022-01-01T00:00:00",
+        "2023-03-15T12:00:00",
+        None,
+    ], "Excel serial dates are converted"
+
+
+def test_parse_many_dates_matches_parse():
+    values = [2021, 45000, 45000.5, 1e10, "2021", "45000"]
+    for coltype in [ColumnTypes.DATE, ColumnTypes.DATETIME]:
+        for excel_serials in [False, True]:
+            parsed, _ = parse_many(values, coltype, excel_serials)
+            assert parsed.tolist() == [
+                parse(x, coltype, excel_serials) for x in values
+            ], (coltype, excel_serials)
+    parsed, _ = parse_many([2021, 45000], ColumnTypes.DATE)
+    assert parsed[0] == parse("2021", ColumnTypes.DATE), "Numbers are not serials"
+    parsed, _ = parse_many([2021, 45000], ColumnTypes.DATE, excel_serials=True)
+    assert parsed.tolist() == ["1905-07-13", "2023-03-15"]
+
+
+def test_parse_many_dates_having_different_offsets():
+    values = [
+        "2022-03-26T10:00:00+01:00",
+        "2022-03-27T10:00:00+02:00",
+        "2022-03-28T10:00:00Z",
+        "2022-03-29T10:00:00",
+    ]
+    for parser in [
+        get_table_parser({"timezone": "Asia/Kathmandu"}),
+        get_table_parser({}),
+    ]:
+        parsed, failed = parser.parse_many(values, ColumnTypes.DATETIME)
+        assert parsed.tolist() == [
+            parser.parse(x, ColumnTypes.DATETIME) for x in values
+        ]
+        assert not failed.any()
+    parser = get_table_parser({"timezone": "UTC"})
+    parsed, _ = parser.parse_many(values, ColumnTypes.DATETIME)
+    assert parsed.tolist() == [
+        "2022-03-26T09:00:00",
+        "2022-03-27T08:00:00",
+        "2022-03-28T10:00:00",
+        "2022-03-29T10:00:00",
+    ]
+
+
+def test_parse_many_caches_values_parsed_one_by_one():
+    clear_parse_cache()
+    values = ["n/a", "1", "unknown", "2"] * 50
+    parsed, failed = parse_many(values, ColumnTypes.INTEGER)
+    assert parsed.tolist() == [None, 1, None, 2] * 50
+    assert failed.sum() == 100
+    assert get_parse_cache_info() == {"hits": 98, "misses": 2, "size": 2}
+    # Numbers are tried as integers, which are cached, and then as floats
+    parse_many(["unknown"], ColumnTypes.NUMBER)
+    assert get_parse_cache_info() == {"hits": 99, "misses": 3, "size": 3}
+
+
+def test_table_parser():
+    props = {"timezone": "Asia/Kathmandu", "language": "fr"}
+    parser = get_table_parser(props)
+    assert get_table_parser({**props}) is parser, "Parsers are reused"
+    assert parser.parse("5 janvier 2022", ColumnTypes.DATE) == "2022-01-05"
+    assert parser.parse("5 Jan 2022", ColumnTypes.DATE) == "2022-01-05"
+    english_parser = get_table_parser({"timezone": "UTC", "language": "en"})
+    assert english_parser.parse("5 janvier 2022", ColumnTypes.DATE) is None
+    assert parse("5 janvier 2022", ColumnTypes.DATE) == "2022-01-05"
+
+    # Offsets are converted to the timezone, in the fast path and in dateparser
+    values = ["2022-01-05T10:00:00+00:00", "2022-01-06T10:00:00+00:00"]
+    parsed, _ = parser.parse_many(values, ColumnTypes.DATETIME)
+    assert parsed.tolist() == ["2022-01-05T15:45:00", "2022-01-06T15:45:00"]
+    assert parser.parse(values[0], ColumnTypes.DATETIME) == "2022-01-05T15:45:00"
+    assert parser.parse("2022-01-05 10:00", ColumnTypes.DATETIME) == (
+        "2022-01-05T10:00:00"
+    )
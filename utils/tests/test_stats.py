@@ -0,0 +1,190 @@
+from multiprocessing import current_process
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.test import override_settings
+
+from utils.common import ColumnTypes, float_r
+from utils.extraction import calculate_single_column_stats, get_stats_accumulator
+from utils.stats import calculate_columns_stats, to_column_array
+
+
+@override_settings(STATS_HISTOGRAM_BINS=2)
+def test_numeric_stats():
+    items = [4, None, 1.5, 10, -2, None, 7]
+    present = [x for x in items if x is not None]
+    assert calculate_single_column_stats(items, ColumnTypes.NUMBER) == {
+        "min": -2.0,
+        "max": 10.0,
+        "mean": float_r(np.mean(present)),
+        "median": 4.0,
+        "std_deviation": float_r(np.std(present)),
+        "total_count": 7,
+        "na_count": 2,
+        "is_approximate": False,
+        "histogram": [
+            {"start": -2.0, "end": 4.0, "count": 2},
+            {"start": 4.0, "end": 10.0, "count": 3},
+        ],
+    }
+    stats = calculate_single_column_stats(items[:4], ColumnTypes.INTEGER)
+    assert stats["median"] == 4.0, "Mean of the middle values"
+    stats = calculate_single_column_stats([None, None], ColumnTypes.FLOAT)
+    assert stats["min"] is None and stats["na_count"] == 2
+
+
+def test_string_stats():
+    items = ["Kathmandu", None, "Pokhara", "Kathmandu", "", None, None]
+    assert calculate_single_column_stats(items, ColumnTypes.STRING) == {
+        "total_count": 7,
+        "na_count": 3,
+        "unique_count": 3,
+        "max_length": 9,
+        "min_length": 0,
+        "is_approximate": False,
+        "top_values": [
+            {"value": "Kathmandu", "count": 2},
+            {"value": "", "count": 1},
+            {"value": "Pokhara", "count": 1},
+        ],
+    }
+
+
+def test_merged_stats_match_stats_of_whole_column():
+    rng = np.random.default_rng(0)
+    numbers = [None if x < 5 else float(x) for x in rng.integers(0, 100, 1000)]
+    strings = [None if x is None else f"value {x:.0f}" for x in numbers]
+    dates = [None if x is None else f"2022-01-{x % 28 + 1:02.0f}" for x in numbers]
+    for items, coltype in [
+        (numbers, ColumnTypes.FLOAT),
+        (strings, ColumnTypes.STRING),
+        (dates, ColumnTypes.DATE),
+    ]:
+        # Batches accumulated by different workers and merged in any order
+        accumulators = []
+        for start in range(0, len(items), 300):
+            accumulator = get_stats_accumulator(coltype)
+            accumulator.add(items[start:][:300], coltype)
+            accumulators.append(accumulator)
+        merged = get_stats_accumulator(coltype)
+        for accumulator in reversed(accumulators):
+            merged.merge(accumulator)
+        expected = calculate_single_column_stats(items, coltype)
+        assert merged.finalize() == expected
+        assert expected["na_count"] == numbers.count(None)
+
+
+def test_stats_are_approximated_after_threshold():
+    rng = np.random.default_rng(0)
+    numbers = rng.normal(size=20000).tolist()
+    strings = [f"value {x}" for x in rng.integers(0, 5000, 20000)]
+    exact = calculate_single_column_stats(numbers, ColumnTypes.FLOAT)
+    assert exact["is_approximate"] is False
+    approximate = calculate_single_column_stats(numbers, ColumnTypes.FLOAT, 1000)
+    assert approximate["is_approximate"] is True
+    assert approximate["mean"] == exact["mean"], "Only the median is estimated"
+    # Rank error of the median is within the configured error
+    rank = np.mean(np.array(numbers) < approximate["median"])
+    assert abs(rank - 0.5) < settings.STATS_QUANTILE_ERROR
+
+    exact = calculate_single_column_stats(strings, ColumnTypes.STRING)
+    approximate = calculate_single_column_stats(strings, ColumnTypes.STRING, 1000)
+    assert approximate["is_approximate"] is True
+    assert approximate["max_length"] == exact["max_length"]
+    error = abs(approximate["unique_count"] - exact["unique_count"])
+    assert error < 3 * settings.STATS_DISTINCT_COUNT_ERROR * exact["unique_count"]
+
+    # Merging an exact accumulator into an approximate one
+    accumulator = get_stats_accumulator(ColumnTypes.STRING, 1000)
+    accumulator.add(strings[:10000], ColumnTypes.STRING)
+    other = get_stats_accumulator(ColumnTypes.STRING, 1000)
+    other.add(strings[10000:][:500], ColumnTypes.STRING)
+    assert not other.is_approximate
+    merged = other.merge(accumulator).finalize()
+    assert merged["is_approximate"] is True
+    assert merged["total_count"] == 10500
+
+
+@override_settings(STATS_HISTOGRAM_BINS=4, STATS_TOP_VALUES=2)
+def test_histograms_and_top_values():
+    stats = calculate_single_column_stats([1, 2, 2, 3, 5, None], ColumnTypes.INTEGER)
+    assert [x["count"] for x in stats["histogram"]] == [1, 2, 1, 1]
+    assert stats["histogram"][0] == {"start": 1.0, "end": 2.0, "count": 1}
+    stats = calculate_single_column_stats([7, 7], ColumnTypes.INTEGER)
+    assert stats["histogram"] == [{"start": 7.0, "end": 7.0, "count": 2}]
+
+    dates = ["2022-01-01", "2022-01-02", "2022-01-05T00:00:00+00:00", None]
+    stats = calculate_single_column_stats(dates, ColumnTypes.DATE)
+    assert stats["histogram"] == [
+        {"start": "2022-01-01T00:00:00", "end": "2022-01-02T00:00:00", "count": 1},
+        {"start": "2022-01-02T00:00:00", "end": "2022-01-03T00:00:00", "count": 1},
+        {"start": "2022-01-03T00:00:00", "end": "2022-01-04T00:00:00", "count": 0},
+        {"start": "2022-01-04T00:00:00", "end": "2022-01-05T00:00:00", "count": 1},
+    ]
+
+    # The most frequent values stand out of the rest once approximate
+    rng = np.random.default_rng(0)
+    strings = [f"value {x}" for x in rng.integers(0, 5000, 20000)]
+    strings += ["frequent"] * 500 + ["common"] * 300
+    exact = calculate_single_column_stats(strings, ColumnTypes.STRING)
+    approximate = calculate_single_column_stats(strings, ColumnTypes.STRING, 1000)
+    assert [x["value"] for x in approximate["top_values"]] == ["frequent", "common"]
+    for exact_top, approximate_top in zip(
+        exact["top_values"], approximate["top_values"]
+    ):
+        error = exact_top["count"] - approximate_top["count"]
+        assert 0 <= error <= len(strings) / 1000
+
+
+def test_temporal_stats():
+    dates = ["2022-01-01", "2022-01-02", "2022-01-05", "2022-01-02", None, "1500-01-01"]
+    stats = calculate_single_column_stats(dates[:5], ColumnTypes.DATE)
+    assert {k: v for k, v in stats.items() if k != "histogram"} == {
+        "earliest": "2022-01-01T00:00:00",
+        "latest": "2022-01-05T00:00:00",
+        "range_days": 4.0,
+        "granularity": "day",
+        "gap_count": 2,
+        "unique_count": 3,
+        "total_count": 5,
+        "na_count": 1,
+        "is_approximate": False,
+    }
+    stats = calculate_single_column_stats(dates, ColumnTypes.DATE)
+    assert stats["earliest"] == "1500-01-01T00:00:00", "Beyond datetime64[ns]"
+
+    months = ["2021-11-01T00:00:00", "2022-03-01T00:00:00", "2022-01-01T00:00:00"]
+    stats = calculate_single_column_stats(months, ColumnTypes.DATETIME)
+    assert stats["granularity"] == "month"
+    assert stats["gap_count"] == 2
+    datetimes = ["2022-01-01T10:00:00+05:45", "2022-01-01T04:16:00", "invalid"]
+    stats = calculate_single_column_stats(datetimes, ColumnTypes.DATETIME)
+    assert stats["earliest"] == "2022-01-01T04:15:00", "Offsets are in UTC"
+    assert stats["granularity"] == "minute"
+    assert stats["na_count"] == 1
+    stats = calculate_single_column_stats([None], ColumnTypes.DATE)
+    assert stats["earliest"] is None and stats["unique_count"] == 0
+
+
+@override_settings(STATS_CONCURRENCY=2, STATS_PARALLEL_MIN_VALUES=0)
+def test_columns_stats_in_parallel():
+    rng = np.random.default_rng(0)
+    numbers = [None if x < 5 else float(x) for x in rng.integers(0, 100, 1000)]
+    columns = [
+        (numbers, ColumnTypes.FLOAT),
+        ([None if x is None else f"काठमाडौं {x}" for x in numbers], ColumnTypes.STRING),
+        ([None if x is None else "" for x in numbers], ColumnTypes.STRING),
+        (
+            [None if x is None else f"2022-01-{x % 28 + 1:02.0f}" for x in numbers],
+            ColumnTypes.DATE,
+        ),
+    ]
+    arrays = [(*to_column_array(items, coltype), coltype) for items, coltype in columns]
+    expected = [
+        calculate_single_column_stats(items, coltype) for items, coltype in columns
+    ]
+    assert calculate_columns_stats(arrays) == expected
+    # As in a celery prefork worker, which cannot have multiprocessing children
+    with mock.patch.dict(current_process()._config, {"daemon": True}):
+        assert calculate_columns_stats(arrays) == expected